@@ -0,0 +1,291 @@
+"""
+Détection d'anomalies SmartCadenas sur le flux des accès, hors du chemin des requêtes.
+
+Les commits ne font que déposer leurs logs dans une file (on_commit); la tâche planifiée
+score_anomalies les verse dans une fenêtre en colonnes (horodatage, source, agent, statut,
+événement, heure: array.array contigus) puis calcule en quelques passes groupées, sur toute la
+fenêtre (ANOMALY_WINDOW_SECONDS):
+- le taux d'échec par source (cadenas, IP), au-delà de la fenêtre courte du limiteur;
+- le nombre de sources d'un cadenas en échec sans aucun succès (devinette distribuée lente);
+- la régularité des intervalles entre tentatives d'une source (coefficient de variation: script);
+- les ouvertures réussies à une heure où le cadenas n'en voit presque jamais (écart horaire);
+- les agents dont les ouvertures ne sont pas suivies de fermetures (cycles incomplets).
+Chaque constat au-dessus de son seuil devient une alerte (create_security_alert), une fois par
+ANOMALY_ALERT_COOLDOWN et par (cadenas, type, sujet).
+
+Avec NumPy (requirements.txt), les passes sont vectorisées (bincount, lexsort) sur les colonnes lues
+sans copie; sans NumPy, le même calcul est fait en Python pur, plus lent mais identique (test_anomaly.py).
+Chaque processus ne voit que les commits qu'il a faits lui-même.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+try:
+    import numpy as np
+except ImportError:  # NumPy absent: moteur en Python pur, mêmes résultats
+    np = None  # type: ignore[assignment]
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_ENABLED = os.getenv('ANOMALY_ENABLED', '1') != '0'
+ANOMALY_WINDOW_SECONDS = int(os.getenv('ANOMALY_WINDOW_SECONDS', 7 * 24 * 3600))
+ANOMALY_MAX_EVENTS = int(os.getenv('ANOMALY_MAX_EVENTS', 1000000))
+ANOMALY_ALERT_COOLDOWN = int(os.getenv('ANOMALY_ALERT_COOLDOWN', 3600))
+# Taux d'échec: au moins ANOMALY_MIN_FAILURES échecs d'une source et au moins cette proportion de ses tentatives
+ANOMALY_FAILURE_RATE = float(os.getenv('ANOMALY_FAILURE_RATE', 0.5))
+ANOMALY_MIN_FAILURES = int(os.getenv('ANOMALY_MIN_FAILURES', 5))
+# Devinette distribuée: sources distinctes d'un cadenas avec des échecs et aucun succès
+ANOMALY_DISTRIBUTED_SOURCES = int(os.getenv('ANOMALY_DISTRIBUTED_SOURCES', 10))
+# Tentatives scriptées: ANOMALY_MIN_FAILURES échecs au moins, intervalles de variation relative inférieure à ce seuil
+ANOMALY_REGULARITY_CV = float(os.getenv('ANOMALY_REGULARITY_CV', 0.1))
+# Écart horaire: heure qui pèse moins de cette part des ouvertures réussies du cadenas (référence d'au moins BASELINE ouvertures)
+ANOMALY_RARE_HOUR_SHARE = float(os.getenv('ANOMALY_RARE_HOUR_SHARE', 0.02))
+ANOMALY_HOUR_BASELINE = int(os.getenv('ANOMALY_HOUR_BASELINE', 100))
+# Cycles incomplets: ouvertures réussies d'un agent non suivies de fermetures
+ANOMALY_OPEN_CYCLES = int(os.getenv('ANOMALY_OPEN_CYCLES', 3))
+# Au-delà, les identifiants de sources et d'agents sont renumérotés sur ceux encore présents dans la fenêtre
+ANOMALY_MAX_KEYS = 100000
+
+_STATUS = {"success": 0, "failed": 1, "warning": 2}
+_EVENT = {"door_open": 0, "door_close": 1}
+SUCCESS, FAILED = 0, 1
+DOOR_OPEN, DOOR_CLOSE = 0, 1
+
+# (type d'alerte, sévérité) de chaque constat
+ANOMALY_KINDS = {
+    "failure_rate": ("anomaly_failure_rate", "high"),
+    "distributed_guessing": ("anomaly_distributed_guessing", "critical"),
+    "scripted_attempts": ("anomaly_scripted_attempts", "high"),
+    "odd_hour": ("anomaly_odd_hour", "medium"),
+    "incomplete_cycles": ("anomaly_incomplete_cycles", "low"),
+}
+
+Finding = Dict[str, Any]
+# (type, message, sévérité, sujet): le sujet est la source de l'alerte (déduplication par type, source, sévérité)
+AlertSink = Callable[[str, List[Tuple[str, str, str, str]]], None]
+
+
+class _Interner:
+    """Identifiants entiers denses pour des clés (cadenas, valeur), avec le cadenas de chaque identifiant."""
+
+    def __init__(self) -> None:
+        self.ids: Dict[Tuple[int, str], int] = {}
+        self.keys: List[Tuple[int, str]] = []
+        self.lock_of = array('i')
+
+    def get(self, lock: int, value: str) -> int:
+        key = (lock, value)
+        ident = self.ids.get(key)
+        if ident is None:
+            ident = self.ids[key] = len(self.keys); self.keys.append(key); self.lock_of.append(lock)
+        return ident
+
+    def remap(self, column: array) -> None:
+        """Ne garde que les identifiants présents dans column, renumérotés dans l'ordre d'apparition."""
+        old_keys = self.keys; self.ids = {}; self.keys = []; self.lock_of = array('i')
+        mapping: Dict[int, int] = {}
+        for position, ident in enumerate(column):
+            new = mapping.get(ident)
+            if new is None: new = mapping[ident] = self.get(*old_keys[ident])
+            column[position] = new
+
+
+class AnomalyEngine:
+    """Fenêtre glissante des accès en colonnes et scores par source, par agent et par cadenas."""
+
+    def __init__(self, window_seconds: int = ANOMALY_WINDOW_SECONDS, max_events: int = ANOMALY_MAX_EVENTS,
+                 vectorized: Optional[bool] = None) -> None:
+        self.window_seconds = window_seconds
+        self.max_events = max_events
+        self.vectorized = np is not None if vectorized is None else vectorized and np is not None
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[str, Dict[str, Any]]] = []
+        self.dropped = 0
+        self._ts = array('d'); self._source = array('i'); self._agent = array('i')
+        self._status = array('b'); self._event = array('b'); self._hour = array('b')
+        self._locks: Dict[str, int] = {}; self._lock_names: List[str] = []
+        self._sources = _Interner(); self._agents = _Interner()
+        # Début des événements arrivés depuis le dernier passage (seuls à pouvoir lever un écart horaire)
+        self._new_from = 0
+        self._alerted: Dict[Tuple[str, str, str], float] = {}
+        self.runs = 0; self.last_duration = 0.0; self.last_run_at: Optional[str] = None
+        self.last_findings: List[Finding] = []
+
+    def on_commit(self, lock_id: str, _previous: Dict[str, Any], tx: Any) -> None:
+        """Abonné aux commits (chemin des requêtes): dépose les nouveaux logs, sans autre calcul."""
+        if not tx.new_logs: return
+        with self._lock:
+            self._pending.extend((lock_id, entry) for entry in tx.new_logs)
+            # File bornée si la tâche ne passe plus: les plus anciens sont abandonnés
+            if len(self._pending) > self.max_events:
+                excess = len(self._pending) - self.max_events; self.dropped += excess; del self._pending[:excess]
+
+    def ingest(self) -> int:
+        """Verse la file dans les colonnes de la fenêtre; retourne le nombre d'événements ajoutés."""
+        with self._lock: pending, self._pending = self._pending, []
+        for lock_id, entry in pending:
+            try: at = datetime.fromisoformat(entry.get("timestamp") or "")
+            except ValueError: continue
+            lock = self._locks.get(lock_id)
+            if lock is None: lock = self._locks[lock_id] = len(self._lock_names); self._lock_names.append(lock_id)
+            self._ts.append(at.timestamp()); self._hour.append(at.hour)
+            self._source.append(self._sources.get(lock, entry.get("ip_address") or "unknown"))
+            self._agent.append(self._agents.get(lock, entry.get("agent") or "unknown"))
+            self._status.append(_STATUS.get(entry.get("status"), 3)); self._event.append(_EVENT.get(entry.get("event"), 2))
+        return len(pending)
+
+    def _trim(self, now: float) -> None:
+        # Arrivée ~chronologique: la coupure par dichotomie suffit (un retardataire sort au passage suivant)
+        drop = max(bisect_left(self._ts, now - self.window_seconds), len(self._ts) - self.max_events)
+        if drop > 0:
+            for column in (self._ts, self._source, self._agent, self._status, self._event, self._hour): del column[:drop]
+            self._new_from = max(0, self._new_from - drop)
+        if len(self._sources.keys) > ANOMALY_MAX_KEYS: self._sources.remap(self._source)
+        if len(self._agents.keys) > ANOMALY_MAX_KEYS: self._agents.remap(self._agent)
+
+    def _statistics(self) -> Dict[str, List[float]]:
+        return self._statistics_numpy() if self.vectorized else self._statistics_python()
+
+    def _statistics_numpy(self) -> Dict[str, List[float]]:
+        """Toutes les statistiques en passes vectorisées sur les colonnes (vues sans copie)."""
+        ts = np.frombuffer(self._ts, dtype=np.float64); src = np.frombuffer(self._source, dtype=np.intc)
+        agent = np.frombuffer(self._agent, dtype=np.intc); status = np.frombuffer(self._status, dtype=np.int8)
+        event = np.frombuffer(self._event, dtype=np.int8); hour = np.frombuffer(self._hour, dtype=np.int8).astype(np.intp)
+        n_sources = len(self._sources.keys); n_agents = len(self._agents.keys); n_locks = len(self._lock_names)
+        failed = status == FAILED; succeeded = status == SUCCESS
+        stats = {"total": np.bincount(src, minlength=n_sources),
+                 "failed": np.bincount(src[failed], minlength=n_sources),
+                 "success": np.bincount(src[succeeded], minlength=n_sources)}
+        # Intervalles entre tentatives consécutives d'une même source: tri (source, horodatage) puis différences
+        order = np.lexsort((ts, src)); sorted_src = src[order]
+        same = sorted_src[1:] == sorted_src[:-1]
+        gaps = np.diff(ts[order])[same]; gap_src = sorted_src[1:][same]
+        count = np.bincount(gap_src, minlength=n_sources); divisor = np.maximum(count, 1)
+        mean = np.bincount(gap_src, weights=gaps, minlength=n_sources) / divisor
+        variance = np.maximum(np.bincount(gap_src, weights=gaps * gaps, minlength=n_sources) / divisor - mean * mean, 0.0)
+        stats.update(gaps=count, gap_mean=mean, gap_cv=np.sqrt(variance) / np.maximum(mean, 1e-9))
+        # Référence horaire des ouvertures réussies de chaque cadenas (cadenas x 24 heures)
+        opened = succeeded & (event == DOOR_OPEN)
+        event_lock = np.frombuffer(self._agents.lock_of, dtype=np.intc)[agent].astype(np.intp)
+        hours = np.bincount(event_lock[opened] * 24 + hour[opened], minlength=n_locks * 24).reshape(n_locks, 24)
+        baseline = hours.sum(axis=1)
+        rare = ((hours[event_lock, hour] < ANOMALY_RARE_HOUR_SHARE * baseline[event_lock])
+                & (baseline[event_lock] >= ANOMALY_HOUR_BASELINE))
+        odd = opened & rare; odd[:self._new_from] = False
+        stats.update(odd_hour=np.bincount(agent[odd], minlength=n_agents),
+                     opens=np.bincount(agent[opened], minlength=n_agents),
+                     closes=np.bincount(agent[event == DOOR_CLOSE], minlength=n_agents))
+        return {name: values.tolist() for name, values in stats.items()}
+
+    def _statistics_python(self) -> Dict[str, List[float]]:
+        """Mêmes statistiques que _statistics_numpy, en un parcours des colonnes."""
+        n_sources = len(self._sources.keys); n_agents = len(self._agents.keys)
+        total = [0] * n_sources; failed = [0] * n_sources; success = [0] * n_sources
+        opens = [0] * n_agents; closes = [0] * n_agents; odd_hour = [0] * n_agents
+        times: Dict[int, List[float]] = {}
+        hours: Dict[int, List[int]] = {}
+        agent_lock = self._agents.lock_of
+        for at, src, agent, status, event, hour in zip(self._ts, self._source, self._agent, self._status, self._event, self._hour):
+            total[src] += 1; times.setdefault(src, []).append(at)
+            if status == FAILED: failed[src] += 1
+            elif status == SUCCESS:
+                success[src] += 1
+                if event == DOOR_OPEN:
+                    opens[agent] += 1; hours.setdefault(agent_lock[agent], [0] * 24)[hour] += 1
+            if event == DOOR_CLOSE: closes[agent] += 1
+        for position in range(self._new_from, len(self._ts)):
+            agent = self._agent[position]
+            if self._status[position] != SUCCESS or self._event[position] != DOOR_OPEN: continue
+            reference = hours[agent_lock[agent]]; baseline = sum(reference)
+            if baseline >= ANOMALY_HOUR_BASELINE and reference[self._hour[position]] < ANOMALY_RARE_HOUR_SHARE * baseline:
+                odd_hour[agent] += 1
+        gaps = [0] * n_sources; gap_mean = [0.0] * n_sources; gap_cv = [0.0] * n_sources
+        for src, series in times.items():
+            if len(series) < 2: continue
+            series.sort()
+            deltas = [b - a for a, b in zip(series, series[1:])]
+            mean = sum(deltas) / len(deltas)
+            variance = max(sum(d * d for d in deltas) / len(deltas) - mean * mean, 0.0)
+            gaps[src] = len(deltas); gap_mean[src] = mean; gap_cv[src] = math.sqrt(variance) / max(mean, 1e-9)
+        return {"total": total, "failed": failed, "success": success, "gaps": gaps, "gap_mean": gap_mean, "gap_cv": gap_cv,
+                "odd_hour": odd_hour, "opens": opens, "closes": closes}
+
+    def score(self) -> List[Finding]:
+        """Constats au-dessus des seuils sur la fenêtre courante, triés par score décroissant."""
+        if not self._ts: return []
+        stats = self._statistics(); findings: List[Finding] = []
+        hours = self.window_seconds / 3600
+        failing_only: Dict[int, int] = {}
+
+        def add(kind: str, lock: int, subject: str, score: float, message: str) -> None:
+            findings.append({"lock_id": self._lock_names[lock], "kind": kind, "subject": subject,
+                             "score": round(score, 3), "message": message})
+
+        for src, (lock, ip_address) in enumerate(self._sources.keys):
+            total = stats["total"][src]; failed = stats["failed"][src]
+            if not total: continue
+            if failed and not stats["success"][src]: failing_only[lock] = failing_only.get(lock, 0) + 1
+            if failed < ANOMALY_MIN_FAILURES: continue
+            rate = failed / total
+            if rate >= ANOMALY_FAILURE_RATE:
+                add("failure_rate", lock, ip_address, rate,
+                    f"{failed} échecs sur {total} tentatives depuis {ip_address} ({rate:.0%}) en {hours:g} h")
+            if stats["gaps"][src] >= ANOMALY_MIN_FAILURES - 1 and stats["gap_cv"][src] <= ANOMALY_REGULARITY_CV:
+                add("scripted_attempts", lock, ip_address, 1 - stats["gap_cv"][src],
+                    f"Tentatives à intervalle régulier depuis {ip_address}: {total} essais, "
+                    f"{stats['gap_mean'][src]:.0f}s entre deux essais (variation {stats['gap_cv'][src]:.0%})")
+        for lock, sources in failing_only.items():
+            if sources >= ANOMALY_DISTRIBUTED_SOURCES:
+                add("distributed_guessing", lock, "*", sources / ANOMALY_DISTRIBUTED_SOURCES,
+                    f"{sources} sources distinctes en échec sans aucun succès en {hours:g} h (devinette distribuée)")
+        for agent, (lock, name) in enumerate(self._agents.keys):
+            if stats["odd_hour"][agent]:
+                add("odd_hour", lock, name, stats["odd_hour"][agent],
+                    f"Ouverture par {name} à une heure inhabituelle pour ce cadenas ({stats['odd_hour'][agent]} fois)")
+            unclosed = stats["opens"][agent] - stats["closes"][agent]
+            if unclosed >= ANOMALY_OPEN_CYCLES:
+                add("incomplete_cycles", lock, name, unclosed,
+                    f"{name}: {unclosed} ouvertures sans fermeture en {hours:g} h (cycles incomplets)")
+        findings.sort(key=lambda finding: finding["score"], reverse=True)
+        return findings
+
+    def run(self, raise_alerts: AlertSink, now: Optional[float] = None) -> int:
+        """Passage complet (tâche planifiée): ingestion, fenêtre, scores, alertes; retourne le nombre d'alertes levées."""
+        started = time.perf_counter(); now = time.time() if now is None else now
+        self.ingest(); self._trim(now)
+        findings = self.score()
+        self._new_from = len(self._ts)
+        by_lock: Dict[str, List[Tuple[str, str, str, str]]] = {}
+        for finding in findings:
+            key = (finding["lock_id"], finding["kind"], finding["subject"])
+            finding["alerted"] = now - self._alerted.get(key, -math.inf) >= ANOMALY_ALERT_COOLDOWN
+            if not finding["alerted"]: continue
+            self._alerted[key] = now
+            alert_type, severity = ANOMALY_KINDS[finding["kind"]]
+            by_lock.setdefault(finding["lock_id"], []).append((alert_type, finding["message"], severity, finding["subject"]))
+            metrics.inc("smartcadenas_anomalies_total", (("kind", finding["kind"]),))
+        self._alerted = {key: at for key, at in self._alerted.items() if now - at < ANOMALY_ALERT_COOLDOWN}
+        raised = 0
+        for lock_id, alerts in by_lock.items():
+            try: raise_alerts(lock_id, alerts); raised += len(alerts)
+            except Exception as e: logger.error("Erreur alertes d'anomalies (%s): %s", lock_id, e)
+        self.runs += 1; self.last_duration = time.perf_counter() - started
+        self.last_run_at = datetime.fromtimestamp(now).isoformat(); self.last_findings = findings
+        return raised
+
+    def stats(self, lock_id: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock: pending = len(self._pending)
+        return {"engine": "numpy" if self.vectorized else "python", "window_seconds": self.window_seconds,
+                "window_events": len(self._ts), "pending": pending, "dropped": self.dropped, "runs": self.runs,
+                "last_run_at": self.last_run_at, "last_duration_ms": round(self.last_duration * 1000, 3),
+                "findings": [finding for finding in self.last_findings if lock_id is None or finding["lock_id"] == lock_id]}
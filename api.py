@@ -5,29 +5,47 @@ Ce module fournit une API Flask pour la gestion des codes d'accès,
 des logs de sécurité et des alertes pour un système de cadenas intelligent.
 """
 
-import json
+import atexit
+import hmac
 import logging
+import math
 import os
 import re
 import secrets
 import string
+import struct
+import time
 from datetime import datetime, timedelta
-from typing import Any, Dict, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
+import click
 from dotenv import load_dotenv
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify
 from flask_cors import CORS
 from flask_restful import Api, Resource
 
+from anomaly import ANOMALY_ENABLED, AnomalyEngine
+from events import EventBroker
+from export import EXPORT_FORMATS, export_chunks, gzip_chunks
+from limiter import SlidingWindowLimiter
+from logconfig import dropped_records, setup_logging
+from metrics import metrics
+from notify import NOTIFY_SYSLOG, NOTIFY_WEBHOOKS, Notifier, build_targets
+from offline import (OFFLINE_ALGORITHM, OFFLINE_MAX_WINDOWS, OFFLINE_SKEW_WINDOWS, code_parameters, code_record, find_code,
+                     mark_window, new_secret, upcoming_windows, window_of)
+from rollups import GRANULARITIES, summarize
+from scheduler import SCHEDULER_ENABLED, SCHEDULER_LOCK_FILE, Scheduler
+from storage import (DATA_FILE, DEFAULT_CODE_LENGTH, DEFAULT_CODE_VALIDITY, DEFAULT_LOCK_ID, DEFAULT_MAX_ATTEMPTS,
+                     LOG_FILTERS, MAX_ALERTS, SQLITE_FILE, STORAGE_BACKEND, CursorKey, StateTransaction, StorageError, add_commit_listener,
+                     decode_cursor, encode_cursor, fleet_alerts_before, fleet_logs_before, get_default_data,
+                     get_storage, is_valid_lock_id, iter_records, list_lock_ids, lock_exists, logs_in_range,
+                     migrate_json_to_sqlite, rebuild_rollups, reconcile_aggregates)
+
 # Charger les variables d'environnement
 load_dotenv()
 
-# Configuration du logger
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.FileHandler('app.log'), logging.StreamHandler()]
-)
+# Configuration du logger: file en mémoire, écriture et rotation de app.log dans un thread dédié
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
@@ -38,118 +56,394 @@ api = Api(app)
 
 app.jinja_env.globals.update(max=max, min=min)
 
-DATA_FILE = 'codes.json'
-MAX_LOGS = int(os.getenv('MAX_LOGS', 1000))
-MAX_ALERTS = int(os.getenv('MAX_ALERTS', 100))
-DEFAULT_CODE_LENGTH = 4
-DEFAULT_CODE_VALIDITY = 300
-DEFAULT_MAX_ATTEMPTS = 3
-
-
-def get_default_data() -> Dict[str, Any]:
-    return {
-        "settings": {
-            "code_length": int(os.getenv('CODE_LENGTH', DEFAULT_CODE_LENGTH)),
-            "code_validity": int(os.getenv('CODE_VALIDITY', DEFAULT_CODE_VALIDITY)),
-            "max_attempts": int(os.getenv('MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
-        },
-        "current_code": {}, "access_logs": [], "alerts": [],
-        "agents": {"default": {"name": "Technicien", "permissions": ["basic_access"]}},
-        "failed_attempts": {"count": 0, "last_reset": datetime.now().isoformat(), "attempts": []}
-    }
+# Les événements persistés (tous backends, tous cadenas) sont poussés aux abonnés SSE
+broker = EventBroker()
+add_commit_listener(broker.on_commit)
+
+# Échecs récents par source (IP, agent) de chaque cadenas: en mémoire, consulté avant tout accès au stockage
+# Par processus: avec N workers gunicorn, une source a jusqu'à N × max_attempts essais (voir limiter.py)
+access_limiter = SlidingWindowLimiter()
+
+def record_commit_metrics(lock_id: str, _previous: Dict[str, Any], tx: StateTransaction) -> None:
+    for entry in tx.new_logs: metrics.inc("smartcadenas_logs_appended_total", (("lock_id", lock_id), ("status", entry.get("status") or "unknown")))
+    for alert in tx.new_alerts: metrics.inc("smartcadenas_alerts_created_total", (("lock_id", lock_id), ("severity", alert.get("severity") or "unknown")))
+    for alert in tx.coalesced: metrics.inc("smartcadenas_alerts_coalesced_total", (("lock_id", lock_id), ("severity", alert.get("severity") or "unknown")))
+
+add_commit_listener(record_commit_metrics)
+
+# Analyse des accès hors du chemin des requêtes: le commit ne fait que déposer ses logs, la tâche score_anomalies calcule
+anomaly_engine = AnomalyEngine()
+if ANOMALY_ENABLED: add_commit_listener(anomaly_engine.on_commit)
+
+# Alertes graves poussées vers les webhooks et syslog: le commit ne fait que les déposer dans la file d'envoi
+notifier = Notifier(build_targets(NOTIFY_WEBHOOKS, NOTIFY_SYSLOG))
+if notifier.enabled: add_commit_listener(notifier.on_commit)
+
+# Chaque accès via le proxy `request` coûte ~1-2 µs: les hooks déréférencent l'objet une seule fois
+@app.before_request
+def start_request_timer() -> None:
+    request._get_current_object().environ['smartcadenas.started'] = time.perf_counter()  # pylint: disable=protected-access
+
+@app.after_request
+def record_request_metrics(response: Response) -> Response:
+    current = request._get_current_object()  # pylint: disable=protected-access
+    started = current.environ.get('smartcadenas.started')
+    if started is not None:
+        metrics.observe("smartcadenas_http_request_duration_seconds",
+                        (("endpoint", current.endpoint or "unmatched"), ("method", current.method), ("status", str(response.status_code))),
+                        time.perf_counter() - started)
+    return response
+
+MAX_BATCH_EVENTS = int(os.getenv('MAX_BATCH_EVENTS', 100))
+CODE_ROTATION_INTERVAL = int(os.getenv('CODE_ROTATION_INTERVAL', 0))
+EXPIRY_SWEEP_INTERVAL = int(os.getenv('EXPIRY_SWEEP_INTERVAL', 5))
+FAILURE_PRUNE_INTERVAL = int(os.getenv('FAILURE_PRUNE_INTERVAL', 60))
+STORAGE_COMPACT_INTERVAL = int(os.getenv('STORAGE_COMPACT_INTERVAL', 3600))
+AGGREGATES_REFRESH_INTERVAL = int(os.getenv('AGGREGATES_REFRESH_INTERVAL', 600))
+ANOMALY_SCORE_INTERVAL = int(os.getenv('ANOMALY_SCORE_INTERVAL', 60))
+MAX_BULK_RESOLVE = 1000
+EVENT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_.:-]{1,64}$')
+# Réponses compactes de /api/code/verify: un octet de statut, puis les secondes de validité restantes
+VERIFY_STATUSES = {"valid": 0, "code_incorrect": 1, "code_expired": 2, "code_already_used": 3,
+                   "no_code_generated": 4, "too_many_attempts": 5}
+VERIFY_MIMETYPES = ['application/json', 'text/plain', 'application/octet-stream']
+VERIFY_STRUCT = struct.Struct('!BH')
+VERIFY_MAX_REMAINING = 65535
+
 
 def sanitize_input(input_str: Union[str, Any]) -> str:
     if not isinstance(input_str, str): return ""
     return re.sub(r'[<>\'";`]', '', input_str)
 
-def load_data() -> Dict[str, Any]:
-    if not os.path.exists(DATA_FILE):
-        default_data = get_default_data()
-        with open(DATA_FILE, 'w', encoding='utf-8') as file:
-            json.dump(default_data, file, indent=2, ensure_ascii=False)
-        return default_data
-    try:
-        with open(DATA_FILE, 'r', encoding='utf-8') as file: data = json.load(file)
-        if not isinstance(data, dict): raise ValueError("Format JSON invalide")
-        default_data_structure = get_default_data()
-        for key, value in default_data_structure.items():
-            if key not in data: data[key] = value
-            elif key == "settings" and isinstance(value, dict):
-                for sub_key, sub_value in value.items():
-                    if sub_key not in data[key]: data[key][sub_key] = sub_value
-        return data
-    except (json.JSONDecodeError, ValueError) as e:
-        logger.error(f"Erreur chargement données: {str(e)}")
-        backup_file = f"{DATA_FILE}.bak.{datetime.now().strftime('%Y%m%d%H%M%S')}"
-        current_data_content = {}
-        if os.path.exists(DATA_FILE):
-            try:
-                with open(DATA_FILE, 'r', encoding='utf-8') as f_read: current_data_content = json.load(f_read)
-            except: pass # pylint: disable=bare-except
-        try:
-            with open(backup_file, 'w', encoding='utf-8') as file_backup:
-                json.dump(current_data_content if current_data_content else {"error_loading": True}, file_backup, indent=2, ensure_ascii=False)
-            logger.info(f"Salvataggio creato: {backup_file}")
-        except Exception as backup_error: logger.error(f"Errore salvataggio: {str(backup_error)}")
-        default_data_on_error = get_default_data()
-        with open(DATA_FILE, 'w', encoding='utf-8') as file_reset:
-            json.dump(default_data_on_error, file_reset, indent=2, ensure_ascii=False)
-        return default_data_on_error
-
-def save_data(data: Dict[str, Any]) -> bool:
-    try:
-        for collection in ["access_logs", "alerts"]:
-            if collection in data and len(data[collection]) > (MAX_LOGS if collection == "access_logs" else MAX_ALERTS):
-                data[collection] = sorted(data[collection], key=lambda x: x.get('timestamp', ''), reverse=True)[:MAX_LOGS if collection == "access_logs" else MAX_ALERTS]
-        with open(DATA_FILE, 'w', encoding='utf-8') as file:
-            json.dump(data, file, indent=2, ensure_ascii=False)
-        return True
-    except Exception as e:
-        logger.error(f"Erreur sauvegarde données: {str(e)}")
-        return False
-
 def generate_code(length: int = DEFAULT_CODE_LENGTH) -> str:
     if not isinstance(length, int) or not 4 <= length <= 10: length = DEFAULT_CODE_LENGTH
     return ''.join(secrets.choice(string.digits) for _ in range(length))
 
-def is_code_valid(code_data: Dict[str, Any]) -> bool:
-    if not code_data or not code_data.get("valid_until"): return False
-    try: return datetime.now() < datetime.fromisoformat(code_data["valid_until"])
+def parse_timestamp_param(value: str) -> str:
+    # Les horodatages stockés sont en heure locale sans fuseau: on ramène le paramètre au même format
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None: parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+def keyset_from_request(fleet: bool = False) -> Optional[CursorKey]:
+    """Clé de pagination par curseur (?cursor=... opaque ou ?before=<ISO 8601>), ou None en mode page."""
+    cursor = request.args.get('cursor'); before = request.args.get('before')
+    if cursor: return decode_cursor(cursor, fleet=fleet)
+    if before: return (parse_timestamp_param(before), "", 0) if fleet else (parse_timestamp_param(before), 0)
+    return None
+
+def lock_storage(lock_id: str, create: bool = False) -> Tuple[Any, Optional[Tuple[Dict[str, Any], int]]]:
+    """Backend du cadenas lock_id, ou (None, réponse d'erreur) si l'identifiant est invalide ou inconnu.
+
+    Seule la génération d'un code (create=True) enregistre un nouveau cadenas.
+    """
+    if not is_valid_lock_id(lock_id): return None, ({"error": "Identifiant de cadenas invalide"}, 400)
+    if not create and not lock_exists(lock_id): return None, ({"error": "Cadenas inconnu"}, 404)
+    return get_storage(lock_id), None
+
+def state_etag(lock_id: str, version: int, *qualifiers: Any) -> str:
+    return ".".join([lock_id, str(version), *map(str, qualifiers)])
+
+def not_modified(etag: str) -> Optional[Response]:
+    """Réponse 304 si le client a déjà cette version (If-None-Match), sans construire le corps."""
+    if not request.if_none_match.contains_weak(etag): return None
+    response = Response(status=304); response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def etag_headers(etag: str) -> Dict[str, str]:
+    # Étiquette faible: remaining_time varie d'un appel à l'autre sans que l'état change
+    return {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'}
+
+def is_valid_event_id(event_id: Any) -> bool:
+    return isinstance(event_id, str) and bool(EVENT_ID_PATTERN.match(event_id))
+
+def is_code_valid(code_data: Dict[str, Any], at: Optional[datetime] = None) -> bool:
+    if not code_data: return False
+    # O(1) sur le chemin des requêtes: drapeau posé une fois par le planificateur, échéance en heure Unix.
+    # Le drapeau ne vaut que pour maintenant: un événement rejoué (at) peut précéder l'expiration
+    if at is None and code_data.get("expired"): return False
+    expires_at = code_data.get("expires_at")
+    if expires_at is not None: return (at.timestamp() if at is not None else time.time()) < expires_at
+    if not code_data.get("valid_until"): return False
+    try: return (at or datetime.now()) < datetime.fromisoformat(code_data["valid_until"])
     except ValueError: return False
 
+def issue_code(data: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Nouveau code aléatoire dans data["current_code"] (état d'une transaction en cours)."""
+    settings = data.get("settings", {})
+    code_length = max(4, min(10, settings.get("code_length", DEFAULT_CODE_LENGTH)))
+    code_validity = max(60, settings.get("code_validity", DEFAULT_CODE_VALIDITY))
+    generated_at = now or datetime.now(); valid_until = generated_at + timedelta(seconds=code_validity)
+    data["current_code"] = {"value": generate_code(code_length), "generated_at": generated_at.isoformat(),
+                            "valid_until": valid_until.isoformat(), "expires_at": valid_until.timestamp(),
+                            "used": False, "used_for_entry": False}
+    return data["current_code"]
+
+def is_offline_mode(data: Dict[str, Any]) -> bool:
+    return data.get("settings", {}).get("code_mode") == "offline" and bool(data.get("offline_codes", {}).get("secret"))
+
+def current_code_view(data: Dict[str, Any], at: Optional[datetime] = None) -> Dict[str, Any]:
+    """Code en vigueur: current_code, ou en mode hors ligne le code dérivé de la fenêtre courante."""
+    if not is_offline_mode(data): return data.get("current_code", {})
+    settings = data.get("settings", {})
+    return code_record(data["offline_codes"], window_of(at or datetime.now(), code_parameters(settings)[1]), settings)
+
+def matching_code(data: Dict[str, Any], code: str, at: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Code (format current_code) auquel `code` correspond, comparé à temps constant; None s'il ne correspond à rien."""
+    if is_offline_mode(data): return find_code(data["offline_codes"], code, at or datetime.now(), data.get("settings", {}))
+    current_code = data.get("current_code", {})
+    if current_code.get("value") and hmac.compare_digest(code.encode(), current_code["value"].encode()): return current_code
+    return None
+
+def mark_code(storage: StateTransaction, code_data: Dict[str, Any], at: datetime, **flags: bool) -> None:
+    # En mode hors ligne l'usage unique est tenu par fenêtre, current_code n'est pas utilisé
+    if "window" in code_data: mark_window(storage["offline_codes"], code_data["window"], flags, at)
+    else: storage["current_code"].update(flags)
+
 @app.route('/api/state')
-def get_state():
-    data = load_data()
+@app.route('/api/locks/<string:lock_id>/state')
+def get_state(lock_id: str = DEFAULT_LOCK_ID):
+    store, error = lock_storage(lock_id)
+    if error: return jsonify(error[0]), error[1]
+    data = store.read_state(); current_code = current_code_view(data)
+    # En mode hors ligne le code change à chaque fenêtre sans commit: la fenêtre fait partie de l'étiquette
+    etag = state_etag(lock_id, data.get("version", 0), *([current_code["window"]] if "window" in current_code else []))
+    cached = not_modified(etag)
+    if cached: return cached
+    unresolved_alerts, _ = store.page_alerts(0, MAX_ALERTS)
     return jsonify({
-        'current_code': data.get('current_code'),
-        'access_logs': data.get('access_logs', [])[-10:],
-        'alerts': [a for a in data.get('alerts', []) if not a.get('resolved')]
-    })
+        'current_code': current_code,
+        'access_logs': store.recent_logs(10)[::-1],
+        'alerts': unresolved_alerts[::-1],
+        'aggregates': data.get('aggregates', {})
+    }), 200, etag_headers(etag)
+
+@app.route('/api/aggregates')
+@app.route('/api/locks/<string:lock_id>/aggregates')
+def get_aggregates(lock_id: str = DEFAULT_LOCK_ID):
+    """Compteurs par statut, raisons d'échec récentes et alertes non résolues, précalculés à l'écriture."""
+    store, error = lock_storage(lock_id)
+    if error: return jsonify(error[0]), error[1]
+    data = store.read_state(); etag = state_etag(lock_id, data.get("version", 0))
+    cached = not_modified(etag)
+    if cached: return cached
+    return jsonify(dict(data.get("aggregates", {}), lock_id=lock_id, version=data.get("version", 0))), 200, etag_headers(etag)
+
+@app.route('/api/stats')
+@app.route('/api/locks/<string:lock_id>/stats')
+def get_stats(lock_id: str = DEFAULT_LOCK_ID):
+    """Séries par heure ou par jour (accès, échecs par raison, alertes par sévérité, IP distinctes), précalculées à l'écriture."""
+    store, error = lock_storage(lock_id)
+    if error: return jsonify(error[0]), error[1]
+    granularity = request.args.get('granularity', 'hour')
+    if granularity not in GRANULARITIES: return jsonify({"error": f"Granularité inconnue (granularités: {', '.join(GRANULARITIES)})"}), 400
+    try: since, until = (parse_timestamp_param(request.args[name]) if request.args.get(name) else None for name in ('since', 'until'))
+    except ValueError: return jsonify({"error": "Date invalide"}), 400
+    etag = state_etag(lock_id, store.version(), granularity, since or "", until or "")
+    cached = not_modified(etag)
+    if cached: return cached
+    stats = summarize(granularity, store.rollups(granularity, since, until))
+    return jsonify(dict(stats, lock_id=lock_id, since=since, until=until)), 200, etag_headers(etag)
+
+@app.route('/api/anomalies')
+@app.route('/api/locks/<string:lock_id>/anomalies')
+def get_anomalies(lock_id: Optional[str] = None):
+    """État du moteur d'anomalies et constats du dernier passage (flotte, ou un cadenas)."""
+    if lock_id is not None:
+        _, error = lock_storage(lock_id)
+        if error: return jsonify(error[0]), error[1]
+    return jsonify(dict(anomaly_engine.stats(lock_id), enabled=ANOMALY_ENABLED, interval=ANOMALY_SCORE_INTERVAL))
 
-def create_security_alert(storage: Dict[str, Any], alert_type: str, message: str, severity: str = "medium") -> Dict[str, Any]:
+@app.route('/api/notifications')
+def get_notifications():
+    """État des notifications sortantes: destinations, files, disjoncteurs."""
+    return jsonify(notifier.stats())
+
+@app.route('/api/version')
+@app.route('/api/locks/<string:lock_id>/version')
+def get_version(lock_id: str = DEFAULT_LOCK_ID):
+    """Sonde de taille constante: l'appareil ne relit /api/code que si la version a changé."""
+    store, error = lock_storage(lock_id)
+    if error: return jsonify(error[0]), error[1]
+    version = store.version(); etag = state_etag(lock_id, version)
+    return not_modified(etag) or (jsonify({"version": version}), 200, etag_headers(etag))
+
+@app.route('/api/code/verify', methods=['POST'])
+@app.route('/api/locks/<string:lock_id>/code/verify', methods=['POST'])
+def verify_code(lock_id: str = DEFAULT_LOCK_ID):
+    """Vérifie un code côté serveur (comparaison à temps constant): la valeur du code ne quitte jamais le serveur.
+
+    Corps: {"code": "1234", "agent": "..."} en JSON, ou le code seul en text/plain (agent en ?agent=).
+    Réponse selon Accept: JSON, text/plain "S RRRRR\n" (8 octets) ou application/octet-stream (3 octets:
+    statut, puis secondes restantes sur 16 bits big-endian). Ne consomme pas le code: l'ouverture reste
+    journalisée par POST /api/access.
+    """
+    payload = request.get_json(silent=True) if request.is_json else None
+    if isinstance(payload, dict): code, agent = payload.get('code'), payload.get('agent', 'unknown')
+    else: code, agent = request.get_data(as_text=True).strip(), request.args.get('agent', 'unknown')
+    agent = sanitize_input(agent)
+    if not isinstance(code, str) or not code.isdigit() or len(code) > 10:
+        return jsonify({"error": "Format de code invalide"}), 400
+    retry_after = access_limiter.retry_after(limiter_keys(lock_id, agent))
+    if retry_after:
+        seconds = max(1, math.ceil(retry_after))
+        return verify_response("too_many_attempts", seconds, 429, {"Retry-After": str(seconds)})
+    store, error = lock_storage(lock_id)
+    if error: return jsonify(error[0]), error[1]
+    data = store.read_state()
+    if not current_code_view(data).get("value"): return verify_response("no_code_generated")
+    # compare_digest: la durée ne dépend pas de la position du premier chiffre erroné
+    current_code = matching_code(data, code)
+    if current_code is None: status = "code_incorrect"
+    elif not is_code_valid(current_code): status = "code_expired"
+    elif current_code.get("used", False) or current_code.get("used_for_entry", False): status = "code_already_used"
+    else:
+        remaining = int((datetime.fromisoformat(current_code["valid_until"]) - datetime.now()).total_seconds())
+        return verify_response("valid", max(0, remaining))
+    if status in ("code_incorrect", "code_expired"):
+        # Même décompte que door_open: sans lui, /verify permettrait de tester les codes sans limite
+        try:
+            with store.transaction() as storage: increment_failed_attempt(storage, agent)
+        except StorageError: logger.error("API Verify: Échec sauvegarde de la tentative échouée.")
+    return verify_response(status)
+
+def verify_response(status: str, remaining: int = 0, http_status: int = 200, headers: Optional[Dict[str, str]] = None) -> Response:
+    """Réponse de /code/verify au format négocié par Accept (JSON par défaut)."""
+    mimetype = request.accept_mimetypes.best_match(VERIFY_MIMETYPES, VERIFY_MIMETYPES[0])
+    status_byte = VERIFY_STATUSES[status]; remaining = min(remaining, VERIFY_MAX_REMAINING)
+    headers = dict(headers or {}, **{'Cache-Control': 'no-store', 'Vary': 'Accept'})
+    if mimetype == 'application/octet-stream': body: Union[str, bytes] = VERIFY_STRUCT.pack(status_byte, remaining)
+    elif mimetype == 'text/plain': body = f"{status_byte} {remaining:05d}\n"
+    else: return jsonify({"valid": status == "valid", "status": status, "remaining_time": remaining}), http_status, headers
+    return Response(body, status=http_status, mimetype=mimetype, headers=headers)
+
+@app.route('/api/events')
+@app.route('/api/locks/<string:lock_id>/events')
+def event_stream(lock_id: str = DEFAULT_LOCK_ID):
+    """Flux SSE: code_generated, code_expired, access_logged, alert_created, alert_resolved (resync: tout recharger)."""
+    _, error = lock_storage(lock_id)
+    if error: return jsonify(error[0]), error[1]
+    return _sse_response(lock_id)
+
+@app.route('/api/fleet/events')
+def fleet_event_stream():
+    return _sse_response(None)
+
+def _sse_response(lock_id: Optional[str]):
+    subscriber = broker.subscribe(lock_id)
+    if subscriber is None: return jsonify({"error": "Trop de clients connectés au flux d'événements"}), 503
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    response = Response(broker.stream(subscriber, last_event_id), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Un client parti avant le premier envoi ne passe jamais dans le générateur: désabonnement à la fermeture
+    response.call_on_close(lambda: broker.unsubscribe(subscriber))
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Format texte Prometheus: séries des requêtes et du stockage, plus l'état courant mesuré à la lecture."""
+    held_logs, held_alerts, unresolved, cache_hits, cache_misses, hit_ratio = [], [], [], [], [], []
+    for lock_id in list_lock_ids():
+        store = get_storage(lock_id); labels = (("lock_id", lock_id),)
+        held_logs.append((labels, store.page_logs(0, 0)[1]))
+        held_alerts.append((labels, store.page_alerts(0, 0, include_resolved=True)[1]))
+        unresolved.append((labels, store.read_state().get("aggregates", {}).get("unresolved_alerts", 0)))
+        if getattr(store, "cache_enabled", False):
+            cache = store.cache.stats()
+            cache_hits.append((labels, cache["hits"])); cache_misses.append((labels, cache["misses"])); hit_ratio.append((labels, cache["hit_ratio"]))
+    limiter = access_limiter.stats()
+    collected = [
+        ("smartcadenas_logs_held", "gauge", "Logs d'accès conservés à chaud par cadenas", held_logs),
+        ("smartcadenas_alerts_held", "gauge", "Alertes conservées à chaud par cadenas", held_alerts),
+        ("smartcadenas_alerts_unresolved", "gauge", "Alertes non résolues par cadenas", unresolved),
+        ("smartcadenas_cache_hits_total", "counter", "Lectures servies par le cache d'état", cache_hits),
+        ("smartcadenas_cache_misses_total", "counter", "Lectures du fichier faute de cache valide", cache_misses),
+        ("smartcadenas_cache_hit_ratio", "gauge", "Part des lectures servies par le cache d'état", hit_ratio),
+        ("smartcadenas_failed_attempts_window", "gauge", "Échecs d'accès dans la fenêtre glissante du limiteur", [((), limiter["window_failures"])]),
+        ("smartcadenas_limiter_tracked_sources", "gauge", "Sources (IP, agent) suivies par le limiteur", [((), limiter["tracked_sources"])]),
+        ("smartcadenas_limiter_locked_sources", "gauge", "Sources actuellement bloquées", [((), limiter["locked_sources"])]),
+        ("smartcadenas_limiter_lockouts_total", "counter", "Blocages déclenchés par le limiteur", [((), limiter["lockouts"])]),
+        ("smartcadenas_limiter_rejected_total", "counter", "Requêtes refusées (429) pendant un blocage", [((), limiter["rejected"])]),
+        ("smartcadenas_sse_subscribers", "gauge", "Clients abonnés au flux d'événements", [((), broker.stats()["subscribers"])]),
+        ("smartcadenas_notifications_pending", "gauge", "Notifications en attente d'envoi par destination (mémoire et spool)",
+         [((("target", target["target"]),), target["pending"]) for target in notifier.stats()["targets"]]),
+        ("smartcadenas_log_records_dropped_total", "counter", "Lignes de log abandonnées (file de journalisation pleine)", [((), dropped_records())]),
+    ]
+    return Response(metrics.render(collected), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/logs/export')
+@app.route('/api/locks/<string:lock_id>/logs/export')
+def export_logs(lock_id: str = DEFAULT_LOCK_ID):
+    """Historique complet des accès (archive comprise) en NDJSON ou CSV, filtres since/until et LOG_FILTERS."""
+    return _export_response(lock_id, "access_logs", LOG_FILTERS)
+
+@app.route('/api/alerts/export')
+@app.route('/api/locks/<string:lock_id>/alerts/export')
+def export_alerts(lock_id: str = DEFAULT_LOCK_ID):
+    """Historique complet des alertes (résolues comprises), filtres since/until/type/severity."""
+    return _export_response(lock_id, "alerts", ("type", "severity"))
+
+def _export_response(lock_id: str, collection: str, filter_fields: Tuple[str, ...]):
+    store, error = lock_storage(lock_id)
+    if error: return jsonify(error[0]), error[1]
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in EXPORT_FORMATS: return jsonify({"error": f"Format inconnu (formats: {', '.join(EXPORT_FORMATS)})"}), 400
+    try: since, until = (parse_timestamp_param(request.args[name]) if request.args.get(name) else None for name in ('since', 'until'))
+    except ValueError: return jsonify({"error": "Date invalide"}), 400
+    filters = {field: request.args[field] for field in filter_fields if request.args.get(field)}
+    mimetype, extension = EXPORT_FORMATS[export_format]
+    # Le générateur lit le stockage au fil de l'envoi: la mémoire ne dépend pas de la taille de l'historique
+    body = export_chunks(iter_records(store, collection, since, until, filters), collection, export_format)
+    headers = {'Content-Disposition': f'attachment; filename="{lock_id}-{collection}.{extension}"', 'Cache-Control': 'no-store'}
+    if 'gzip' in request.accept_encodings:
+        body = gzip_chunks(body); headers.update({'Content-Encoding': 'gzip', 'Vary': 'Accept-Encoding'})
+    logger.debug("API Export: %s (%s) du cadenas %s.", collection, export_format, lock_id)
+    return Response(body, mimetype=mimetype, headers=headers)
+
+def create_security_alert(storage: StateTransaction, alert_type: str, message: str, severity: str = "medium",
+                          source: Optional[str] = None) -> Dict[str, Any]:
     valid_severities = ["low", "medium", "high", "critical"]
     severity = severity if severity in valid_severities else "medium"
+    timestamp = datetime.now().isoformat()
     alert = {"type": sanitize_input(alert_type), "message": sanitize_input(message), "severity": severity,
-             "timestamp": datetime.now().isoformat(), "resolved": False, "_index": len(storage.get("alerts", []))}
-    storage.setdefault("alerts", []).append(alert)
-    return alert
+             "source": sanitize_input(source) if source is not None else None, "timestamp": timestamp, "resolved": False,
+             "count": 1, "first_seen": timestamp, "last_seen": timestamp}
+    # L'identifiant "_index" est attribué par le backend au commit de la transaction; une répétition de (type, source,
+    # sévérité) y est repliée sur l'alerte ouverte (alert["_index"] et alert["count"] sont alors ceux de celle-ci)
+    return storage.add_alert(alert)
+
+def limiter_keys(lock_id: str, agent: str) -> List[Tuple[str, str, str]]:
+    keys = [(lock_id, "ip", request.remote_addr or "unknown")]
+    # Sans agent déclaré, la clé serait commune à tous les clients: seule l'IP compte alors
+    if agent and agent != "unknown": keys.append((lock_id, "agent", agent))
+    return keys
 
-def increment_failed_attempt(storage: Dict[str, Any]) -> int:
-    if "failed_attempts" not in storage:
-        storage["failed_attempts"] = {"count": 0, "last_reset": datetime.now().isoformat(), "attempts": []}
+def too_many_attempts(retry_after: float) -> Tuple[Dict[str, Any], int, Dict[str, str]]:
+    seconds = max(1, math.ceil(retry_after))
+    return {"error": "Trop de tentatives échouées, source temporairement bloquée", "retry_after": seconds}, 429, {"Retry-After": str(seconds)}
+
+def increment_failed_attempt(storage: StateTransaction, agent: str = "unknown", occurred_at: Optional[datetime] = None) -> int:
     current_time = datetime.now()
+    # Un échec rejoué hors de la fenêtre (lot tamponné ancien) est journalisé mais ne compte plus
+    if occurred_at is not None and (current_time - occurred_at).total_seconds() > access_limiter.window: return 0
     ip_address = request.remote_addr if request else "unknown"
     user_agent = request.headers.get('User-Agent', 'unknown') if request else "unknown"
-    storage["failed_attempts"]["count"] += 1
-    storage["failed_attempts"]["attempts"].append({"timestamp": current_time.isoformat(), "ip_address": ip_address, "user_agent": user_agent[:200]})
-    cutoff_time = (current_time - timedelta(minutes=15)).isoformat()
-    storage["failed_attempts"]["attempts"] = [a for a in storage["failed_attempts"]["attempts"] if a["timestamp"] > cutoff_time]
-    storage["failed_attempts"]["count"] = len(storage["failed_attempts"]["attempts"])
     max_attempts = storage.get("settings", {}).get("max_attempts", DEFAULT_MAX_ATTEMPTS)
-    if storage["failed_attempts"]["count"] >= max_attempts:
-        create_security_alert(storage, "multiple_failed_attempts", f"{storage['failed_attempts']['count']} tentatives échouées depuis {ip_address}", "high")
-        storage["failed_attempts"] = {"count": 0, "last_reset": datetime.now().isoformat(), "attempts": []}
-    return storage["failed_attempts"]["count"]
+    count, locked = access_limiter.record_failure(limiter_keys(storage.lock_id, agent), max_attempts)
+    # Seul un résumé de taille fixe est persisté (avec le log de l'échec, dans la même écriture)
+    previous = storage.get("failed_attempts", {})
+    storage["failed_attempts"] = {
+        "count": 0 if locked else count,
+        "last_reset": current_time.isoformat() if locked else previous.get("last_reset", current_time.isoformat()),
+        "last_failure": {"timestamp": current_time.isoformat(), "ip_address": ip_address, "user_agent": user_agent[:200]},
+        "lockouts": previous.get("lockouts", 0) + int(locked)
+    }
+    if locked:
+        create_security_alert(storage, "multiple_failed_attempts",
+                              f"{count} tentatives échouées depuis {ip_address}: source bloquée {int(access_limiter.lockout)}s", "high",
+                              source=ip_address)
+    return count
 
 @app.template_filter('datetimeformat')
 def datetimeformat(value: Union[str, datetime], fmt: str = '%d/%m/%Y %H:%M:%S') -> str:
@@ -167,30 +461,22 @@ def server_error(_) -> Tuple[str, int]: return render_template('error.html', err
 @app.route('/')
 def dashboard() -> Union[str, Tuple[str, int]]:
     try:
-        data = load_data()
+        store = get_storage(); data = store.read_state()
         settings = data.get("settings", get_default_data()["settings"])
         logs_page = max(1, request.args.get('logs_page', 1, type=int))
         alerts_page = max(1, request.args.get('alerts_page', 1, type=int))
         per_page = 5
-        logs = sorted(data.get("access_logs", []), key=lambda x: x.get('timestamp', ''), reverse=True)
-        total_logs = len(logs)
-        logs_to_show = logs[(logs_page - 1) * per_page: logs_page * per_page]
-        alerts = [a for a in data.get("alerts", []) if not a.get("resolved", False)]
-        alerts = sorted(alerts, key=lambda x: x.get('timestamp', ''), reverse=True)
-        total_alerts = len(alerts)
-        alerts_to_show = alerts[(alerts_page - 1) * per_page: alerts_page * per_page]
+        logs_to_show, total_logs = store.page_logs((logs_page - 1) * per_page, per_page)
+        alerts_to_show, total_alerts = store.page_alerts((alerts_page - 1) * per_page, per_page)
         failed_attempts = data.get("failed_attempts", {"count": 0})
         failed_count = failed_attempts.get("count", 0)
         max_attempts = settings.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
         progress = (failed_count / max_attempts) * 100 if max_attempts > 0 else 0
         security_level = "danger" if failed_count >= max_attempts else "warning" if failed_count > 0 else "success"
-        failure_reasons = {}
-        recent_failed_logs = [log for log in logs if log.get("status") == "failed"][:20]
-        for log in recent_failed_logs:
-            reason = log.get("reason", "unknown")
-            failure_reasons[reason] = failure_reasons.get(reason, 0) + 1
+        # Histogramme tenu à jour à chaque commit: aucun log n'est relu au rendu
+        failure_reasons = data.get("aggregates", {}).get("failure_reasons", {})
         return render_template('dashboard.html', is_code_valid=is_code_valid, now=datetime.now(),
-                               current_code=data.get("current_code"), logs=logs_to_show, alerts=alerts_to_show,
+                               current_code=current_code_view(data), logs=logs_to_show, alerts=alerts_to_show,
                                total_logs=total_logs, total_alerts=total_alerts, logs_page=logs_page,
                                logs_pages=max(1, (total_logs + per_page - 1) // per_page), alerts_page=alerts_page,
                                alerts_pages=max(1, (total_alerts + per_page - 1) // per_page),
@@ -198,128 +484,216 @@ def dashboard() -> Union[str, Tuple[str, int]]:
                                security_level=security_level, progress_percentage=progress,
                                failure_reasons=failure_reasons, settings=settings)
     except Exception as e:
-        logger.error(f"Erreur dashboard: {str(e)}")
+        logger.error("Erreur dashboard: %s", e)
         return render_template('error.html', error="Erreur dashboard", code=500), 500
 
 class CodeResource(Resource):
-    def get(self) -> Dict[str, Any]:
+    def get(self, lock_id: str = DEFAULT_LOCK_ID) -> Dict[str, Any]:
         try:
-            data = load_data()
-            current_code = data.get("current_code", {})
-            if not current_code or not current_code.get("value"):
-                return {"valid": False, "code": None, "remaining_time": 0, "reason": "no_code_generated"}
+            store, error = lock_storage(lock_id)
+            if error: return error
+            data = store.read_state()
+            current_code = current_code_view(data)
             code_valid = is_code_valid(current_code)
+            # L'expiration du code (ou la fenêtre en mode hors ligne) change la réponse sans commit: elle fait partie de l'étiquette
+            etag = state_etag(lock_id, data.get("version", 0), int(code_valid), *([current_code["window"]] if "window" in current_code else []))
+            cached = not_modified(etag)
+            if cached: return cached
+            if not current_code or not current_code.get("value"):
+                return {"valid": False, "code": None, "remaining_time": 0, "reason": "no_code_generated"}, 200, etag_headers(etag)
             remaining_time = 0; reason = None
             if code_valid:
                 valid_until = datetime.fromisoformat(current_code["valid_until"])
                 remaining_time = max(0, int((valid_until - datetime.now()).total_seconds()))
             else: reason = "code_expired"
             if current_code.get("used", False): code_valid = False; reason = "code_already_used"
+            if "window" in current_code:
+                # Hors ligne, la fenêtre utilisée pour une entrée ne sert plus (usage unique)
+                if current_code.get("used_for_entry", False): code_valid = False; reason = "code_already_used"
+                return {"valid": code_valid, "code": current_code["value"], "mode": "offline", "window": current_code["window"],
+                        "generated_at": current_code["generated_at"], "valid_until": current_code["valid_until"],
+                        "used": current_code["used"] or current_code["used_for_entry"],
+                        "remaining_time": remaining_time if code_valid else 0, "reason": reason}, 200, etag_headers(etag)
             return {"valid": code_valid, "code": current_code["value"], "generated_at": current_code.get("generated_at"),
                     "valid_until": current_code.get("valid_until"), "used": current_code.get("used", False),
-                    "remaining_time": remaining_time, "reason": reason}
-        except Exception as e: logger.error(f"Erreur GET CodeResource: {str(e)}"); return {"error": "Erreur serveur"}, 500
+                    "remaining_time": remaining_time, "reason": reason}, 200, etag_headers(etag)
+        except Exception as e: logger.error("Erreur GET CodeResource: %s", e); return {"error": "Erreur serveur"}, 500
+
+    def post(self, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
+        try:
+            store, error = lock_storage(lock_id, create=True)
+            if error: return error
+            with store.transaction() as data:
+                if is_offline_mode(data):
+                    return {"error": "Cadenas en mode hors ligne: les codes sont dérivés du secret (voir /code/windows)"}, 409
+                new_code = issue_code(data)
+            logger.info("API: Nuovo codice generato: %s", new_code["value"])
+            return {"code": new_code["value"], "generated_at": new_code["generated_at"], "valid_until": new_code["valid_until"]}, 201
+        except StorageError: return {"error": "Erreur sauvegarde"}, 500
+        except Exception as e: logger.error("Erreur POST CodeResource: %s", e); return {"error": "Erreur serveur"}, 500
+
+
+class OfflineCodeResource(Resource):
+    """Mode hors ligne: POST active le mode (ou change de secret) et renvoie le secret une seule fois, DELETE le désactive."""
+
+    def post(self, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
+        try:
+            store, error = lock_storage(lock_id, create=True)
+            if error: return error
+            with store.transaction() as data:
+                secret = new_secret(); enabled_at = datetime.now()
+                data["settings"] = dict(data.get("settings", {}), code_mode="offline")
+                # Nouveau secret: les fenêtres utilisées avec l'ancien ne signifient plus rien
+                data["offline_codes"] = {"secret": secret, "enabled_at": enabled_at.isoformat(), "used": {}}
+                digits, period = code_parameters(data["settings"])
+            logger.info("API: Mode hors ligne activé pour le cadenas %s.", lock_id)
+            return {"mode": "offline", "secret": secret, "algorithm": OFFLINE_ALGORITHM, "digits": digits, "period": period,
+                    "skew_windows": OFFLINE_SKEW_WINDOWS, "enabled_at": enabled_at.isoformat()}, 201
+        except StorageError: return {"error": "Erreur sauvegarde"}, 500
+        except Exception as e: logger.error("Erreur POST OfflineCodeResource: %s", e); return {"error": "Erreur serveur"}, 500
+
+    def delete(self, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
+        try:
+            store, error = lock_storage(lock_id)
+            if error: return error
+            with store.transaction() as data:
+                data["settings"] = dict(data.get("settings", {}), code_mode="random")
+                # Les commits appliquent les clés modifiées (data.update): le secret est effacé, pas la clé retirée
+                data["offline_codes"] = {}
+            logger.info("API: Mode hors ligne désactivé pour le cadenas %s.", lock_id)
+            return {"mode": "random"}, 200
+        except StorageError: return {"error": "Erreur sauvegarde"}, 500
+        except Exception as e: logger.error("Erreur DELETE OfflineCodeResource: %s", e); return {"error": "Erreur serveur"}, 500
+
 
-    def post(self) -> Tuple[Dict[str, Any], int]:
+class CodeWindowsResource(Resource):
+    """Codes des fenêtres à venir (?count=, 10 par défaut) pour le provisionnement, avec leur état d'utilisation."""
+
+    def get(self, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
         try:
-            data = load_data(); settings = data.get("settings", {})
-            code_length = max(4, min(10, settings.get("code_length", DEFAULT_CODE_LENGTH)))
-            code_validity = max(60, settings.get("code_validity", DEFAULT_CODE_VALIDITY))
-            new_code = generate_code(code_length); generated_at = datetime.now()
-            valid_until = generated_at + timedelta(seconds=code_validity)
-            data["current_code"] = {"value": new_code, "generated_at": generated_at.isoformat(),
-                                   "valid_until": valid_until.isoformat(), "used": False, "used_for_entry": False}
-            if not save_data(data): return {"error": "Erreur sauvegarde"}, 500
-            logger.info(f"API: Nuovo codice generato: {new_code}")
-            return {"code": new_code, "generated_at": generated_at.isoformat(), "valid_until": valid_until.isoformat()}, 201
-        except Exception as e: logger.error(f"Erreur POST CodeResource: {str(e)}"); return {"error": "Erreur serveur"}, 500
+            store, error = lock_storage(lock_id)
+            if error: return error
+            data = store.read_state()
+            if not is_offline_mode(data): return {"error": "Le cadenas n'est pas en mode hors ligne"}, 409
+            count = min(OFFLINE_MAX_WINDOWS, max(1, request.args.get('count', 10, type=int)))
+            digits, period = code_parameters(data.get("settings", {}))
+            windows = upcoming_windows(data["offline_codes"], datetime.now(), count, data.get("settings", {}))
+            return {"windows": windows, "digits": digits, "period": period, "skew_windows": OFFLINE_SKEW_WINDOWS}, 200, {'Cache-Control': 'no-store'}
+        except Exception as e: logger.error("Erreur GET CodeWindowsResource: %s", e); return {"error": "Erreur serveur"}, 500
 
 
 class AccessResource(Resource):
-    def post(self) -> Tuple[Dict[str, Any], int]:
+    def post(self, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
         try:
             req_data = request.json
             if not req_data or not isinstance(req_data, dict): return {"error": "Données invalides"}, 400
+            if req_data.get('event') == "door_open":
+                retry_after = access_limiter.retry_after(limiter_keys(lock_id, sanitize_input(req_data.get('agent', 'unknown'))))
+                if retry_after: return too_many_attempts(retry_after)
+            store, error = lock_storage(lock_id)
+            if error: return error
+
+            # Lire les settings (lecture servie par le backend, sans verrou) pour la validation
+            settings = store.read_state().get("settings", get_default_data().get("settings", {}))
+            error_message = self._validate_event(req_data, settings)
+            if error_message: return {"error": error_message}, 400
+            event_id = req_data.get('event_id')
+            if event_id is not None and not is_valid_event_id(event_id):
+                return {"error": "Champ 'event_id' invalide"}, 400
 
-            event = req_data.get('event')
-            code = req_data.get('code')
-            agent = sanitize_input(req_data.get('agent', 'unknown'))
-
-            if not event:
-                return {"error": "Champ 'event' manquant"}, 400
-
-            if event not in ["door_open", "door_close"]:
-                return {"error": "Événement non reconnu"}, 400
-
-            # Charger les données, y compris les settings
-            storage = load_data()  # load_data() charge tout le fichier codes.json
-            settings = storage.get("settings", get_default_data().get("settings", {}))  # Récupérer les settings
-
-            # Si l'événement est 'door_open', le code est obligatoire et ne doit pas être vide.
-            if event == "door_open" and (code is None or code == ""):
-                return {"error": "Champ 'code' manquant ou vide pour l'événement door_open"}, 400
-
-            if code is None:
-                return {"error": "Champ 'code' manquant"}, 400
-
-            # Vérification de la longueur et du format pour les codes
-            placeholders_autorises = ["_LBE_"]
-            expected_code_length = settings.get("code_length", DEFAULT_CODE_LENGTH)
-
-            if event == "door_open":  # Validation stricte pour les codes d'ouverture
-                if not code.isdigit() or len(code) != expected_code_length:
-                    logger.warning(
-                        f"API Access: Code '{code}' au format invalide pour door_open (attendu: {expected_code_length} chiffres).")
-                    return {"error": "Format de code invalide pour ouverture"}, 400
-            elif code != "" and code not in placeholders_autorises:  # Pour door_close avec un code numérique
-                if not code.isdigit() or len(
-                        code) != expected_code_length:  # Si ce n'est pas un placeholder ni vide, il doit être valide
-                    # Si le code pour un door_close (qui n'est pas un placeholder ou vide)
-                    # ne correspond pas au format attendu, on peut le logger mais potentiellement le laisser passer
-                    # car le but principal est de logger la fermeture.
-                    # Ou on peut le rejeter. Pour l'instant, soyons un peu plus souple pour les codes de fermeture non placeholder.
-                    # Cependant, la logique _handle_door_close vérifiera s'il correspond au current_code.
-                    # Pour être cohérent, on peut aussi appliquer une validation ici.
-                    # Décidons pour l'instant de ne valider strictement que les codes pour 'door_open'.
-                    # La validation de longueur > 10 est toujours une bonne idée générale.
-                    if len(code) > 10:  # Simple vérification de longueur excessive
-                        logger.warning(f"API Access: Code '{code}' trop long reçu pour door_close.")
-                        return {"error": "Format de code invalide (trop long)"}, 400
-
-            timestamp = datetime.now().isoformat();
-            ip_address = request.remote_addr
-            log_entry = {"event": event, "code_used": code, "agent": agent, "timestamp": timestamp,
-                         "ip_address": ip_address, "status": "pending"}
-
-            if event == "door_close":
-                self._handle_door_close(storage, code, log_entry)
-            elif event == "door_open":
-                self._handle_door_open(storage, code, log_entry, settings)  # Passer settings ici
-
-            storage.setdefault("access_logs", []).append(log_entry)
-            if not save_data(storage):
+            try:
+                with store.transaction() as storage:
+                    duplicate = store.find_logs_by_event_id([event_id]).get(event_id) if event_id else None
+                    log_entry = duplicate or self._apply_event(storage, req_data, datetime.now(), settings)
+            except StorageError:
                 logger.error("API Access: Échec sauvegarde après traitement accès.")
                 return {"error": "Erreur de sauvegarde interne"}, 500
 
-            logger.info(
-                f"Accesso API: Evento '{event}' elaborato per codice '{code}'. Stato: {log_entry['status']}, Motivo: {log_entry.get('reason')}")
+            if duplicate:
+                return {"status": "duplicate", "event_status": log_entry["status"], "reason": log_entry.get("reason")}, 200
+            # Une ligne par accès: DEBUG (les accès sont déjà dans access_logs et dans /metrics)
+            logger.debug("Accesso API: Evento '%s' elaborato per codice '%s'. Stato: %s, Motivo: %s",
+                         log_entry['event'], log_entry['code_used'], log_entry['status'], log_entry.get('reason'))
             return {"status": "logged", "event_status": log_entry["status"], "reason": log_entry.get("reason")}, 201
         except Exception as e:
-            logger.error(f"Erreur POST AccessResource: {str(e)}"); return {"error": "Erreur serveur"}, 500
+            logger.error("Erreur POST AccessResource: %s", e); return {"error": "Erreur serveur"}, 500
+
+    @staticmethod
+    def _validate_event(req_data: Dict[str, Any], settings: Dict[str, Any]) -> Optional[str]:
+        """Message d'erreur si l'événement est invalide, None sinon."""
+        event = req_data.get('event')
+        code = req_data.get('code')
 
-    def _handle_door_close(self, storage: Dict[str, Any], code: str, log_entry: Dict[str, Any]) -> None:
+        if not event:
+            return "Champ 'event' manquant"
+
+        if event not in ["door_open", "door_close"]:
+            return "Événement non reconnu"
+
+        # Si l'événement est 'door_open', le code est obligatoire et ne doit pas être vide.
+        if event == "door_open" and (code is None or code == ""):
+            return "Champ 'code' manquant ou vide pour l'événement door_open"
+
+        if code is None:
+            return "Champ 'code' manquant"
+        if not isinstance(code, str):
+            return "Format de code invalide"
+
+        # Vérification de la longueur et du format pour les codes
+        placeholders_autorises = ["_LBE_"]
+        expected_code_length = settings.get("code_length", DEFAULT_CODE_LENGTH)
+
+        if event == "door_open":  # Validation stricte pour les codes d'ouverture
+            if not code.isdigit() or len(code) != expected_code_length:
+                # Échantillonné: un client qui martèle l'API ne doit pas inonder app.log
+                logger.warning("API Access: Code '%s' au format invalide pour door_open (attendu: %s chiffres).",
+                               code, expected_code_length, extra={"sample": "invalid_code"})
+                return "Format de code invalide pour ouverture"
+        elif code != "" and code not in placeholders_autorises:  # Pour door_close avec un code numérique
+            if not code.isdigit() or len(
+                    code) != expected_code_length:  # Si ce n'est pas un placeholder ni vide, il doit être valide
+                # Si le code pour un door_close (qui n'est pas un placeholder ou vide)
+                # ne correspond pas au format attendu, on peut le logger mais potentiellement le laisser passer
+                # car le but principal est de logger la fermeture.
+                # Ou on peut le rejeter. Pour l'instant, soyons un peu plus souple pour les codes de fermeture non placeholder.
+                # Cependant, la logique _handle_door_close vérifiera s'il correspond au current_code.
+                # Pour être cohérent, on peut aussi appliquer une validation ici.
+                # Décidons pour l'instant de ne valider strictement que les codes pour 'door_open'.
+                # La validation de longueur > 10 est toujours une bonne idée générale.
+                if len(code) > 10:  # Simple vérification de longueur excessive
+                    logger.warning("API Access: Code '%s' trop long reçu pour door_close.", code, extra={"sample": "invalid_code"})
+                    return "Format de code invalide (trop long)"
+        return None
+
+    def _apply_event(self, storage: StateTransaction, req_data: Dict[str, Any], timestamp: datetime,
+                     settings: Dict[str, Any], occurred_at: Optional[datetime] = None) -> Dict[str, Any]:
+        """Applique un événement validé à la transaction et y ajoute son entrée de log.
+
+        occurred_at (heure de l'événement côté appareil) sert à juger l'expiration du code, par défaut timestamp.
+        """
+        event = req_data['event']; code = req_data['code']
+        log_entry = {"event": event, "code_used": code, "agent": sanitize_input(req_data.get('agent', 'unknown')),
+                     "timestamp": timestamp.isoformat(), "ip_address": request.remote_addr, "status": "pending"}
+        if req_data.get('event_id'): log_entry["event_id"] = req_data['event_id']
+        if event == "door_close":
+            self._handle_door_close(storage, code, log_entry, occurred_at or timestamp)
+        elif event == "door_open":
+            self._handle_door_open(storage, code, log_entry, storage.get("settings", settings), occurred_at or timestamp)
+        return storage.append_log(log_entry)
+
+    def _handle_door_close(self, storage: StateTransaction, code: str, log_entry: Dict[str, Any],
+                           occurred_at: Optional[datetime] = None) -> None:
         # ... (contenu de _handle_door_close comme dans ma réponse précédente, il n'utilise pas settings) ...
-        current_code_data = storage.get("current_code", {})
+        current_code_data = matching_code(storage, code, occurred_at) if code not in ("", "_LBE_") else None
         if code == "":
             log_entry.update(
                 {"status": "success", "reason": "Sortie par bouton (sans code d'entrée préalable valide) journalisée"})
         elif code == "_LBE_":
             log_entry.update({"status": "success", "reason": "Sortie par bouton (après entrée valide) journalisée"})
-        elif current_code_data.get("value") == code and current_code_data.get("used_for_entry", False):
-            storage["current_code"]["used"] = True
-            storage["current_code"]["used_for_entry"] = False
+        elif current_code_data and current_code_data.get("used_for_entry", False):
+            mark_code(storage, current_code_data, occurred_at or datetime.now(), used=True, used_for_entry=False)
             log_entry.update({"status": "success", "reason": "Code invalidé après cycle d'accès complet (fermeture)"})
-        elif current_code_data.get("value") == code and not current_code_data.get("used_for_entry", False):
+        elif current_code_data:
             log_entry.update({"status": "warning",
                               "reason": "Fermeture avec code actuel, mais pas utilisé pour entrée récente ou déjà invalidé."})
         else:
@@ -327,9 +701,9 @@ class AccessResource(Resource):
                               "reason": "Code non reconnu ou non applicable pour l'événement de sortie/fermeture"})
 
     # MODIFIÉ: _handle_door_open a besoin des settings pour la longueur du code attendue
-    def _handle_door_open(self, storage: Dict[str, Any], code: str, log_entry: Dict[str, Any],
-                          settings: Dict[str, Any]) -> None:
-        current_code_data = storage.get("current_code", {})
+    def _handle_door_open(self, storage: StateTransaction, code: str, log_entry: Dict[str, Any],
+                          settings: Dict[str, Any], occurred_at: Optional[datetime] = None) -> None:
+        current_code_data = matching_code(storage, code, occurred_at)
         # expected_code_length est maintenant récupéré via settings passés en argument
         expected_code_length = settings.get("code_length", DEFAULT_CODE_LENGTH)
 
@@ -337,112 +711,403 @@ class AccessResource(Resource):
         # On peut la garder ici aussi pour une double vérification si on le souhaite, mais c'est redondant.
         # Assumons que le code arrivant ici a déjà passé la validation de format de base.
 
-        if current_code_data.get("value") == code:
-            if is_code_valid(current_code_data):
+        if current_code_data:
+            if is_code_valid(current_code_data, occurred_at):
                 if not current_code_data.get("used", False) and not current_code_data.get("used_for_entry", False):
                     log_entry["status"] = "success";
-                    storage["current_code"]["used_for_entry"] = True
+                    mark_code(storage, current_code_data, occurred_at or datetime.now(), used_for_entry=True)
                 else:
                     log_entry["status"] = "failed";
                     log_entry["reason"] = "code_already_used_for_entry_or_exit"
             else:
                 log_entry["status"] = "failed";
                 log_entry["reason"] = "code_expired"
-                increment_failed_attempt(storage)
+                increment_failed_attempt(storage, log_entry["agent"], occurred_at)
         else:
             log_entry["status"] = "failed";
             log_entry["reason"] = "code_incorrect"
-            increment_failed_attempt(storage)
+            increment_failed_attempt(storage, log_entry["agent"], occurred_at)
+
+class AccessBatchResource(AccessResource):
+    """Événements tamponnés par le cadenas (coupure WiFi) rejoués dans l'ordre, en un seul commit.
+
+    L'horodatage serveur reste la clé d'ordre des logs; l'heure de l'appareil est conservée dans
+    client_timestamp et sert à juger la validité du code au moment de l'événement.
+    """
+
+    def post(self, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
+        try:
+            store, error = lock_storage(lock_id)
+            if error: return error
+            req_data = request.json
+            events = req_data.get('events') if isinstance(req_data, dict) else req_data
+            if not isinstance(events, list) or not events: return {"error": "Champ 'events' manquant ou vide"}, 400
+            if len(events) > MAX_BATCH_EVENTS:
+                return {"error": f"Lot trop volumineux (maximum {MAX_BATCH_EVENTS} événements)"}, 413
+
+            settings = store.read_state().get("settings", get_default_data().get("settings", {}))
+            received_at = datetime.now()
+            results: List[Optional[Dict[str, Any]]] = [None] * len(events); accepted = []
+            for position, item in enumerate(events):
+                error_message, occurred_at = self._validate_batch_item(item, settings, received_at)
+                if error_message:
+                    results[position] = {"index": position, "status": "rejected", "error": error_message}
+                else:
+                    accepted.append((position, item, occurred_at))
+
+            try:
+                with store.transaction() as storage:
+                    known = store.find_logs_by_event_id([item['event_id'] for _, item, _ in accepted if item.get('event_id')])
+                    for position, item, occurred_at in accepted:
+                        event_id = item.get('event_id')
+                        if event_id in known:
+                            log_entry = known[event_id]; status = "duplicate"
+                        else:
+                            log_entry = self._apply_event(storage, item, received_at, settings, occurred_at)
+                            log_entry["client_timestamp"] = occurred_at.isoformat(); status = "logged"
+                            if event_id: known[event_id] = log_entry  # Doublons à l'intérieur du même lot
+                        results[position] = {"index": position, "event_id": event_id, "status": status,
+                                             "event_status": log_entry["status"], "reason": log_entry.get("reason")}
+            except StorageError:
+                logger.error("API Access batch: Échec sauvegarde du lot.")
+                return {"error": "Erreur de sauvegarde interne"}, 500
+
+            counts = {status: sum(1 for r in results if r["status"] == status) for status in ("logged", "duplicate", "rejected")}
+            logger.debug("API Access batch: %s événements reçus (%s journalisés, %s doublons, %s rejetés).",
+                         len(events), counts['logged'], counts['duplicate'], counts['rejected'])
+            return {"status": "processed", "logged": counts["logged"], "duplicates": counts["duplicate"],
+                    "rejected": counts["rejected"], "results": results}, 200
+        except Exception as e:
+            logger.error("Erreur POST AccessBatchResource: %s", e); return {"error": "Erreur serveur"}, 500
+
+    def _validate_batch_item(self, item: Any, settings: Dict[str, Any],
+                             received_at: datetime) -> Tuple[Optional[str], Optional[datetime]]:
+        if not isinstance(item, dict): return "Données invalides", None
+        error_message = self._validate_event(item, settings)
+        if error_message: return error_message, None
+        if item.get('event_id') is not None and not is_valid_event_id(item['event_id']):
+            return "Champ 'event_id' invalide", None
+        if item.get('timestamp') is None: return None, received_at
+        try: occurred_at = datetime.fromisoformat(parse_timestamp_param(item['timestamp']))
+        except (TypeError, ValueError, AttributeError): return "Champ 'timestamp' invalide", None
+        # Horloge de l'appareil en avance: l'événement ne peut pas être postérieur à sa réception
+        return None, min(occurred_at, received_at)
 
 class LogsResource(Resource):
-    def get(self) -> Dict[str, Any]:
+    def get(self, lock_id: str = DEFAULT_LOCK_ID) -> Dict[str, Any]:
         try:
-            data = load_data(); page = max(1, request.args.get('page', 1, type=int))
+            store, error = lock_storage(lock_id)
+            if error: return error
+            etag = state_etag(lock_id, store.version())
+            cached = not_modified(etag)
+            if cached: return cached
+            page = max(1, request.args.get('page', 1, type=int))
             per_page = min(50, max(1, request.args.get('per_page', 10, type=int)))
-            logs = sorted(data.get("access_logs", []), key=lambda x: x.get('timestamp', ''), reverse=True)
-            total = len(logs); start = (page - 1) * per_page
-            return {"logs": logs[start:start + per_page], "pagination": {"total": total, "page": page, "per_page": per_page, "pages": max(1, (total + per_page - 1) // per_page)}}
-        except Exception as e: logger.error(f"Erreur GET LogsResource: {str(e)}"); return {"error": "Erreur serveur"}, 500
+            try:
+                key = keyset_from_request()
+                since, until = (parse_timestamp_param(request.args[name]) if request.args.get(name) else None for name in ('since', 'until'))
+            except ValueError: return {"error": "Curseur ou date invalide"}, 400
+            filters = {field: request.args[field] for field in LOG_FILTERS if request.args.get(field)}
+            if since or until:
+                # Plage de dates: l'état chaud est complété par l'archive des entrées évincées
+                logs, next_key = logs_in_range(store, since, until, key, per_page, filters)
+                return {"logs": logs, "pagination": {"per_page": per_page, "next_cursor": encode_cursor(next_key)}}, 200, etag_headers(etag)
+            if filters or key is not None or request.args.get('cursor') is not None:
+                # Filtres servis par les index secondaires (postings par statut, IP, agent...), pagination par curseur
+                logs, next_key = store.logs_before(key, per_page, filters)
+                return {"logs": logs, "pagination": {"per_page": per_page, "next_cursor": encode_cursor(next_key)}}, 200, etag_headers(etag)
+            logs, total = store.page_logs((page - 1) * per_page, per_page)
+            next_cursor = encode_cursor((logs[-1]["timestamp"], logs[-1]["id"])) if logs and page * per_page < total else None
+            return {"logs": logs, "pagination": {"total": total, "page": page, "per_page": per_page, "pages": max(1, (total + per_page - 1) // per_page), "next_cursor": next_cursor}}, 200, etag_headers(etag)
+        except Exception as e: logger.error("Erreur GET LogsResource: %s", e); return {"error": "Erreur serveur"}, 500
 
 class AlertResource(Resource):
-    def post(self) -> Tuple[Dict[str, Any], int]:
+    def post(self, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
         try:
+            store, error = lock_storage(lock_id)
+            if error: return error
             req_data = request.json
             if not req_data or not isinstance(req_data, dict): return {"error": "Données invalides"}, 400
             alert_type = req_data.get('type'); message = req_data.get('message'); severity = req_data.get('severity', 'medium')
             if not alert_type or not message: return {"error": "Champs manquants"}, 400
-            storage = load_data(); alert = create_security_alert(storage, alert_type, message, severity)
-            if not save_data(storage): return {"error": "Erreur sauvegarde"}, 500
-            logger.info(f"API Alert: Alerte créée - Type: {alert_type}, Sévérité: {severity}")
+            with store.transaction() as storage:
+                alert = create_security_alert(storage, alert_type, message, severity, source=request.remote_addr or "unknown")
+            if alert.get("count", 1) > 1:
+                logger.debug("API Alert: Alerte %s répétée (%s occurrences)", alert.get("_index"), alert.get("count"))
+                return {"status": "alert_coalesced", "alert_id": alert.get("_index"), "timestamp": alert.get("timestamp"),
+                        "count": alert.get("count"), "first_seen": alert.get("first_seen"), "last_seen": alert.get("last_seen")}, 200
+            logger.info("API Alert: Alerte créée - Type: %s, Sévérité: %s", alert_type, severity)
             return {"status": "alert_created", "alert_id": alert.get("_index"), "timestamp": alert.get("timestamp")}, 201
-        except Exception as e: logger.error(f"Erreur POST AlertResource: {str(e)}"); return {"error": "Erreur serveur"}, 500
+        except StorageError: return {"error": "Erreur sauvegarde"}, 500
+        except Exception as e: logger.error("Erreur POST AlertResource: %s", e); return {"error": "Erreur serveur"}, 500
 
 class AlertResolveResource(Resource):
-    def post(self, index: int) -> Tuple[Dict[str, Any], int]:
+    def post(self, index: int, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
         try:
-            data = load_data(); #alerts = data.get("alerts", []) # Non utilisé directement
             if not isinstance(index, int) or index < 0: return {"error": "Index invalide"}, 400
-            alert_to_resolve = None; original_list_index = -1
-            for i, alert_item in enumerate(data.get("alerts",[])): # Utiliser data.get pour être sûr
-                if alert_item.get("_index") == index: alert_to_resolve = alert_item; original_list_index = i; break
-            if not alert_to_resolve: return {"error": "Alerte non trouvée"}, 404
-            if alert_to_resolve.get("resolved", False): return {"error": "Alerte déjà résolue"}, 400
-            data["alerts"][original_list_index].update({"resolved": True, "resolved_at": datetime.now().isoformat(), "resolved_by": request.remote_addr})
-            if not save_data(data): return {"error": "Erreur sauvegarde"}, 500
-            logger.info(f"API Alert: Alerte {index} marquée comme résolue.")
-            return {"status": "alert_resolved", "alert_index": index, "resolved_at": data["alerts"][original_list_index]["resolved_at"]}
-        except Exception as e: logger.error(f"Erreur POST AlertResolveResource for index {index}: {str(e)}"); return {"error": "Erreur serveur"}, 500
+            store, error = lock_storage(lock_id)
+            if error: return error
+            with store.transaction() as data:
+                alert_to_resolve = store.get_alert(index)
+                if not alert_to_resolve: return {"error": "Alerte non trouvée"}, 404
+                if alert_to_resolve.get("resolved", False): return {"error": "Alerte déjà résolue"}, 400
+                resolved_at = datetime.now().isoformat()
+                data.update_alert(index, {"resolved": True, "resolved_at": resolved_at, "resolved_by": request.remote_addr})
+            logger.info("API Alert: Alerte %s marquée comme résolue.", index)
+            return {"status": "alert_resolved", "alert_index": index, "resolved_at": resolved_at}
+        except StorageError: return {"error": "Erreur sauvegarde"}, 500
+        except Exception as e: logger.error("Erreur POST AlertResolveResource for index %s: %s", index, e); return {"error": "Erreur serveur"}, 500
+
+class AlertsBulkResolveResource(Resource):
+    """Résolution groupée: liste d'identifiants ou filtre (type, severity, before), en un seul commit."""
+
+    def post(self, lock_id: str = DEFAULT_LOCK_ID) -> Tuple[Dict[str, Any], int]:
+        try:
+            store, error = lock_storage(lock_id)
+            if error: return error
+            req_data = request.json
+            if not req_data or not isinstance(req_data, dict): return {"error": "Données invalides"}, 400
+            ids = req_data.get('ids'); before = None
+            criteria = req_data.get('filter', {k: req_data[k] for k in ('type', 'severity', 'before') if k in req_data})
+            if ids is not None:
+                if not isinstance(ids, list) or not ids or len(ids) > MAX_BULK_RESOLVE or not all(isinstance(i, int) and i >= 0 for i in ids):
+                    return {"error": f"Champ 'ids' invalide (1 à {MAX_BULK_RESOLVE} identifiants entiers)"}, 400
+            elif not isinstance(criteria, dict) or not criteria or set(criteria) - {'type', 'severity', 'before'}:
+                return {"error": "Indiquer 'ids' ou un filtre (type, severity, before)"}, 400
+            else:
+                try: before = parse_timestamp_param(criteria['before']) if criteria.get('before') else None
+                except (TypeError, ValueError, AttributeError): return {"error": "Date 'before' invalide"}, 400
+
+            resolved_at = datetime.now().isoformat()
+            fields = {"resolved": True, "resolved_at": resolved_at, "resolved_by": request.remote_addr}
+            with store.transaction() as data:
+                if ids is not None:
+                    found = {i: store.get_alert(i) for i in dict.fromkeys(ids)}
+                    targets = [i for i, alert in found.items() if alert and not alert.get("resolved", False)]
+                    not_found = [i for i, alert in found.items() if not alert]
+                    already_resolved = [i for i, alert in found.items() if alert and alert.get("resolved", False)]
+                else:
+                    targets = [alert["id"] for alert in store.find_alerts(criteria.get('type'), criteria.get('severity'), before)]
+                    not_found = []; already_resolved = []
+                for index in targets: data.update_alert(index, fields)
+            logger.info("API Alert: %s alertes résolues en lot.", len(targets))
+            return {"status": "alerts_resolved", "resolved": len(targets), "ids": targets, "not_found": not_found,
+                    "already_resolved": already_resolved, "resolved_at": resolved_at}, 200
+        except StorageError: return {"error": "Erreur sauvegarde"}, 500
+        except Exception as e: logger.error("Erreur POST AlertsBulkResolveResource: %s", e); return {"error": "Erreur serveur"}, 500
 
 class AlertsResource(Resource):
-    def get(self) -> Dict[str, Any]:
+    def get(self, lock_id: str = DEFAULT_LOCK_ID) -> Dict[str, Any]:
         try:
-            data = load_data(); page = max(1, request.args.get('page', 1, type=int))
+            store, error = lock_storage(lock_id)
+            if error: return error
+            etag = state_etag(lock_id, store.version())
+            cached = not_modified(etag)
+            if cached: return cached
+            page = max(1, request.args.get('page', 1, type=int))
             per_page = min(50, max(1, request.args.get('per_page', 10, type=int)))
             show_resolved = request.args.get('show_resolved', 'false').lower() == 'true'
-            alerts_source = data.get("alerts", []); filtered_alerts = []
-            if show_resolved: filtered_alerts = alerts_source
-            else:
-                for alert_item in alerts_source:
-                    if not alert_item.get("resolved", False): filtered_alerts.append(alert_item)
-            alerts = sorted(filtered_alerts, key=lambda x: x.get('timestamp', ''), reverse=True)
-            total = len(alerts); start = (page - 1) * per_page
-            return {"alerts": alerts[start:start + per_page], "pagination": {"total": total, "page": page, "per_page": per_page, "pages": max(1, (total + per_page - 1) // per_page)}}
-        except Exception as e: logger.error(f"Erreur GET AlertsResource: {str(e)}"); return {"error": "Erreur serveur"}, 500
+            try: key = keyset_from_request()
+            except ValueError: return {"error": "Curseur ou date invalide"}, 400
+            if key is not None or request.args.get('cursor') is not None:
+                alerts, next_key = store.alerts_before(key, per_page, include_resolved=show_resolved)
+                return {"alerts": alerts, "pagination": {"per_page": per_page, "next_cursor": encode_cursor(next_key)}}, 200, etag_headers(etag)
+            alerts, total = store.page_alerts((page - 1) * per_page, per_page, include_resolved=show_resolved)
+            next_cursor = encode_cursor((alerts[-1]["timestamp"], alerts[-1]["id"])) if alerts and page * per_page < total else None
+            return {"alerts": alerts, "pagination": {"total": total, "page": page, "per_page": per_page, "pages": max(1, (total + per_page - 1) // per_page), "next_cursor": next_cursor}}, 200, etag_headers(etag)
+        except Exception as e: logger.error("Erreur GET AlertsResource: %s", e); return {"error": "Erreur serveur"}, 500
 
 class SettingsResource(Resource):
-    def get(self) -> Dict[str, Any]:
+    def get(self, lock_id: str = DEFAULT_LOCK_ID) -> Dict[str, Any]:
         try:
-            data = load_data()
+            store, error = lock_storage(lock_id)
+            if error: return error
+            etag = state_etag(lock_id, store.version())
+            cached = not_modified(etag)
+            if cached: return cached
+            data = store.read_state()
             default_settings_values = get_default_data().get("settings", {})
             current_settings = data.get("settings", default_settings_values)
             settings_to_return = {
                 "code_length": current_settings.get("code_length", DEFAULT_CODE_LENGTH),
                 "code_validity": current_settings.get("code_validity", DEFAULT_CODE_VALIDITY),
-                "max_attempts": current_settings.get("max_attempts", DEFAULT_MAX_ATTEMPTS)
+                "max_attempts": current_settings.get("max_attempts", DEFAULT_MAX_ATTEMPTS),
+                "code_mode": current_settings.get("code_mode", "random")
             }
-            logger.info(f"API: Envoi des paramètres: {settings_to_return}")
-            return settings_to_return, 200
+            logger.debug("API: Envoi des paramètres: %s", settings_to_return)
+            return settings_to_return, 200, etag_headers(etag)
         except Exception as e:
-            logger.error(f"Erreur GET SettingsResource: {str(e)}")
+            logger.error("Erreur GET SettingsResource: %s", e)
             return {"error": "Erreur serveur lors de la récupération des paramètres"}, 500
 
-api.add_resource(CodeResource, '/api/code')
-api.add_resource(AccessResource, '/api/access')
-api.add_resource(LogsResource, '/api/logs')
-api.add_resource(AlertResource, '/api/alert')
-api.add_resource(AlertResolveResource, '/api/alert/<int:index>/resolve')
-api.add_resource(AlertsResource, '/api/alerts')
-api.add_resource(SettingsResource, '/api/settings')
+class LocksResource(Resource):
+    def get(self) -> Dict[str, Any]:
+        # Résumé de l'état courant de chaque cadenas: aucun historique n'est parcouru
+        try:
+            locks = []
+            for lock_id in list_lock_ids():
+                store = get_storage(lock_id); data = store.read_state()
+                current_code = current_code_view(data)
+                locks.append({"lock_id": lock_id,
+                              "code_valid": bool(current_code.get("value")) and is_code_valid(current_code) and not current_code.get("used", False),
+                              "valid_until": current_code.get("valid_until"),
+                              "failed_attempts": data.get("failed_attempts", {}).get("count", 0),
+                              "unresolved_alerts": data.get("aggregates", {}).get("unresolved_alerts", 0)})
+            return {"locks": locks, "total": len(locks)}
+        except Exception as e: logger.error("Erreur GET LocksResource: %s", e); return {"error": "Erreur serveur"}, 500
+
+class FleetLogsResource(Resource):
+    def get(self) -> Dict[str, Any]:
+        try:
+            per_page = min(50, max(1, request.args.get('per_page', 10, type=int)))
+            try: key = keyset_from_request(fleet=True)
+            except ValueError: return {"error": "Curseur ou date invalide"}, 400
+            logs, next_key = fleet_logs_before(key, per_page)
+            return {"logs": logs, "pagination": {"per_page": per_page, "next_cursor": encode_cursor(next_key)}}
+        except Exception as e: logger.error("Erreur GET FleetLogsResource: %s", e); return {"error": "Erreur serveur"}, 500
+
+class FleetAlertsResource(Resource):
+    def get(self) -> Dict[str, Any]:
+        try:
+            per_page = min(50, max(1, request.args.get('per_page', 10, type=int)))
+            show_resolved = request.args.get('show_resolved', 'false').lower() == 'true'
+            try: key = keyset_from_request(fleet=True)
+            except ValueError: return {"error": "Curseur ou date invalide"}, 400
+            alerts, next_key = fleet_alerts_before(key, per_page, include_resolved=show_resolved)
+            return {"alerts": alerts, "pagination": {"per_page": per_page, "next_cursor": encode_cursor(next_key)}}
+        except Exception as e: logger.error("Erreur GET FleetAlertsResource: %s", e); return {"error": "Erreur serveur"}, 500
+
+# Les routes historiques visent le cadenas par défaut; /api/locks/<lock_id>/... vise un cadenas de la flotte
+api.add_resource(CodeResource, '/api/code', '/api/locks/<string:lock_id>/code')
+api.add_resource(OfflineCodeResource, '/api/code/offline', '/api/locks/<string:lock_id>/code/offline')
+api.add_resource(CodeWindowsResource, '/api/code/windows', '/api/locks/<string:lock_id>/code/windows')
+api.add_resource(AccessResource, '/api/access', '/api/locks/<string:lock_id>/access')
+api.add_resource(AccessBatchResource, '/api/access/batch', '/api/locks/<string:lock_id>/access/batch')
+api.add_resource(LogsResource, '/api/logs', '/api/locks/<string:lock_id>/logs')
+api.add_resource(AlertResource, '/api/alert', '/api/locks/<string:lock_id>/alert')
+api.add_resource(AlertResolveResource, '/api/alert/<int:index>/resolve', '/api/locks/<string:lock_id>/alert/<int:index>/resolve')
+api.add_resource(AlertsResource, '/api/alerts', '/api/locks/<string:lock_id>/alerts')
+api.add_resource(AlertsBulkResolveResource, '/api/alerts/resolve', '/api/locks/<string:lock_id>/alerts/resolve')
+api.add_resource(SettingsResource, '/api/settings', '/api/locks/<string:lock_id>/settings')
+api.add_resource(LocksResource, '/api/locks')
+api.add_resource(FleetLogsResource, '/api/fleet/logs')
+api.add_resource(FleetAlertsResource, '/api/fleet/alerts')
+
+def rotate_codes() -> int:
+    """Remplace le code des cadenas (mode aléatoire) généré il y a plus de CODE_ROTATION_INTERVAL secondes."""
+    rotated = 0; now = datetime.now(); cutoff = (now - timedelta(seconds=CODE_ROTATION_INTERVAL)).isoformat()
+    for lock_id in list_lock_ids():
+        store = get_storage(lock_id)
+        if not code_rotation_due(store.read_state(), cutoff): continue
+        with store.transaction() as tx:
+            # Revérifié sous le verrou: une requête a pu générer un code entre-temps
+            if code_rotation_due(tx, cutoff): issue_code(tx, now); rotated += 1
+    return rotated
+
+def code_rotation_due(data: Dict[str, Any], cutoff: str) -> bool:
+    return not is_offline_mode(data) and data.get("current_code", {}).get("generated_at", "") <= cutoff
+
+def sweep_expired_codes() -> int:
+    """Marque une fois pour toutes (expired) les codes échus: les lectures n'ont plus de date à interpréter."""
+    expired = 0
+    for lock_id in list_lock_ids():
+        store = get_storage(lock_id)
+        if not code_expiry_due(store.read_state()): continue
+        with store.transaction() as tx:
+            if code_expiry_due(tx): tx["current_code"] = dict(tx["current_code"], expired=True); expired += 1
+    return expired
+
+def code_expiry_due(data: Dict[str, Any]) -> bool:
+    code = data.get("current_code", {})
+    return bool(code.get("value")) and not code.get("expired") and not is_code_valid(code)
+
+def prune_failed_attempts() -> int:
+    """Oublie les sources inactives du limiteur (mémoire du processus: dans chaque worker)."""
+    return access_limiter.prune()
+
+def reset_stale_failures() -> int:
+    """Remet à zéro les compteurs d'échecs persistés sortis de la fenêtre du limiteur."""
+    pruned = 0; now = datetime.now(); cutoff = (now - timedelta(seconds=access_limiter.window)).isoformat()
+    for lock_id in list_lock_ids():
+        store = get_storage(lock_id)
+        if not failures_stale(store.read_state(), cutoff): continue
+        with store.transaction() as tx:
+            if failures_stale(tx, cutoff):
+                tx["failed_attempts"] = dict(tx["failed_attempts"], count=0, last_reset=now.isoformat()); pruned += 1
+    return pruned
+
+def failures_stale(data: Dict[str, Any], cutoff: str) -> bool:
+    failed_attempts = data.get("failed_attempts", {})
+    return failed_attempts.get("count", 0) > 0 and failed_attempts.get("last_failure", {}).get("timestamp", "") < cutoff
+
+def compact_storage() -> int:
+    for lock_id in list_lock_ids(): get_storage(lock_id).compact()
+    return 0
+
+def refresh_aggregates() -> int:
+    return sum(reconcile_aggregates(get_storage(lock_id)) for lock_id in list_lock_ids())
+
+def raise_anomaly_alerts(lock_id: str, alerts: List[Tuple[str, str, str, str]]) -> None:
+    with get_storage(lock_id).transaction() as tx:
+        for alert_type, message, severity, subject in alerts: create_security_alert(tx, alert_type, message, severity, source=subject)
+
+def score_anomalies() -> int:
+    return anomaly_engine.run(raise_anomaly_alerts)
+
+# Tâches périodiques (secondes, 0 = désactivée): hors du chemin des requêtes, dans un thread unique par processus.
+# shared=True: stockage commun, exécutée par un seul worker (meneur); les autres portent sur la mémoire du processus
+scheduler = Scheduler(SCHEDULER_LOCK_FILE or f"{SQLITE_FILE if STORAGE_BACKEND == 'sqlite' else DATA_FILE}.scheduler.lock")
+scheduler.add_job("rotate_codes", max(1, min(60, CODE_ROTATION_INTERVAL // 10)) if CODE_ROTATION_INTERVAL > 0 else 0, rotate_codes, shared=True)
+scheduler.add_job("sweep_expired_codes", EXPIRY_SWEEP_INTERVAL, sweep_expired_codes, initial_delay=0, shared=True)
+scheduler.add_job("prune_failed_attempts", FAILURE_PRUNE_INTERVAL, prune_failed_attempts)
+scheduler.add_job("reset_stale_failures", FAILURE_PRUNE_INTERVAL, reset_stale_failures, shared=True)
+scheduler.add_job("compact_storage", STORAGE_COMPACT_INTERVAL, compact_storage, shared=True)
+scheduler.add_job("refresh_aggregates", AGGREGATES_REFRESH_INTERVAL, refresh_aggregates, shared=True)
+scheduler.add_job("score_anomalies", ANOMALY_SCORE_INTERVAL if ANOMALY_ENABLED else 0, score_anomalies)
+
+def start_background_jobs() -> bool:
+    """Démarre le planificateur et l'envoi des notifications (une fois par processus, arrêt à la sortie).
+
+    Appelé par api.py (serveur de développement) et par wsgi.py dans chaque worker gunicorn.
+    """
+    if notifier.start(): atexit.register(notifier.stop)
+    if not SCHEDULER_ENABLED or not scheduler.start(): return False
+    atexit.register(scheduler.stop)
+    return True
+
+@app.cli.command('run-jobs')
+@click.option('--job', 'jobs', multiple=True, help='Tâche à exécuter (toutes par défaut)')
+def run_jobs_command(jobs: Tuple[str, ...]) -> None:
+    """Exécute une fois les tâches planifiées (alternative à cron quand le serveur ne tourne pas)."""
+    scheduler.run_pending(force=True, names=set(jobs) or None)
+    for name, job in scheduler.stats()["jobs"].items():
+        if not jobs or name in jobs: click.echo(f"{name}: {job['last_result']} ({job['last_duration_ms']} ms, {job['failures']} échecs)")
+
+@app.cli.command('migrate-sqlite')
+@click.option('--source', default=DATA_FILE, show_default=True, help='Fichier codes.json à importer')
+@click.option('--target', default=SQLITE_FILE, show_default=True, help='Base SQLite de destination')
+def migrate_sqlite_command(source: str, target: str) -> None:
+    """Importe un codes.json existant dans une base SQLite (STORAGE_BACKEND=sqlite)."""
+    try: counts = migrate_json_to_sqlite(source, target)
+    except (OSError, ValueError, StorageError) as e: raise click.ClickException(str(e)) from e
+    click.echo(f"{counts['access_logs']} logs et {counts['alerts']} alertes importés dans {target}.")
+
+@app.cli.command('rebuild-rollups')
+@click.option('--lock', 'lock_ids', multiple=True, help='Cadenas à traiter (tous par défaut)')
+def rebuild_rollups_command(lock_ids: Tuple[str, ...]) -> None:
+    """Redérive les séries de /api/stats depuis tout l'historique, archive comprise (données antérieures aux séries)."""
+    for lock_id in lock_ids or list_lock_ids():
+        if not is_valid_lock_id(lock_id) or not lock_exists(lock_id): raise click.ClickException(f"Cadenas inconnu: {lock_id}")
+        try: counts = rebuild_rollups(get_storage(lock_id))
+        except StorageError as e: raise click.ClickException(str(e)) from e
+        click.echo(f"{lock_id}: {counts['hour']} heures, {counts['day']} jours.")
 
 if __name__ == '__main__':
     api_host = os.getenv('API_HOST', '0.0.0.0')
     api_port = int(os.getenv('API_PORT', 5000))
-    if not os.path.exists(DATA_FILE):
-        logger.info(f"Fichier {DATA_FILE} n'existe pas. Création avec données par défaut.")
-        with open(DATA_FILE, 'w', encoding='utf-8') as f: json.dump(get_default_data(), f, indent=2, ensure_ascii=False)
-        logger.info(f"Fichier {DATA_FILE} créé.")
-    else:
-        logger.info(f"Vérification et mise à jour structure de {DATA_FILE}.")
-        loaded_data = load_data(); save_data(loaded_data)
-    logger.info(f"Démarrage serveur SmartCadenas API sur {api_host}:{api_port}")
-    app.run(host=api_host, port=api_port, debug=os.getenv('FLASK_ENV') == 'development')
\ No newline at end of file
+    debug = os.getenv('FLASK_ENV') == 'development'
+    get_storage().initialize()
+    # Avec le rechargeur (debug), le processus parent ne sert aucune requête: seul l'enfant (WERKZEUG_RUN_MAIN) planifie
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true': start_background_jobs()
+    logger.info("Démarrage serveur SmartCadenas API sur %s:%s", api_host, api_port)
+    app.run(host=api_host, port=api_port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,122 @@
+"""
+Archive froide des entrées sorties de la rétention SmartCadenas.
+
+Les logs et alertes évincés de l'état chaud (au-delà de MAX_LOGS / MAX_ALERTS) ne sont plus
+perdus: ils sont ajoutés à des segments gzip append-only, un par collection et par jour
+(access_logs-2026-10-17.jsonl.gz). Chaque ajout est un membre gzip indépendant, décrit par
+une ligne de index.jsonl (segment, offset, longueur, horodatages min/max, nombre d'entrées):
+une requête sur une plage de dates ne décompresse que les membres qui la recouvrent.
+
+zstd n'est pas dans la bibliothèque standard: gzip (zlib) est utilisé sans dépendance.
+"""
+
+import gzip
+import json
+import os
+import threading
+import zlib
+from typing import Any, Dict, Iterator, List, Optional
+
+ARCHIVE_COMPRESSION_LEVEL = int(os.getenv('ARCHIVE_COMPRESSION_LEVEL', 6))
+
+Member = Dict[str, Any]
+
+
+class LogArchive:
+    """Segments gzip append-only d'un cadenas, avec index des membres en mémoire tenu à jour depuis index.jsonl."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self._lock = threading.Lock()
+        self._members: Optional[Dict[str, List[Member]]] = None
+        # Fichier d'index déjà lu (inode) et octets consommés (lignes complètes uniquement)
+        self._index_inode: Optional[int] = None
+        self._index_offset = 0
+
+    def _load_index(self) -> Dict[str, List[Member]]:
+        """Index des membres, complété par les lignes ajoutées depuis la dernière lecture (autres processus compris).
+
+        Comme le cache JSON, l'index en mémoire est vérifié contre le fichier (inode, taille) à chaque
+        appel: seule la fin ajoutée est relue; un index remplacé ou raccourci est relu en entier.
+        """
+        try: st = os.stat(self.index_path)
+        except OSError: st = None
+        if self._members is None or st is None or st.st_ino != self._index_inode or st.st_size < self._index_offset:
+            self._members = {}; self._index_offset = 0
+            self._index_inode = st.st_ino if st is not None else None
+        if st is None or st.st_size == self._index_offset: return self._members
+        with open(self.index_path, 'rb') as file:
+            file.seek(self._index_offset); tail = file.read(st.st_size - self._index_offset)
+        # Une dernière ligne sans saut de ligne est en cours d'écriture: relue au prochain appel
+        complete = tail[:tail.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            # Ligne tronquée par un arrêt brutal: le membre correspondant n'est pas référencé
+            try: member = json.loads(line)
+            except ValueError: continue
+            self._members.setdefault(member["collection"], []).append(member)
+        self._index_offset += len(complete)
+        return self._members
+
+    def append(self, collection: str, items: List[Dict[str, Any]], skip_archived: bool = False) -> int:
+        """Ajoute des entrées évincées (un membre gzip par jour concerné); fsync avant de rendre la main.
+
+        skip_archived écarte les entrées déjà présentes (même id) dans les membres qui recoupent
+        leur plage: utilisé au rejeu d'un journal, qui peut refaire une éviction déjà archivée.
+        """
+        if items and skip_archived:
+            timestamps = [item.get("timestamp", "") for item in items]
+            archived = {entry.get("id") for member in self.members(collection, min(timestamps), max(timestamps))
+                        for entry in self.read_member(member)}
+            items = [item for item in items if item.get("id") not in archived]
+        if not items: return 0
+        by_day: Dict[str, List[Dict[str, Any]]] = {}
+        for item in items: by_day.setdefault(item.get("timestamp", "")[:10] or "undated", []).append(item)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            new_members = []
+            for day, day_items in sorted(by_day.items()):
+                segment = f"{collection}-{day}.jsonl.gz"
+                payload = "".join(json.dumps(item, ensure_ascii=False) + "\n" for item in day_items).encode('utf-8')
+                with open(os.path.join(self.directory, segment), 'ab') as file:
+                    offset = file.tell()
+                    file.write(gzip.compress(payload, compresslevel=ARCHIVE_COMPRESSION_LEVEL, mtime=0))
+                    file.flush(); os.fsync(file.fileno())
+                    length = file.tell() - offset
+                timestamps = [item.get("timestamp", "") for item in day_items]
+                new_members.append({"collection": collection, "segment": segment, "offset": offset, "length": length,
+                                    "min_ts": min(timestamps), "max_ts": max(timestamps), "count": len(day_items)})
+            # L'index n'est écrit qu'après les données: un membre indexé est toujours complet sur disque
+            self._load_index()
+            with open(self.index_path, 'ab') as file:
+                # Fin d'index tronquée par un arrêt brutal: isolée sur sa propre ligne (ignorée à la lecture)
+                if file.tell() > self._index_offset: file.write(b"\n")
+                file.write(b"".join(json.dumps(m, ensure_ascii=False).encode('utf-8') + b"\n" for m in new_members))
+                file.flush(); os.fsync(file.fileno())
+            # Les nouveaux membres sont pris en compte par la relecture de la fin de l'index
+            self._load_index()
+        return len(items)
+
+    def members(self, collection: str, since: Optional[str] = None, until: Optional[str] = None) -> List[Member]:
+        """Membres dont la plage [min_ts, max_ts] recoupe [since, until], du plus récent au plus ancien."""
+        with self._lock: members = list(self._load_index().get(collection, []))
+        overlapping = [m for m in members if (since is None or m["max_ts"] >= since) and (until is None or m["min_ts"] <= until)]
+        return sorted(overlapping, key=lambda m: m["max_ts"], reverse=True)
+
+    def read_member(self, member: Member) -> List[Dict[str, Any]]:
+        with open(os.path.join(self.directory, member["segment"]), 'rb') as file:
+            file.seek(member["offset"]); raw = file.read(member["length"])
+        # wbits=31: un seul membre gzip, lu à son offset sans décompresser le reste du segment
+        payload = zlib.decompressobj(wbits=31).decompress(raw).rstrip(b"\n")
+        # json.dumps échappe les sauts de ligne: les lignes deviennent un tableau JSON décodé en un seul appel
+        return json.loads(b"[" + payload.replace(b"\n", b",") + b"]") if payload else []
+
+    def iter_items(self, collection: str, since: Optional[str] = None, until: Optional[str] = None) -> Iterator[List[Dict[str, Any]]]:
+        for member in self.members(collection, since, until): yield self.read_member(member)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock: members = self._load_index()
+        return {collection: {"segments": len({m["segment"] for m in items}), "members": len(items),
+                             "records": sum(m["count"] for m in items), "bytes": sum(m["length"] for m in items),
+                             "oldest": min((m["min_ts"] for m in items), default=None)}
+                for collection, items in members.items()}
@@ -0,0 +1,676 @@
+#!/usr/bin/env python3
+"""
+Benchmarks de l'API SmartCadenas - exécutés en processus via le client de test Flask
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# Les benchmarks ne doivent pas toucher au codes.json de travail ni remplir app.log
+# Les processus de bench_workers (spawn) réimportent ce module: ils héritent du répertoire du parent
+WORK_DIR = os.environ.get("SMARTCADENAS_BENCH_DIR") or tempfile.mkdtemp(prefix="smartcadenas-bench-")
+os.environ["SMARTCADENAS_BENCH_DIR"] = WORK_DIR
+os.environ.setdefault("DATA_FILE", os.path.join(WORK_DIR, "codes.json"))
+os.environ.setdefault("LOG_FILE", os.path.join(WORK_DIR, "app.log"))
+os.environ.setdefault("SQLITE_FILE", os.path.join(WORK_DIR, "smartcadenas.db"))
+os.environ.setdefault("LOCKS_DIR", os.path.join(WORK_DIR, "locks"))
+
+import api  # noqa: E402  pylint: disable=wrong-import-position
+from anomaly import ANOMALY_MAX_EVENTS, ANOMALY_WINDOW_SECONDS, AnomalyEngine, np  # noqa: E402  pylint: disable=wrong-import-position
+from archive import LogArchive  # noqa: E402  pylint: disable=wrong-import-position
+from limiter import SlidingWindowLimiter  # noqa: E402  pylint: disable=wrong-import-position
+from logconfig import TEXT_FORMAT, NonBlockingQueueHandler, SizeTimedRotatingFileHandler  # noqa: E402  pylint: disable=wrong-import-position
+from metrics import metrics  # noqa: E402  pylint: disable=wrong-import-position
+from notify import Notifier, WebhookTarget  # noqa: E402  pylint: disable=wrong-import-position
+from rollups import fold_document, rebuild  # noqa: E402  pylint: disable=wrong-import-position
+import storage  # noqa: E402  pylint: disable=wrong-import-position
+from storage import BACKENDS, JOURNAL_COMPACT_THRESHOLD, MAX_ALERTS, MAX_LOGS, add_commit_listener, get_storage  # noqa: E402  pylint: disable=wrong-import-position
+
+logging.disable(logging.WARNING)
+
+# Threads par processus dans bench_workers (un worker gunicorn gthread)
+STRESS_THREADS = int(os.getenv("STRESS_THREADS", 4))
+STRESS_MAX_WORKERS = 64
+
+
+def build_dataset(n_logs: int) -> Dict[str, Any]:
+    """Construit un état avec n_logs entrées d'accès et un code valide"""
+    data = api.get_default_data()
+    start = datetime.now() - timedelta(seconds=n_logs)
+    statuses = ("success", "failed", "warning")
+    data["access_logs"] = [
+        {"event": "door_open" if i % 2 == 0 else "door_close", "code_used": f"{i % 10000:04d}",
+         "agent": f"agent-{i % 50}", "timestamp": (start + timedelta(seconds=i)).isoformat(),
+         "ip_address": f"10.0.{(i // 256) % 256}.{i % 256}", "status": statuses[i % 3],
+         "reason": "code_incorrect" if i % 3 == 1 else None}
+        for i in range(n_logs)
+    ]
+    now = datetime.now()
+    data["current_code"] = {"value": "1234", "generated_at": now.isoformat(),
+                            "valid_until": (now + timedelta(hours=1)).isoformat(),
+                            "used": False, "used_for_entry": False}
+    return data
+
+
+def write_dataset(data: Dict[str, Any]) -> None:
+    """Écrit l'état directement sur disque (sans la troncature MAX_LOGS du backend)"""
+    store = get_storage()
+    with open(store.path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=2, ensure_ascii=False)
+    store.cache.invalidate()
+
+
+def measure(func: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    """Mesure la latence de func en millisecondes"""
+    samples: List[float] = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {"mean_ms": round(statistics.fmean(samples), 4),
+            "p50_ms": round(samples[len(samples) // 2], 4),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 4)}
+
+
+def bench_cache(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """Latence de GET /api/code avec et sans le cache d'état"""
+    client = api.app.test_client()
+    store = get_storage()
+    results = []
+    for size in sizes:
+        write_dataset(build_dataset(size))
+        row: Dict[str, Any] = {"logs": size}
+        for label, enabled in (("sans_cache", False), ("avec_cache", True)):
+            store.cache_enabled = enabled
+            store.cache.invalidate()
+            client.get('/api/code')
+            # Moins d'itérations sans cache sur les gros jeux de données: chaque appel relit tout le fichier
+            runs = iterations if enabled else max(5, iterations // max(1, size // 1000))
+            row[label] = measure(lambda: client.get('/api/code'), runs)
+        row["acceleration"] = round(row["sans_cache"]["mean_ms"] / row["avec_cache"]["mean_ms"], 1)
+        row["cache"] = store.cache.stats()
+        results.append(row)
+    store.cache_enabled = True
+    return results
+
+
+def bench_filters(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """Latence de GET /api/logs filtré (index secondaires) face à un parcours complet des logs"""
+    client = api.app.test_client()
+    store = get_storage()
+    queries = {"selectif": {"ip_address": "10.0.3.7", "status": "failed"},
+               "peu_selectif": {"status": "success"},
+               "combine": {"agent": "agent-8", "event": "door_open", "status": "failed"}}
+    results = []
+    for size in sizes:
+        write_dataset(build_dataset(size))
+        logs = store.load()["access_logs"]
+        started = time.perf_counter()
+        client.get('/api/logs', query_string={"status": "success", "per_page": 1})
+        row: Dict[str, Any] = {"logs": size, "construction_index_ms": round((time.perf_counter() - started) * 1000, 2)}
+        for label, filters in queries.items():
+            params = dict(filters, per_page=50)
+            matches = sum(1 for log in logs if all(log.get(k) == v for k, v in filters.items()))
+            row[label] = {"correspondances": matches,
+                          "index": measure(lambda: client.get('/api/logs', query_string=params), iterations),
+                          # Ce que devait faire un client: tout parcourir pour garder les 50 plus récents
+                          "parcours": measure(lambda: [log for log in reversed(logs)
+                                                       if all(log.get(k) == v for k, v in filters.items())][:50],
+                                              max(5, iterations // max(1, size // 1000)))}
+        results.append(row)
+    return results
+
+
+def bench_code_check(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:  # pylint: disable=unused-argument
+    """Coût de is_code_valid sur le chemin des requêtes: date ISO à analyser, échéance en heure Unix, drapeau expired"""
+    now = datetime.now(); valid_until = now + timedelta(minutes=5)
+    variants = {
+        "iso_valid_until": {"value": "1234", "valid_until": valid_until.isoformat()},
+        "expires_at": {"value": "1234", "valid_until": valid_until.isoformat(), "expires_at": valid_until.timestamp()},
+        "drapeau_expired": {"value": "1234", "valid_until": now.isoformat(), "expires_at": now.timestamp(), "expired": True},
+    }
+    results = []
+    for size in sizes:
+        row: Dict[str, Any] = {"appels": size}
+        for label, code in variants.items():
+            started = time.perf_counter()
+            for _ in range(size): api.is_code_valid(code)
+            row[f"{label}_ns"] = round((time.perf_counter() - started) / size * 1e9, 1)
+        # Balayage du planificateur: un passage sans code échu ne fait que des lectures
+        started = time.perf_counter(); api.sweep_expired_codes()
+        row["balayage_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        results.append(row)
+    return results
+
+
+def bench_export(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:  # pylint: disable=unused-argument
+    """Débit de /api/logs/export sur `size` enregistrements (archive + état chaud) et mémoire maximale du processus"""
+    client = api.app.test_client()
+    store = get_storage()
+    results = []
+    for size in sizes:
+        # L'archive est remplie par paquets générés à la volée: le jeu de données n'est jamais entièrement en mémoire
+        shutil.rmtree(store.archive.directory, ignore_errors=True)
+        store.archive = LogArchive(store.archive.directory)
+        hot = min(size, 1000); start = datetime.now() - timedelta(seconds=size)
+        for chunk_start in range(0, size - hot, 1000):
+            chunk = build_dataset(min(1000, size - hot - chunk_start))["access_logs"]
+            for offset, entry in enumerate(chunk):
+                entry["id"] = chunk_start + offset + 1
+                entry["timestamp"] = (start + timedelta(seconds=chunk_start + offset)).isoformat()
+            store.archive.append("access_logs", chunk)
+        data = build_dataset(hot)
+        for offset, entry in enumerate(data["access_logs"]): entry["id"] = size - hot + offset + 1
+        data["sequences"] = {"access_logs": size}
+        write_dataset(data)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        row: Dict[str, Any] = {"records": size, "archive": store.archive.stats().get("access_logs")}
+        for label, url, headers in (("ndjson", '/api/logs/export', {}), ("csv", '/api/logs/export?format=csv', {}),
+                                    ("ndjson_gzip", '/api/logs/export', {"Accept-Encoding": "gzip"})):
+            started = time.perf_counter()
+            response = client.get(url, headers=headers, buffered=False)
+            sent = sum(len(chunk) for chunk in response.response)
+            response.close()
+            elapsed = time.perf_counter() - started
+            row[label] = {"seconds": round(elapsed, 2), "records_per_s": round(size / elapsed), "mb": round(sent / 1e6, 1),
+                          "mb_per_s": round(sent / 1e6 / elapsed, 1)}
+        # ru_maxrss (Ko sous Linux): une hausse nulle pendant les exports montre une mémoire plate
+        row["rss_max_mb"] = {"avant": round(rss_before / 1024, 1),
+                             "apres": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+        results.append(row)
+    return results
+
+
+def bench_stats(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """GET /api/stats sur un mois de séries horaires face au recalcul depuis les logs bruts, coût de reconstruction et de mise à jour"""
+    client = api.app.test_client()
+    results = []
+    for size in sizes:
+        data = build_dataset(size)
+        # Un mois d'historique, réparti uniformément
+        start = datetime.now() - timedelta(days=30); step = 30 * 86400 / size
+        for i, entry in enumerate(data["access_logs"]): entry["timestamp"] = (start + timedelta(seconds=i * step)).isoformat()
+        logs = data["access_logs"]
+        started = time.perf_counter(); data["rollups"] = rebuild(logs, [])
+        row: Dict[str, Any] = {"logs": size, "reconstruction_s": round(time.perf_counter() - started, 3),
+                               "intervalles_heure": len(data["rollups"]["hour"])}
+        write_dataset(data)
+        params = {"granularity": "hour", "since": start.isoformat()}
+        client.get('/api/stats', query_string=params)
+        row["api_stats"] = measure(lambda: client.get('/api/stats', query_string=params), iterations)
+
+        def raw_scan() -> Dict[str, List[int]]:
+            # Ce que devait faire un graphique: relire chaque log de la plage et compter par heure
+            buckets: Dict[str, List[int]] = {}
+            for log in logs:
+                counts = buckets.setdefault(log["timestamp"][:13], [0, 0, 0])
+                counts[("success", "failed", "warning").index(log["status"])] += 1
+            return buckets
+
+        row["parcours_logs"] = measure(raw_scan, max(3, iterations // max(1, size // 1000)))
+        # Surcoût d'écriture: un événement replié dans les séries (deux intervalles décodés et réencodés)
+        rollups = data["rollups"]; event = dict(logs[-1])
+        row["repli_par_evenement_us"] = round(measure(lambda: fold_document(rollups, [event], []), iterations * 10)["mean_ms"] * 1000, 2)
+        results.append(row)
+    return results
+
+
+def bench_metrics(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """Surcoût de l'instrumentation: coût unitaire des séries et écart de latence d'une requête avec/sans métriques"""
+    client = api.app.test_client()
+    results = []
+    for size in sizes:
+        labels = (("endpoint", "versionresource"), ("method", "GET"), ("status", "200"))
+        started = time.perf_counter()
+        for _ in range(size): metrics.observe("smartcadenas_http_request_duration_seconds", labels, 0.0012)
+        observe_us = (time.perf_counter() - started) / size * 1e6
+        started = time.perf_counter()
+        for _ in range(size): metrics.inc("smartcadenas_logs_appended_total", (("lock_id", "default"), ("status", "success")))
+        inc_us = (time.perf_counter() - started) / size * 1e6
+        # Les deux hooks de requête exécutés seuls, dans un contexte de requête réel
+        with api.app.test_request_context('/api/version'):
+            response = api.app.response_class(status=200)
+            started = time.perf_counter()
+            for _ in range(size): api.start_request_timer(); api.record_request_metrics(response)
+            hooks_us = (time.perf_counter() - started) / size * 1e6
+        row: Dict[str, Any] = {"operations": size, "observe_us": round(observe_us, 3), "inc_us": round(inc_us, 3),
+                               "hooks_par_requete_us": round(hooks_us, 3)}
+        # Requêtes avec et sans métriques en alternance: le bruit (GC, caches) touche les deux séries de la même façon
+        samples: Dict[bool, List[float]] = {False: [], True: []}
+        for i in range(2 * iterations):
+            metrics.enabled = bool(i % 2)
+            started = time.perf_counter(); client.get('/api/version')
+            samples[metrics.enabled].append((time.perf_counter() - started) * 1e6)
+        for label, enabled in (("requete_sans_metriques_us", False), ("requete_avec_metriques_us", True)):
+            row[label] = {"p50": round(statistics.median(samples[enabled]), 1), "mean": round(statistics.fmean(samples[enabled]), 1)}
+        row["ecart_p50_us"] = round(row["requete_avec_metriques_us"]["p50"] - row["requete_sans_metriques_us"]["p50"], 1)
+        started = time.perf_counter(); body = client.get('/metrics').data
+        row["scrape"] = {"ms": round((time.perf_counter() - started) * 1000, 2), "octets": len(body)}
+        results.append(row)
+    metrics.enabled = True
+    return results
+
+
+def bench_logging(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:  # pylint: disable=unused-argument
+    """Coût d'une ligne de log pour le thread appelant: FileHandler synchrone, file + thread d'écriture, DEBUG filtré"""
+    logging.disable(logging.NOTSET)
+    results = []
+    for size in sizes:
+        row: Dict[str, Any] = {"lignes": size}
+        for mode in ("synchrone", "file", "debug_filtre"):
+            path = os.path.join(WORK_DIR, f"bench-{mode}.log")
+            sink = (SizeTimedRotatingFileHandler(path) if mode == "file" else logging.FileHandler(path, encoding='utf-8'))
+            sink.setFormatter(logging.Formatter(TEXT_FORMAT))
+            bench_logger = logging.getLogger(f"bench.{mode}"); bench_logger.propagate = False; bench_logger.setLevel(logging.INFO)
+            log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(size + 1)
+            listener = None
+            if mode == "synchrone": bench_logger.handlers = [sink]
+            else:
+                bench_logger.handlers = [NonBlockingQueueHandler(log_queue)]
+                listener = logging.handlers.QueueListener(log_queue, sink); listener.start()
+            emit = bench_logger.debug if mode == "debug_filtre" else bench_logger.info
+            started = time.perf_counter()
+            for i in range(size): emit("Accesso API: Evento '%s' elaborato per codice '%s'. Stato: %s", "door_open", i, "success")
+            caller_us = (time.perf_counter() - started) / size * 1e6
+            # Le thread d'écriture vide la file: temps total jusqu'à la dernière ligne sur disque
+            if listener: listener.stop()
+            total_ms = (time.perf_counter() - started) * 1000
+            sink.close()
+            row[mode] = {"appelant_us": round(caller_us, 2), "total_ms": round(total_ms, 1),
+                         "octets": os.path.getsize(path) if os.path.exists(path) else 0}
+        results.append(row)
+    logging.disable(logging.WARNING)
+    return results
+
+
+def bench_limiter(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """Coût du limiteur sous une inondation de force brute depuis `size` adresses IP distinctes"""
+    client = api.app.test_client()
+    results = []
+    for size in sizes:
+        limiter = SlidingWindowLimiter()
+        ips = [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}" for i in range(size)]
+        counter = iter(range(10 ** 9))
+
+        def failure() -> None:
+            key = [("default", "ip", ips[next(counter) % size])]
+            if not limiter.retry_after(key): limiter.record_failure(key, 3)
+
+        # Trois passes: chaque adresse atteint max_attempts et se fait bloquer
+        start = time.perf_counter()
+        for _ in range(3 * size): failure()
+        flood_seconds = time.perf_counter() - start
+        row: Dict[str, Any] = {"ips": size, "flood_ops_per_s": round(3 * size / flood_seconds),
+                               "per_request": measure(failure, max(iterations, 10000)), "limiter": limiter.stats()}
+
+        # Bout en bout: une source bloquée reçoit 429 sans lecture ni écriture du stockage
+        write_dataset(build_dataset(1000))
+        api.access_limiter.reset()
+        blocked = {"REMOTE_ADDR": "192.0.2.1"}
+        for _ in range(3):
+            client.post('/api/access', json={"event": "door_open", "code": "0000"}, environ_base=blocked)
+        row["api_429"] = measure(lambda: client.post('/api/access', json={"event": "door_open", "code": "0000"},
+                                                     environ_base=blocked), iterations)
+        addresses = iter(range(10 ** 9))
+        row["api_echec_journalise"] = measure(
+            lambda: client.post('/api/access', json={"event": "door_open", "code": "0000"},
+                                environ_base={"REMOTE_ADDR": f"198.51.{next(addresses) % 250}.{next(addresses) % 250}"}),
+            iterations)
+        results.append(row)
+    api.access_limiter.reset()
+    return results
+
+
+def _door_event(i: int, agent: str) -> Dict[str, Any]:
+    return {"event": "door_open" if i % 2 == 0 else "door_close", "code_used": "1234", "agent": agent,
+            "timestamp": datetime.now().isoformat(), "ip_address": "127.0.0.1", "status": "success", "reason": None}
+
+
+def _stress_worker(lock_id: str, worker: int, events: int, start: Any) -> None:
+    """Processus de bench_workers: STRESS_THREADS threads enchaînent des événements de porte sur le même cadenas"""
+    store = get_storage(lock_id)
+
+    def door_events(thread: int) -> None:
+        for i in range(thread, events, STRESS_THREADS):
+            with store.transaction() as tx: tx.append_log(_door_event(i, f"stress-{worker}"))
+
+    threads = [threading.Thread(target=door_events, args=(t,)) for t in range(STRESS_THREADS)]
+    start.wait()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+
+def bench_workers(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """`size` processus (STRESS_THREADS threads chacun) écrivent chacun `iterations` événements sur le même cadenas.
+
+    Vérifie qu'aucune écriture n'est perdue (agrégat logs_total, identifiants uniques) et mesure le débit.
+    Le cadenas part de MAX_LOGS logs: chaque passage écrit un document de taille stable, quel que soit le
+    nombre de processus.
+    """
+    # spawn: des processus vierges comme des workers gunicorn (un fork hériterait des verrous et threads du parent)
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in sizes:
+        workers = max(1, min(size, STRESS_MAX_WORKERS))
+        lock_id = f"stress-{workers}-{int(time.time() * 1000)}"
+        store = get_storage(lock_id)
+        with store.transaction() as tx:
+            for i in range(MAX_LOGS): tx.append_log(_door_event(i, "prefill"))
+        start = context.Event()
+        processes = [context.Process(target=_stress_worker, args=(lock_id, worker, iterations, start)) for worker in range(workers)]
+        for process in processes: process.start()
+        started = time.perf_counter(); start.set()
+        for process in processes: process.join()
+        elapsed = time.perf_counter() - started
+        expected = workers * iterations
+        written = store.read_state()["aggregates"]["logs_total"] - MAX_LOGS
+        ids = [log["id"] for log in store.page_logs(0, expected)[0]]
+        results.append({"processus": workers, "threads": STRESS_THREADS, "evenements": expected,
+                        "secondes": round(elapsed, 3), "evenements_par_s": round(expected / elapsed, 1),
+                        "perdus": expected - written, "ids_dupliques": len(ids) - len(set(ids)),
+                        "echecs_processus": sum(1 for process in processes if process.exitcode != 0)})
+    return results
+
+
+# Anomalies plantées dans le flux synthétique de bench_anomalies: (cadenas, type de constat, sujet)
+PLANTED_ANOMALIES = {("lock-0", "failure_rate", "203.0.113.7"), ("lock-1", "distributed_guessing", "*"),
+                     ("lock-2", "scripted_attempts", "192.0.2.50"), ("lock-3", "odd_hour", "intrus"),
+                     ("lock-4", "incomplete_cycles", "oubli")}
+
+
+def _access_stream(size: int, now: float, chunk: int = 100000) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Une semaine d'accès de jour (ouverture puis fermeture par le même agent) sur 20 cadenas, par paquets, puis les anomalies plantées"""
+    rng = random.Random(size); start = now - ANOMALY_WINDOW_SECONDS + 3600
+    ips = max(20, size // 2000); agents = max(10, size // 500)
+
+    def entry(at: float, event: str, status: str, ip_address: str, agent: str) -> Dict[str, Any]:
+        return {"timestamp": datetime.fromtimestamp(at).isoformat(), "event": event, "status": status,
+                "reason": "code_incorrect" if status == "failed" else None, "ip_address": ip_address, "agent": agent}
+
+    batch: Dict[str, List[Dict[str, Any]]] = {}; produced = 0
+    while produced < size:
+        day = start + rng.randrange(6) * 86400
+        at = day - (day + time.localtime(day).tm_gmtoff) % 86400 + rng.uniform(8, 19) * 3600
+        lock_id = f"lock-{rng.randrange(20)}"; source = rng.randrange(ips); ip_address = f"10.1.{source // 256}.{source % 256}"
+        agent = f"agent-{rng.randrange(agents)}"
+        if rng.random() < 0.1:
+            batch.setdefault(lock_id, []).append(entry(at, "door_open", "failed", ip_address, agent)); produced += 1
+        else:
+            batch.setdefault(lock_id, []).extend([entry(at, "door_open", "success", ip_address, agent),
+                                                  entry(at + 60, "door_close", "success", ip_address, agent)]); produced += 2
+        if produced % chunk < 2:
+            yield from batch.items(); batch = {}
+    yield from batch.items()
+    yield "lock-0", sorted((entry(rng.uniform(start, now), "door_open", "failed", "203.0.113.7", "inconnu") for _ in range(8)),
+                           key=lambda item: item["timestamp"])
+    yield "lock-1", [entry(now - i * 3000, "door_open", "failed", f"198.51.100.{i}", "inconnu") for i in range(15)]
+    yield "lock-2", [entry(now - 7200 + i * 30, "door_open", "failed", "192.0.2.50", "script") for i in range(12)]
+    midnight = now - (now + time.localtime(now).tm_gmtoff) % 86400
+    yield "lock-3", [entry(midnight - 21 * 3600, "door_open", "success", "10.9.9.9", "intrus")]
+    yield "lock-4", [entry(midnight - 86400 * i + 10 * 3600, "door_open", "success", "10.9.9.8", "oubli") for i in range(1, 5)]
+
+
+def bench_anomalies(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:  # pylint: disable=unused-argument
+    """Ingestion et passage de score du moteur d'anomalies sur `size` accès, et anomalies plantées retrouvées.
+
+    Avec NumPy, les deux moteurs traitent le même flux: numpy_identique_python compare leurs constats (sujet et score).
+    """
+    results = []
+    engines = ("numpy", "python") if np is not None else ("python",)
+    for size in sizes:
+        now = time.time(); row: Dict[str, Any] = {"evenements": size}; findings = {}
+        for label in engines:
+            engine = AnomalyEngine(max_events=max(ANOMALY_MAX_EVENTS, size + 1000), vectorized=label == "numpy")
+            ingestion = 0.0
+            for lock_id, entries in _access_stream(size, now):
+                engine.on_commit(lock_id, {}, SimpleNamespace(new_logs=entries))
+                started = time.perf_counter(); engine.ingest(); ingestion += time.perf_counter() - started
+            raised: List[Tuple[str, str, str, str]] = []
+            started = time.perf_counter()
+            engine.run(lambda lock_id, alerts: raised.extend(alerts), now=now)
+            scoring = time.perf_counter() - started
+            found = {(f["lock_id"], f["kind"], f["subject"]) for f in engine.last_findings}
+            findings[label] = sorted((f["lock_id"], f["kind"], f["subject"], f["score"]) for f in engine.last_findings)
+            # Un même sujet planté peut lever plusieurs constats (un script est aussi un fort taux d'échec)
+            planted_subjects = {(lock_id, subject) for lock_id, _, subject in PLANTED_ANOMALIES}
+            row[label] = {"ingestion_s": round(ingestion, 2), "score_s": round(scoring, 3),
+                          "evenements_par_s": round(size / scoring), "alertes": len(raised),
+                          "plantees_trouvees": f"{len(PLANTED_ANOMALIES & found)}/{len(PLANTED_ANOMALIES)}",
+                          "faux_positifs": sorted(list(f) for f in found if (f[0], f[2]) not in planted_subjects)[:5]}
+        if len(findings) == 2: row["numpy_identique_python"] = findings["numpy"] == findings["python"]
+        results.append(row)
+    return results
+
+
+def _storage_bytes(backend: str) -> float:
+    counters = metrics.snapshot().counters
+    return sum(value for (name, labels), value in counters.items()
+               if name == "smartcadenas_storage_bytes_total" and ("backend", backend) in labels and labels[1][1] in ("write", "append"))
+
+
+def bench_journal(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """Octets écrits et latence par événement de porte selon la taille de l'historique: document JSON réécrit contre journal.
+
+    L'historique (`size` logs) est dans l'instantané de départ; MAX_LOGS est relevé le temps de la mesure pour qu'il
+    reste dans l'état chaud. La compaction du journal est mesurée à part: un instantané complet, amorti sur les
+    événements qui remplissent JOURNAL_COMPACT_THRESHOLD lignes.
+    """
+    results = []
+    saved_max_logs = storage.MAX_LOGS
+    try:
+        for size in sizes:
+            row: Dict[str, Any] = {"historique": size}
+            storage.MAX_LOGS = size + iterations + 1
+            for backend in ("json", "journal"):
+                path = os.path.join(WORK_DIR, f"journal-{backend}-{size}.json")
+                with open(path, 'w', encoding='utf-8') as file: json.dump(build_dataset(size), file, ensure_ascii=False)
+                store = BACKENDS[backend](path) if backend == "json" else BACKENDS[backend](path, compact_threshold=10 ** 9)
+                store.initialize()
+                # Le document JSON est réécrit à chaque événement: nombre de mesures borné sur les gros historiques
+                count = iterations if backend == "journal" else max(5, min(iterations, 2_000_000 // max(size, 1)))
+                written_before = _storage_bytes(backend); started = time.perf_counter()
+                for i in range(count):
+                    with store.transaction() as tx:
+                        tx.append_log({"event": "door_open", "timestamp": datetime.now().isoformat(), "ip_address": "10.1.0.1",
+                                       "agent": "bench", "status": "success", "code_used": f"{i % 10000:04d}"})
+                entry: Dict[str, Any] = {"evenements": count, "us_par_evenement": round((time.perf_counter() - started) / count * 1e6, 1),
+                                         "octets_ecrits_par_evenement": round((_storage_bytes(backend) - written_before) / count)}
+                if backend == "journal":
+                    lines = store._journal_lines  # pylint: disable=protected-access
+                    started = time.perf_counter(); store.compact(); compact_s = time.perf_counter() - started
+                    snapshot = os.path.getsize(path); events_per_compaction = JOURNAL_COMPACT_THRESHOLD / max(1.0, lines / count)
+                    entry.update(compaction_ms=round(compact_s * 1000, 1), compaction_octets=snapshot,
+                                 octets_amortis_par_evenement=round(entry["octets_ecrits_par_evenement"] + snapshot / events_per_compaction))
+                row[backend] = entry
+            results.append(row)
+    finally:
+        storage.MAX_LOGS = saved_max_logs
+    return results
+
+
+def bench_alert_storm(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:  # pylint: disable=unused-argument
+    """Attaque soutenue: `size` alertes identiques (même type, source, sévérité) par backend, avec et sans déduplication.
+
+    Compte les alertes conservées, les octets écrits (json: documents, journal: lignes ajoutées; sqlite: pages WAL,
+    non mesurées), la croissance des fichiers et vérifie qu'une alerte d'un autre type levée avant l'attaque est
+    toujours dans l'état chaud.
+    """
+    results = []
+    for size in sizes:
+        row: Dict[str, Any] = {"alertes_emises": size}
+        for backend in ("json", "journal", "sqlite"):
+            for label, window in (("sans_deduplication", 0), ("deduplication", 600)):
+                path = os.path.join(WORK_DIR, f"storm-{backend}-{label}-{size}.{'db' if backend == 'sqlite' else 'json'}")
+                store = BACKENDS[backend](path); store.initialize(); store.coalesce_window = window
+                with store.transaction() as tx: api.create_security_alert(tx, "tamper", "Boîtier ouvert", "critical", source="capteur")
+                files = [path, f"{path}.journal"]
+                disk_before = sum(os.path.getsize(f) for f in files if os.path.exists(f)); written_before = _storage_bytes(backend)
+                started = time.perf_counter()
+                for i in range(size):
+                    with store.transaction() as tx:
+                        api.create_security_alert(tx, "multiple_failed_attempts", f"{i} tentatives échouées depuis 203.0.113.7", "high",
+                                                  source="203.0.113.7")
+                elapsed = time.perf_counter() - started
+                if backend == "sqlite": store._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")  # pylint: disable=protected-access
+                grown = sum(os.path.getsize(f) for f in files if os.path.exists(f)) - disk_before
+                alerts, total = store.page_alerts(0, MAX_ALERTS, include_resolved=True)
+                row.setdefault(backend, {})[label] = {
+                    "us_par_alerte": round(elapsed / size * 1e6, 1), "alertes_conservees": total,
+                    "occurrences_max": max((alert.get("count", 1) for alert in alerts), default=0),
+                    "octets_ecrits_par_alerte": round((_storage_bytes(backend) - written_before) / size) if backend != "sqlite" else None,
+                    "croissance_octets": grown, "alerte_reelle_conservee": any(a["type"] == "tamper" for a in alerts)}
+        results.append(row)
+    return results
+
+
+class _SlowWebhook(BaseHTTPRequestHandler):
+    """Webhook de bench_notify: 100 ms par requête, comme un service distant lent"""
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(0.1)
+        self.send_response(204); self.end_headers()
+
+    def log_message(self, *args: Any) -> None:  # pylint: disable=arguments-differ
+        pass
+
+
+def bench_notify(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """Latence de déverrouillage (POST /api/code/verify) pendant `size` alertes critiques par seconde sur un autre cadenas.
+
+    Sans notification, puis notifiées à un webhook lent (100 ms) et à une destination hors service (connexion
+    refusée, disjoncteur): le chemin de la requête ne fait que déposer l'alerte, la latence ne doit pas bouger.
+    """
+    client = api.app.test_client()
+    write_dataset(build_dataset(1000))
+    client.post('/api/locks/storm/code')
+    slow = ThreadingHTTPServer(('127.0.0.1', 0), _SlowWebhook)
+    threading.Thread(target=slow.serve_forever, daemon=True).start()
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0)); dead_port = probe.getsockname()[1]
+    modes = {"sans_alertes": None, "alertes_sans_notification": None,
+             "webhook_lent": f"http://127.0.0.1:{slow.server_port}/hook", "cible_hors_service": f"http://127.0.0.1:{dead_port}/hook"}
+    current: List[Any] = [None]; serial = itertools.count()
+    add_commit_listener(lambda lock_id, previous, tx: current[0] and current[0].on_commit(lock_id, previous, tx))
+    results = []
+    for rate in sizes:
+        row: Dict[str, Any] = {"alertes_par_s": rate}
+        for label, url in modes.items():
+            notifier = current[0] = None
+            if url:
+                notifier = current[0] = Notifier([WebhookTarget(url, timeout=2)], spool_dir=os.path.join(WORK_DIR, f"notify-{label}-{rate}"))
+                notifier.start()
+            stop = threading.Event(); posted = [0]
+
+            def storm() -> None:
+                poster = api.app.test_client(); next_at = time.perf_counter()
+                while not stop.is_set():
+                    # Types distincts sur toute la série: chaque alerte est nouvelle (jamais coalescée), donc notifiée
+                    poster.post('/api/locks/storm/alert', json={"type": f"tamper-{next(serial)}", "message": "Boîtier ouvert", "severity": "critical"})
+                    posted[0] += 1; next_at += 1 / rate
+                    time.sleep(max(0.0, next_at - time.perf_counter()))
+
+            # Référence sans alertes: la tempête s'arrête avant sa première alerte
+            if label == "sans_alertes": stop.set()
+            poster = threading.Thread(target=storm, daemon=True)
+            poster.start()
+            started = time.perf_counter()
+            latency = measure(lambda: client.post('/api/code/verify', json={"code": "1234"}), iterations)
+            elapsed = time.perf_counter() - started
+            stop.set()
+            poster.join(timeout=5)
+            entry: Dict[str, Any] = dict(latency, alertes_emises=posted[0], alertes_par_s_reelles=round(posted[0] / elapsed))
+            if notifier is not None:
+                notifier.flush(5 if label == "webhook_lent" else 0.5)
+                target = notifier.stats()["targets"][0]
+                entry.update(livrees=target["delivered"], en_attente=target["pending"], disjoncteur=target["state"])
+                notifier.stop(); current[0] = None
+            row[label] = entry
+        results.append(row)
+    slow.shutdown(); slow.server_close()
+    return results
+
+
+def bench_verify(sizes: List[int], iterations: int) -> List[Dict[str, Any]]:
+    """Vérification d'un code: GET /api/code + comparaison côté client, contre POST /api/code/verify (JSON, texte, binaire)"""
+    client = api.app.test_client()
+    results = []
+    # Décodage côté appareil de chaque réponse (ArduinoJson / lecture de champs fixes): coût relatif, pas absolu
+    modes = {
+        "get_code_json": (lambda: client.get('/api/code'), lambda body: json.loads(body)["code"] == "1234"),
+        "verify_json": (lambda: client.post('/api/code/verify', json={"code": "1234"}), lambda body: json.loads(body)["valid"]),
+        "verify_texte": (lambda: client.post('/api/code/verify', data="1234", content_type='text/plain', headers={'Accept': 'text/plain'}),
+                         lambda body: body[0] == 48 and int(body[2:7])),
+        "verify_binaire": (lambda: client.post('/api/code/verify', data="1234", content_type='text/plain',
+                                               headers={'Accept': 'application/octet-stream'}),
+                           lambda body: api.VERIFY_STRUCT.unpack(body)[0] == 0),
+    }
+    for size in sizes:
+        write_dataset(build_dataset(size))
+        row: Dict[str, Any] = {"logs": size}
+        for label, (call, parse) in modes.items():
+            response = call(); body = response.data
+            header_bytes = sum(len(f"{name}: {value}\r\n") for name, value in response.headers.items())
+            started = time.perf_counter()
+            for _ in range(iterations): parse(body)
+            parse_us = (time.perf_counter() - started) / iterations * 1e6
+            row[label] = dict(measure(call, iterations), corps_octets=len(body), entetes_octets=header_bytes,
+                              decodage_us=round(parse_us, 3), code_expose=b"1234" in body)
+        results.append(row)
+    return results
+
+
+BENCHMARKS = {
+    "alert_storm": bench_alert_storm,
+    "anomalies": bench_anomalies,
+    "cache": bench_cache,
+    "code_check": bench_code_check,
+    "export": bench_export,
+    "filters": bench_filters,
+    "journal": bench_journal,
+    "limiter": bench_limiter,
+    "logging": bench_logging,
+    "metrics": bench_metrics,
+    "notify": bench_notify,
+    "stats": bench_stats,
+    "verify": bench_verify,
+    "workers": bench_workers,
+}
+
+
+def main() -> int:
+    """Point d'entrée principal"""
+    parser = argparse.ArgumentParser(description='Benchmarks API SmartCadenas')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS), help='Benchmark à exécuter')
+    parser.add_argument('--sizes', type=str, default="1000,10000,100000", help='Tailles de jeux de données')
+    parser.add_argument('--iterations', type=int, default=200, help='Itérations par mesure')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    results = BENCHMARKS[args.benchmark](sizes, args.iterations)
+    print(json.dumps({"benchmark": args.benchmark, "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
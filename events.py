@@ -0,0 +1,128 @@
+"""
+Diffusion des événements SmartCadenas en Server-Sent Events (SSE).
+
+Le broker est alimenté par les commits du stockage (add_commit_listener): tout ce qui est
+persisté (code généré, accès journalisé, alerte créée ou résolue) est poussé aux tableaux de
+bord abonnés, sans qu'ils aient à interroger l'API. Un abonné inactif ne coûte qu'un réveil
+toutes les SSE_KEEPALIVE secondes.
+
+Le broker est local au processus: avec plusieurs workers, un client ne reçoit que les
+événements du worker qui le sert. Chaque événement porte la version d'état du commit: le
+tableau de bord sonde /api/version à intervalle lent pendant que le flux est connecté et ne
+recharge que si la version dépasse la dernière reçue (écriture traitée par un autre worker).
+"""
+
+import json
+import os
+import queue
+import secrets
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+
+from storage import StateTransaction
+
+SSE_KEEPALIVE = float(os.getenv('SSE_KEEPALIVE', 15))
+SSE_MAX_CLIENTS = int(os.getenv('SSE_MAX_CLIENTS', 50))
+SSE_REPLAY_SIZE = int(os.getenv('SSE_REPLAY_SIZE', 256))
+SSE_QUEUE_SIZE = 100
+
+Event = Dict[str, Any]
+
+
+def events_from_commit(previous: Dict[str, Any], tx: StateTransaction) -> List[Tuple[str, Dict[str, Any]]]:
+    """Traduit une transaction validée en événements (type, données)."""
+    events: List[Tuple[str, Dict[str, Any]]] = []
+    code = tx.get("current_code") or {}
+    previous_code = previous.get("current_code") or {}
+    if code.get("generated_at") and code.get("generated_at") != previous_code.get("generated_at"):
+        events.append(("code_generated", {"code": code.get("value"), "generated_at": code.get("generated_at"),
+                                          "valid_until": code.get("valid_until")}))
+    elif code.get("expired") and not previous_code.get("expired") and code.get("generated_at") == previous_code.get("generated_at"):
+        events.append(("code_expired", {"generated_at": code.get("generated_at"), "valid_until": code.get("valid_until")}))
+    events += [("access_logged", entry) for entry in tx.new_logs]
+    events += [("alert_created", alert) for alert in tx.new_alerts]
+    events += [("alert_coalesced", alert) for alert in tx.coalesced]
+    events += [("alert_resolved", dict(fields, index=index)) for index, fields in tx.alert_updates.items()
+               if fields.get("resolved")]
+    return events
+
+
+def format_sse(event: Event) -> str:
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+class EventBroker:
+    """Abonnés SSE (une file bornée chacun) et tampon de rejeu pour la reconnexion (Last-Event-ID)."""
+
+    def __init__(self, max_clients: int = SSE_MAX_CLIENTS, replay_size: int = SSE_REPLAY_SIZE) -> None:
+        self.max_clients = max_clients
+        # Les identifiants sont préfixés par l'instance: après un redémarrage, un Last-Event-ID ancien force un resync
+        self._boot = secrets.token_hex(4)
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._replay: Deque[Event] = deque(maxlen=replay_size)
+        self._subscribers: Set[Tuple[queue.Queue, Optional[str]]] = set()
+
+    def on_commit(self, lock_id: str, previous: Dict[str, Any], tx: StateTransaction) -> None:
+        version = tx.get("version")
+        for event_type, data in events_from_commit(previous, tx): self.publish(event_type, data, lock_id, version)
+
+    def publish(self, event_type: str, data: Dict[str, Any], lock_id: str, version: Optional[int] = None) -> None:
+        with self._lock:
+            self._seq += 1
+            event = {"id": f"{self._boot}-{self._seq}", "seq": self._seq, "event": event_type,
+                     "data": dict(data, lock_id=lock_id, version=version), "lock_id": lock_id}
+            self._replay.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber, lock_filter in subscribers:
+            if lock_filter is None or lock_filter == lock_id: self._deliver(subscriber, event)
+
+    @staticmethod
+    def _deliver(subscriber: queue.Queue, event: Event) -> None:
+        try: subscriber.put_nowait(event)
+        except queue.Full:
+            # Client trop lent: on vide sa file et on lui demande de tout recharger
+            with subscriber.mutex: subscriber.queue.clear()
+            subscriber.put_nowait({"id": event["id"], "seq": event["seq"], "event": "resync", "data": {}})
+
+    def subscribe(self, lock_id: Optional[str]) -> Optional[Tuple[queue.Queue, Optional[str]]]:
+        with self._lock:
+            if len(self._subscribers) >= self.max_clients: return None
+            subscriber = (queue.Queue(maxsize=SSE_QUEUE_SIZE), lock_id)
+            self._subscribers.add(subscriber)
+            return subscriber
+
+    def unsubscribe(self, subscriber: Tuple[queue.Queue, Optional[str]]) -> None:
+        with self._lock: self._subscribers.discard(subscriber)
+
+    def _missed(self, last_event_id: Optional[str], lock_id: Optional[str]) -> Tuple[List[Event], int]:
+        """Événements postérieurs à last_event_id, ou un resync s'ils ne sont plus dans le tampon."""
+        with self._lock:
+            seq = self._seq
+            # Sans Last-Event-ID, la file de l'abonné ne contient que des événements postérieurs à l'abonnement
+            if not last_event_id: return [], 0
+            boot, _, last_seq = last_event_id.partition("-")
+            oldest = self._replay[0]["seq"] if self._replay else seq + 1
+            if boot != self._boot or not last_seq.isdigit() or int(last_seq) + 1 < oldest:
+                return [{"id": f"{self._boot}-{seq}", "seq": seq, "event": "resync", "data": {}}], seq
+            return [e for e in self._replay if e["seq"] > int(last_seq) and (lock_id is None or e["lock_id"] == lock_id)], seq
+
+    def stream(self, subscriber: Tuple[queue.Queue, Optional[str]], last_event_id: Optional[str] = None) -> Iterator[str]:
+        """Flux SSE d'un abonné; le désabonnement a lieu quand le client se déconnecte."""
+        events, last_seq = self._missed(last_event_id, subscriber[1])
+        try:
+            yield f"retry: 3000\n: connecté ({len(events)} événements manqués)\n\n"
+            for event in events: yield format_sse(event)
+            while True:
+                try: event = subscriber[0].get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    # Commentaire SSE: garde la connexion ouverte et détecte les clients partis
+                    yield ": keepalive\n\n"; continue
+                if event["seq"] <= last_seq and event["event"] != "resync": continue  # déjà envoyé par le rejeu
+                yield format_sse(event)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock: return {"subscribers": len(self._subscribers), "published": self._seq}
@@ -0,0 +1,66 @@
+"""
+Export en flux de l'historique SmartCadenas (logs d'accès, alertes) en NDJSON ou CSV.
+
+Les enregistrements arrivent d'un générateur (storage.iter_records) et sont sérialisés par
+paquets de EXPORT_BATCH: la réponse HTTP est produite au fil de l'eau, sans jamais
+matérialiser l'historique, avec compression gzip optionnelle.
+"""
+
+import csv
+import io
+import json
+import os
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List
+
+EXPORT_BATCH = int(os.getenv('EXPORT_BATCH', 500))
+
+EXPORT_FORMATS = {"ndjson": ("application/x-ndjson", "ndjson"), "csv": ("text/csv", "csv")}
+EXPORT_FIELDS = {
+    "access_logs": ["id", "timestamp", "event", "status", "reason", "code_used", "agent", "ip_address",
+                    "event_id", "client_timestamp"],
+    "alerts": ["id", "timestamp", "type", "severity", "message", "source", "count", "first_seen", "last_seen",
+               "resolved", "resolved_at", "resolved_by"],
+}
+_encoder = json.JSONEncoder(ensure_ascii=False)
+
+
+def _batches(records: Iterable[Dict[str, Any]]) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= EXPORT_BATCH: yield batch; batch = []
+    if batch: yield batch
+
+
+def ndjson_chunks(records: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    encode = _encoder.encode
+    for batch in _batches(records):
+        # "_index" (doublon de l'id côté alertes) n'est pas exporté
+        yield "".join(encode({k: v for k, v in record.items() if k != "_index"} if "_index" in record else record) + "\n"
+                      for record in batch)
+
+
+def csv_chunks(records: Iterable[Dict[str, Any]], fields: List[str]) -> Iterator[str]:
+    # Colonnes fixes par collection: un champ absent donne une cellule vide, un champ inconnu est ignoré
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore', lineterminator='\n')
+    writer.writeheader()
+    for batch in _batches(records):
+        writer.writerows(batch)
+        yield buffer.getvalue(); buffer.seek(0); buffer.truncate()
+    if buffer.tell(): yield buffer.getvalue()
+
+
+def export_chunks(records: Iterable[Dict[str, Any]], collection: str, export_format: str) -> Iterator[str]:
+    if export_format == "csv": return csv_chunks(records, EXPORT_FIELDS[collection])
+    return ndjson_chunks(records)
+
+
+def gzip_chunks(chunks: Iterable[str], level: int = 6) -> Iterator[bytes]:
+    """Compresse un flux de texte en un membre gzip unique, émis au fil des paquets."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data: yield data
+    yield compressor.flush()
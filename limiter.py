@@ -0,0 +1,110 @@
+"""
+Limiteur anti force brute de l'application SmartCadenas.
+
+Fenêtre glissante d'échecs par source (adresse IP, agent), tenue en mémoire: une source qui
+atteint max_attempts échecs dans la fenêtre est bloquée LOCKOUT_DURATION secondes, sans
+effet sur les autres sources. Chaque source ne garde que ses max_attempts derniers échecs
+et le nombre de sources suivies est borné (éviction LRU): mémoire et coût par requête
+restent constants même sous une inondation depuis des milliers d'adresses.
+
+L'état est propre au processus: sous gunicorn, chaque worker tient ses propres compteurs, et une
+source peut échouer jusqu'à (workers × max_attempts) fois avant d'être bloquée partout.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Hashable, Iterable, Optional, Tuple
+
+LIMITER_WINDOW = int(os.getenv('LIMITER_WINDOW', 900))
+LIMITER_MAX_KEYS = int(os.getenv('LIMITER_MAX_KEYS', 10000))
+LOCKOUT_DURATION = int(os.getenv('LOCKOUT_DURATION', 300))
+
+
+class _SourceState:
+    __slots__ = ("failures", "locked_until")
+
+    def __init__(self, limit: int) -> None:
+        self.failures: Deque[float] = deque(maxlen=limit)
+        self.locked_until = 0.0
+
+
+class SlidingWindowLimiter:
+    """Échecs récents et blocages par clé, clés évincées de la moins récemment vue à la plus récente."""
+
+    def __init__(self, window: float = LIMITER_WINDOW, lockout: float = LOCKOUT_DURATION,
+                 max_keys: int = LIMITER_MAX_KEYS) -> None:
+        self.window = window
+        self.lockout = lockout
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._sources: "OrderedDict[Hashable, _SourceState]" = OrderedDict()
+        self.failures = 0
+        self.lockouts = 0
+        self.rejected = 0
+        self.evictions = 0
+
+    def retry_after(self, keys: Iterable[Hashable], now: Optional[float] = None) -> float:
+        """Secondes avant déblocage si l'une des clés est bloquée, 0 sinon (la requête est alors comptée comme rejetée)."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            wait = 0.0
+            for key in keys:
+                source = self._sources.get(key)
+                if source is not None and source.locked_until > now:
+                    # Une source bloquée qui insiste reste en tête du LRU: elle ne peut pas se faire évincer
+                    wait = max(wait, source.locked_until - now); self._sources.move_to_end(key)
+            if wait: self.rejected += 1
+            return wait
+
+    def record_failure(self, keys: Iterable[Hashable], limit: int, now: Optional[float] = None) -> Tuple[int, bool]:
+        """Enregistre un échec pour chaque clé; retourne (plus grand nombre d'échecs dans la fenêtre, blocage déclenché)."""
+        now = time.monotonic() if now is None else now
+        limit = max(1, limit); highest = 0; locked = False
+        with self._lock:
+            self.failures += 1
+            for key in keys:
+                source = self._touch(key, limit)
+                failures = source.failures
+                failures.append(now)
+                while failures and failures[0] <= now - self.window: failures.popleft()
+                count = len(failures)
+                if count >= limit and source.locked_until <= now:
+                    # La fenêtre repart de zéro à la fin du blocage
+                    source.locked_until = now + self.lockout; failures.clear()
+                    locked = True; self.lockouts += 1
+                highest = max(highest, count)
+        return highest, locked
+
+    def _touch(self, key: Hashable, limit: int) -> _SourceState:
+        source = self._sources.get(key)
+        if source is None:
+            source = self._sources[key] = _SourceState(limit)
+            if len(self._sources) > self.max_keys:
+                self._sources.popitem(last=False); self.evictions += 1
+        else:
+            self._sources.move_to_end(key)
+            if source.failures.maxlen != limit: source.failures = deque(source.failures, maxlen=limit)
+        return source
+
+    def prune(self, now: Optional[float] = None) -> int:
+        """Oublie les sources sans échec dans la fenêtre ni blocage en cours; retourne le nombre de sources retirées."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            stale = [key for key, source in self._sources.items()
+                     if source.locked_until <= now and (not source.failures or source.failures[-1] <= now - self.window)]
+            for key in stale: del self._sources[key]
+            return len(stale)
+
+    def reset(self) -> None:
+        with self._lock: self._sources.clear()
+
+    def stats(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            # Échecs encore dans la fenêtre (les plus anciens sont purgés au prochain échec de la source ou par prune())
+            in_window = sum(1 for source in self._sources.values() for at in source.failures if at > now - self.window)
+            return {"tracked_sources": len(self._sources), "failures": self.failures, "lockouts": self.lockouts,
+                    "rejected": self.rejected, "evictions": self.evictions, "window_failures": in_window,
+                    "locked_sources": sum(1 for source in self._sources.values() if source.locked_until > now)}
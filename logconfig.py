@@ -0,0 +1,147 @@
+"""
+Journalisation applicative SmartCadenas, sans écriture disque dans les threads de requête.
+
+Les threads de requête ne font que déposer l'enregistrement dans une file bornée
+(QueueHandler); un thread d'écoute (QueueListener) le formate et l'écrit dans app.log,
+avec rotation à la taille (LOG_MAX_BYTES) et à l'heure (LOG_ROTATE_SECONDS). File pleine:
+l'enregistrement est abandonné et compté plutôt que de bloquer la requête.
+LOG_FORMAT=json produit une ligne JSON par enregistrement, champs extra compris.
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from typing import Dict, Iterator, Optional
+
+from dotenv import load_dotenv
+
+# Les constantes ci-dessous sont lues à l'import: charger .env avant
+load_dotenv()
+
+LOG_FILE = os.getenv('LOG_FILE', 'app.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 7))
+LOG_ROTATE_SECONDS = int(os.getenv('LOG_ROTATE_SECONDS', 24 * 3600))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', 100))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Attributs standard d'un LogRecord: tout le reste vient de extra={...} et part dans la sortie JSON
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class SizeTimedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotation numérotée (app.log.1 ... app.log.N) à la taille ou à chaque frontière de rotate_seconds (UTC)."""
+
+    def __init__(self, filename: str, max_bytes: int = LOG_MAX_BYTES, backup_count: int = LOG_BACKUP_COUNT,
+                 rotate_seconds: int = LOG_ROTATE_SECONDS) -> None:
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.rotate_seconds = rotate_seconds
+        # Un fichier existant est rattaché à la période de sa dernière écriture: redémarrer n'empêche pas la rotation
+        started = os.path.getmtime(filename) if os.path.exists(filename) else time.time()
+        self.rollover_at = self._next_boundary(started)
+
+    def _next_boundary(self, now: float) -> float:
+        if self.rotate_seconds <= 0: return float('inf')
+        return (now // self.rotate_seconds + 1) * self.rotate_seconds
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time.time() >= self.rollover_at and os.path.exists(self.baseFilename): return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self.rollover_at = self._next_boundary(time.time())
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement: horodatage, niveau, logger, message et champs extra."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"timestamp": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                 "message": record.getMessage()}
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if record.exc_info: entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Ne garde qu'un enregistrement sur `every` parmi ceux marqués extra={"sample": "<clé>"} (le premier passe)."""
+
+    def __init__(self, every: int = LOG_SAMPLE_EVERY) -> None:
+        super().__init__()
+        self.every = max(1, every)
+        self._counters: Dict[str, Iterator[int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None or self.every == 1: return True
+        # next() sur itertools.count est atomique sous le GIL: pas de verrou sur le chemin chaud
+        seen = next(self._counters.setdefault(key, itertools.count()))
+        if seen % self.every: return False
+        record.sample_rate = self.every
+        if seen: record.msg = f"{record.msg} [1 sur {self.every}]"
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui abandonne (et compte) l'enregistrement quand la file est pleine au lieu d'attendre."""
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]") -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Le logger racine n'a que ce handler: l'enregistrement n'est partagé avec personne, inutile de le copier
+        # comme QueueHandler.prepare; les arguments sont fusionnés ici car ils peuvent être modifiés après l'appel
+        if record.exc_info or record.stack_info: return super().prepare(record)
+        record.message = record.msg = record.getMessage(); record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try: self.queue.put_nowait(record)
+        except queue.Full: self.dropped += 1
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def setup_logging(log_file: str = LOG_FILE, level: str = LOG_LEVEL, log_format: str = LOG_FORMAT) -> NonBlockingQueueHandler:
+    """Installe la file sur le logger racine et démarre le thread d'écriture (une seule fois par processus)."""
+    global _listener, _queue_handler
+    if _queue_handler is not None: return _queue_handler
+    formatter = JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT)
+    sinks = [SizeTimedRotatingFileHandler(log_file), logging.StreamHandler(sys.stderr)]
+    for sink in sinks: sink.setFormatter(formatter)
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(LOG_QUEUE_SIZE)
+    _queue_handler = NonBlockingQueueHandler(log_queue)
+    _queue_handler.addFilter(SamplingFilter())
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [_queue_handler]
+    _listener = logging.handlers.QueueListener(log_queue, *sinks, respect_handler_level=True)
+    _listener.start()
+    # Vide la file avant la sortie du processus
+    atexit.register(stop_logging)
+    return _queue_handler
+
+
+def stop_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for sink in _listener.handlers: sink.close()
+        _listener = None
+
+
+def dropped_records() -> int:
+    return _queue_handler.dropped if _queue_handler is not None else 0
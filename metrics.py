@@ -0,0 +1,141 @@
+"""
+Instrumentation de l'application SmartCadenas, exposée au format texte Prometheus (/metrics).
+
+Chaque thread incrémente ses propres compteurs (threading.local): le chemin chaud ne prend
+aucun verrou et ne partage aucune donnée. Les fragments sont additionnés à la lecture
+(/metrics); ceux des threads terminés sont repliés dans un total commun, le nombre de
+fragments reste donc borné même quand le serveur crée un thread par requête.
+"""
+
+import bisect
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SHARD_SWEEP = 64
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[Labels, float]
+
+
+class _Shard:
+    __slots__ = ("counters", "histograms")
+
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        # Par série: un compteur par bucket (+Inf compris), puis la somme des observations
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {}
+
+    def merge(self, other: "_Shard") -> None:
+        for key, value in dict(other.counters).items(): self.counters[key] = self.counters.get(key, 0.0) + value
+        for key, values in dict(other.histograms).items():
+            values = list(values); mine = self.histograms.get(key)
+            if mine is None: self.histograms[key] = values
+            else: self.histograms[key] = [a + b for a, b in zip(mine, values)]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels: return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class MetricsRegistry:
+    """Compteurs et histogrammes fragmentés par thread, plus des mesures instantanées fournies à la lecture."""
+
+    def __init__(self, enabled: bool = METRICS_ENABLED) -> None:
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, _Shard]] = []
+        self._retired = _Shard()
+        self._meta: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {}
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._meta[name] = ("counter", help_text, ())
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self._meta[name] = ("histogram", help_text, buckets)
+
+    def _shard(self) -> _Shard:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # Seul le premier appel d'un thread prend le verrou (enregistrement du fragment)
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                if len(self._shards) >= SHARD_SWEEP: self._sweep()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _sweep(self) -> None:
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive(): alive.append((thread, shard))
+            else: self._retired.merge(shard)
+        self._shards = alive
+
+    def inc(self, name: str, labels: Labels = (), value: float = 1.0) -> None:
+        if not self.enabled: return
+        counters = self._shard().counters; key = (name, labels)
+        counters[key] = counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        if not self.enabled: return
+        histograms = self._shard().histograms; key = (name, labels)
+        series = histograms.get(key)
+        buckets = self._meta[name][2]
+        if series is None: series = histograms[key] = [0.0] * (len(buckets) + 2)
+        series[bisect.bisect_left(buckets, value)] += 1; series[-1] += value
+
+    def snapshot(self) -> _Shard:
+        with self._lock:
+            self._sweep()
+            total = _Shard(); total.merge(self._retired)
+            for _, shard in self._shards: total.merge(shard)
+        return total
+
+    def render(self, collected: Optional[Iterable[Tuple[str, str, str, List[Sample]]]] = None) -> str:
+        """Format d'exposition texte: séries enregistrées, puis mesures (nom, type, aide, échantillons) collectées à la lecture."""
+        total = self.snapshot(); lines: List[str] = []
+        for name, (kind, help_text, buckets) in sorted(self._meta.items()):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            if kind == "counter":
+                lines += [f"{name}{_format_labels(labels)} {_format_value(value)}"
+                          for (metric, labels), value in sorted(total.counters.items()) if metric == name]
+                continue
+            for (metric, labels), series in sorted(total.histograms.items()):
+                if metric != name: continue
+                cumulative = 0.0
+                for bound, count in zip(list(buckets) + ["+Inf"], series[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {_format_value(cumulative)}")
+                lines += [f"{name}_sum{_format_labels(labels)} {repr(series[-1])}", f"{name}_count{_format_labels(labels)} {_format_value(cumulative)}"]
+        for name, kind, help_text, samples in collected or []:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples]
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+metrics.histogram("smartcadenas_http_request_duration_seconds",
+                  "Durée de traitement des requêtes par endpoint, méthode et statut (_count: nombre de requêtes)")
+metrics.histogram("smartcadenas_storage_duration_seconds", "Durée des lectures et écritures du stockage par backend et opération")
+metrics.counter("smartcadenas_storage_bytes_total", "Octets lus et écrits par le stockage, par backend et opération")
+metrics.histogram("smartcadenas_storage_group_commit_size", "Transactions écrites par lot (group commit), par backend",
+                  (1, 2, 4, 8, 16, 32, 64, 128))
+metrics.counter("smartcadenas_logs_appended_total", "Logs d'accès enregistrés, par cadenas et statut")
+metrics.counter("smartcadenas_alerts_created_total", "Alertes créées, par cadenas et sévérité (rate() donne le rythme de création)")
+metrics.counter("smartcadenas_alerts_coalesced_total", "Alertes répétées repliées sur une alerte ouverte, par cadenas et sévérité")
+metrics.counter("smartcadenas_scheduler_runs_total", "Exécutions des tâches planifiées, par tâche et résultat")
+metrics.histogram("smartcadenas_scheduler_job_duration_seconds", "Durée des tâches planifiées")
+metrics.counter("smartcadenas_anomalies_total", "Anomalies signalées par le moteur d'analyse des accès, par type")
+metrics.counter("smartcadenas_notifications_total", "Alertes notifiées, par destination et résultat (delivered, failed, rejected, dropped)")
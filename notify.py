@@ -0,0 +1,428 @@
+"""
+Notifications sortantes SmartCadenas: alertes graves poussées vers des webhooks HTTP et syslog.
+
+Le commit d'une alerte de sévérité NOTIFY_MIN_SEVERITY ou plus ne fait que la déposer dans une
+file bornée (on_commit, sur le chemin de la requête: ni réseau ni disque). Un thread répartiteur
+la copie dans la file de chaque destination et l'écrit dans le spool de celle-ci
+(NOTIFY_SPOOL_DIR, une ligne JSON par notification) avant tout envoi; un pool de NOTIFY_WORKERS
+threads envoie ensuite les lots (jusqu'à NOTIFY_BATCH_SIZE alertes par requête HTTP ou par
+connexion syslog), et chaque lot livré est marqué dans le spool.
+
+Un échec est retenté avec un délai exponentiel (NOTIFY_RETRY_BASE à NOTIFY_RETRY_MAX secondes);
+après NOTIFY_BREAKER_THRESHOLD échecs consécutifs, le disjoncteur de la destination s'ouvre:
+plus aucun envoi pendant NOTIFY_BREAKER_COOLDOWN secondes, puis une seule alerte pour sonder.
+Une destination en panne ne retarde pas les autres. Au-delà de NOTIFY_MAX_PENDING notifications
+en mémoire pour une destination, les suivantes ne sont que dans le spool et y sont relues quand
+la file se vide. Une réponse 4xx (hors 408 et 429) rejette le lot sans nouvel essai.
+
+Au démarrage, les notifications non livrées sont reprises du spool, y compris celles des
+processus arrêtés (fichiers <destination>.<pid>.spool): livraison au moins une fois, un arrêt
+pendant un envoi peut faire livrer un lot deux fois.
+
+Sous gunicorn, chaque worker a son Notifier et son fichier de spool par destination dans
+NOTIFY_SPOOL_DIR. Les écouteurs de commit ne sont appelés que dans le processus qui commite:
+un worker ne livre que les alertes de ses propres requêtes, jamais celles qu'il relit du
+stockage commun, et chaque alerte n'est donc envoyée qu'une fois.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Deque, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_WEBHOOKS = [url.strip() for url in os.getenv('NOTIFY_WEBHOOKS', '').split(',') if url.strip()]
+# Socket syslog locale (/dev/log) ou udp://hôte:port; vide: pas de syslog
+NOTIFY_SYSLOG = os.getenv('NOTIFY_SYSLOG', '')
+NOTIFY_MIN_SEVERITY = os.getenv('NOTIFY_MIN_SEVERITY', 'high')
+NOTIFY_SPOOL_DIR = os.getenv('NOTIFY_SPOOL_DIR', 'notify-spool')
+NOTIFY_QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', 10000))
+NOTIFY_MAX_PENDING = int(os.getenv('NOTIFY_MAX_PENDING', 1000))
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', 2))
+NOTIFY_BATCH_SIZE = int(os.getenv('NOTIFY_BATCH_SIZE', 50))
+NOTIFY_TIMEOUT = float(os.getenv('NOTIFY_TIMEOUT', 5))
+NOTIFY_RETRY_BASE = float(os.getenv('NOTIFY_RETRY_BASE', 1))
+NOTIFY_RETRY_MAX = float(os.getenv('NOTIFY_RETRY_MAX', 300))
+NOTIFY_BREAKER_THRESHOLD = int(os.getenv('NOTIFY_BREAKER_THRESHOLD', 5))
+NOTIFY_BREAKER_COOLDOWN = float(os.getenv('NOTIFY_BREAKER_COOLDOWN', 60))
+# Spool sans notification en attente vidé au-delà de cette taille
+NOTIFY_SPOOL_COMPACT_BYTES = 1 << 20
+# Éléments versés de la file commune dans les files des destinations par passage du répartiteur
+NOTIFY_INGEST_CHUNK = 1000
+
+SEVERITY_RANK = {"low": 0, "medium": 1, "high": 2, "critical": 3}
+# Sévérité syslog (RFC 5424) de chaque sévérité d'alerte, facilité local0
+_SYSLOG_SEVERITY = {"low": 5, "medium": 4, "high": 3, "critical": 2}
+_SYSLOG_FACILITY = 16
+# <destination>.<pid propriétaire>.spool, ou .claim-<n> pendant la reprise du spool d'un processus arrêté
+_SPOOL_NAME = re.compile(r'([a-z]+-[0-9a-f]{10})\.(\d+)\.(spool|claim-\d+)')
+_WAKE = object()
+
+Entry = Dict[str, Any]
+
+
+class RejectedDelivery(Exception):
+    """Refus définitif de la destination (4xx): le lot n'est pas retenté."""
+
+
+class WebhookTarget:
+    """POST JSON {"source": "smartcadenas", "alerts": [...]} d'un lot vers une URL."""
+
+    kind = "webhook"
+
+    def __init__(self, url: str, timeout: float = NOTIFY_TIMEOUT) -> None:
+        self.key = url; self.timeout = timeout
+        parts = urlsplit(url)
+        # Libellé sans identifiants, chemin ni paramètres (jetons éventuels): métriques, journaux, /api/notifications
+        self.label = f"{parts.scheme}://{parts.netloc.rsplit('@', 1)[-1]}#{hashlib.sha1(url.encode('utf-8')).hexdigest()[:6]}"
+
+    def send(self, alerts: List[Dict[str, Any]]) -> None:
+        body = json.dumps({"source": "smartcadenas", "alerts": alerts}, ensure_ascii=False).encode('utf-8')
+        request = urllib.request.Request(self.key, data=body, method='POST',
+                                         headers={'Content-Type': 'application/json', 'User-Agent': 'SmartCadenas-Notify'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response: response.read()
+        except urllib.error.HTTPError as e:
+            if 400 <= e.code < 500 and e.code not in (408, 429): raise RejectedDelivery(f"HTTP {e.code}") from e
+            raise
+
+
+class SyslogTarget:
+    """Un datagramme syslog par alerte (facilité local0), vers la socket locale ou un collecteur UDP."""
+
+    kind = "syslog"
+
+    def __init__(self, address: str, timeout: float = NOTIFY_TIMEOUT) -> None:
+        self.key = self.label = address; self.timeout = timeout
+        parts = urlsplit(address)
+        self._address: Union[str, Tuple[str, int]] = (parts.hostname or "localhost", parts.port or 514) if parts.scheme == "udp" else address
+
+    def send(self, alerts: List[Dict[str, Any]]) -> None:
+        if isinstance(self._address, tuple):
+            family, _, _, _, sockaddr = socket.getaddrinfo(*self._address, type=socket.SOCK_DGRAM)[0]
+        else:
+            family, sockaddr = socket.AF_UNIX, self._address
+        with socket.socket(family, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.timeout); sock.connect(sockaddr)
+            for alert in alerts: sock.send(syslog_line(alert))
+
+
+def syslog_line(alert: Dict[str, Any]) -> bytes:
+    priority = _SYSLOG_FACILITY * 8 + _SYSLOG_SEVERITY.get(alert.get("severity"), 4)
+    repeated = f", {alert['count']} occurrences" if alert.get("count", 1) > 1 else ""
+    return (f"<{priority}>smartcadenas: [{alert.get('lock_id')}] {alert.get('severity')} {alert.get('type')}: "
+            f"{alert.get('message')} (alerte {alert.get('id')}{repeated})").encode('utf-8')
+
+def build_targets(webhooks: List[str], syslog: str) -> List[Any]:
+    targets: List[Any] = [WebhookTarget(url) for url in webhooks]
+    if syslog: targets.append(SyslogTarget(syslog))
+    return targets
+
+def _process_alive(pid: int) -> bool:
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except OSError: return True  # processus d'un autre utilisateur
+    return True
+
+
+class _Destination:
+    """File en mémoire, spool et disjoncteur d'une destination; modifiés par le seul thread répartiteur."""
+
+    def __init__(self, target: Any, spool_dir: str) -> None:
+        self.target = target
+        self.prefix = f"{target.kind}-{hashlib.sha1(target.key.encode('utf-8')).hexdigest()[:10]}"
+        self.spool_dir = spool_dir
+        self.path = os.path.join(spool_dir, f"{self.prefix}.{os.getpid()}.spool")
+        self.pending: Deque[Entry] = deque()
+        self.in_flight: List[Entry] = []
+        # Notifications écrites dans le spool mais pas en mémoire (file pleine), à relire depuis spill_offset
+        self.spilled = 0; self.spill_offset = 0
+        self.next_id = 0; self.spool_size = 0
+        self._file = None
+        self._buffer: List[bytes] = []; self._buffered = 0
+        self.failures = 0; self.retry_at = 0.0; self.open_until = 0.0
+        self.delivered = 0; self.rejected = 0; self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def state(self, threshold: int, now: float) -> str:
+        if self.failures < threshold: return "closed"
+        return "open" if now < self.open_until else "half_open"
+
+    def backlog(self) -> int:
+        return len(self.pending) + len(self.in_flight) + self.spilled
+
+    def recover(self, max_pending: int) -> int:
+        """Reprend les notifications non livrées des spools de cette destination (ce processus ou un processus arrêté)."""
+        claimed = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            match = _SPOOL_NAME.fullmatch(name)
+            if not match or match.group(1) != self.prefix: continue
+            pid = int(match.group(2))
+            if pid != os.getpid() and _process_alive(pid): continue
+            path = os.path.join(self.spool_dir, name); claim = os.path.join(self.spool_dir, f"{self.prefix}.{os.getpid()}.claim-{len(claimed)}")
+            # Le renommage est atomique: si deux processus reprennent le même spool, un seul y parvient
+            try: os.rename(path, claim)
+            except OSError: continue
+            claimed.append(claim)
+        alerts: List[Dict[str, Any]] = []
+        for claim in claimed:
+            undelivered: Dict[int, Dict[str, Any]] = {}
+            with open(claim, 'rb') as file:
+                for line in file:
+                    try: record = json.loads(line)
+                    except ValueError: break  # ligne coupée par un arrêt brutal
+                    if record["op"] == "add": undelivered[record["n"]] = record["alert"]
+                    else:
+                        for n in record["n"]: undelivered.pop(n, None)
+            alerts.extend(undelivered.values())
+        # Spool neuf, renuméroté, avec les seules notifications à livrer; les fichiers repris sont supprimés ensuite
+        lines = [json.dumps({"op": "add", "n": n, "alert": alert}, ensure_ascii=False).encode('utf-8') + b"\n" for n, alert in enumerate(alerts)]
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(b"".join(lines)); file.flush(); os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        for claim in claimed:
+            if claim != self.path: os.remove(claim)
+        self._file = open(self.path, 'ab')
+        self.next_id = len(alerts); self.spool_size = sum(len(line) for line in lines)
+        self.pending = deque({"n": n, "alert": alert} for n, alert in enumerate(alerts[:max_pending]))
+        self.spilled = max(0, len(alerts) - max_pending)
+        self.spill_offset = sum(len(line) for line in lines[:max_pending])
+        return len(alerts)
+
+    def _write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n"
+        self._buffer.append(line); self._buffered += len(line)
+
+    def enqueue(self, alert: Dict[str, Any], max_pending: int) -> None:
+        entry = {"n": self.next_id, "alert": alert}; self.next_id += 1
+        if self.spilled or len(self.pending) + len(self.in_flight) >= max_pending:
+            if not self.spilled: self.spill_offset = self.spool_size + self._buffered
+            self.spilled += 1
+        else:
+            self.pending.append(entry)
+        self._write({"op": "add", **entry})
+
+    def acknowledge(self, batch: List[Entry]) -> None:
+        self._write({"op": "done", "n": [entry["n"] for entry in batch]})
+
+    def sync(self) -> None:
+        """Écrit les lignes en attente dans le spool (un fsync par passage du répartiteur, jamais sur le chemin des requêtes)."""
+        if not self._buffer or self._file is None: return
+        payload = b"".join(self._buffer); self._buffer = []; self._buffered = 0
+        self._file.write(payload); self._file.flush(); os.fsync(self._file.fileno())
+        self.spool_size += len(payload)
+
+    def refill(self, max_pending: int) -> None:
+        """Relit du spool les notifications débordées, dans l'ordre, tant que la file en mémoire a de la place."""
+        if not self.spilled or len(self.pending) + len(self.in_flight) >= max_pending: return
+        self.sync()
+        with open(self.path, 'rb') as file:
+            file.seek(self.spill_offset)
+            for line in file:
+                if self.spilled == 0 or len(self.pending) + len(self.in_flight) >= max_pending: break
+                self.spill_offset += len(line)
+                record = json.loads(line)
+                if record["op"] == "add":
+                    self.pending.append({"n": record["n"], "alert": record["alert"]}); self.spilled -= 1
+
+    def compact(self) -> None:
+        if self.backlog() or self.spool_size < NOTIFY_SPOOL_COMPACT_BYTES or self._file is None: return
+        self.sync()
+        self._file.truncate(0); os.fsync(self._file.fileno())
+        self.spool_size = 0; self.spill_offset = 0
+
+    def close(self) -> None:
+        """Arrêt: le spool fait foi, la mémoire est oubliée (un redémarrage la relit avec recover)."""
+        if self._file is not None:
+            self.sync(); self._file.close(); self._file = None
+        self.pending = deque(); self.in_flight = []; self.spilled = 0
+
+
+class Notifier:
+    """File commune bornée, un thread répartiteur et un pool d'envoi; une _Destination par cible."""
+
+    def __init__(self, targets: List[Any], spool_dir: str = NOTIFY_SPOOL_DIR, min_severity: str = NOTIFY_MIN_SEVERITY,
+                 queue_size: int = NOTIFY_QUEUE_SIZE, max_pending: int = NOTIFY_MAX_PENDING, workers: int = NOTIFY_WORKERS,
+                 batch_size: int = NOTIFY_BATCH_SIZE, retry_base: float = NOTIFY_RETRY_BASE, retry_max: float = NOTIFY_RETRY_MAX,
+                 breaker_threshold: int = NOTIFY_BREAKER_THRESHOLD, breaker_cooldown: float = NOTIFY_BREAKER_COOLDOWN) -> None:
+        self.spool_dir = spool_dir
+        self.min_severity = min_severity if min_severity in SEVERITY_RANK else "high"
+        self.max_pending = max(1, max_pending); self.workers = max(1, workers); self.batch_size = max(1, batch_size)
+        self.retry_base = retry_base; self.retry_max = retry_max
+        self.breaker_threshold = max(1, breaker_threshold); self.breaker_cooldown = breaker_cooldown
+        self.destinations = [_Destination(target, spool_dir) for target in targets]
+        self.dropped = 0
+        self._inbox: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._results: "queue.Queue[Tuple[_Destination, List[Entry], Optional[BaseException]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.destinations)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def on_commit(self, lock_id: str, _previous: Dict[str, Any], tx: Any) -> None:
+        """Écouteur de commit (thread de la requête): dépose les alertes à notifier, sans attendre."""
+        threshold = SEVERITY_RANK[self.min_severity]
+        for alert in tx.new_alerts:
+            if SEVERITY_RANK.get(alert.get("severity"), 0) < threshold: continue
+            try: self._inbox.put_nowait(dict({k: v for k, v in alert.items() if k != "_index"}, lock_id=lock_id))
+            except queue.Full:
+                # Répartiteur arrêté ou débordé: l'alerte reste dans l'état et le tableau de bord, seule la notification est perdue
+                with self._lock: self.dropped += 1
+                metrics.inc("smartcadenas_notifications_total", (("target", "*"), ("outcome", "dropped")))
+
+    def _wake(self) -> None:
+        try: self._inbox.put_nowait(_WAKE)
+        except queue.Full: pass  # file pleine: le répartiteur est déjà réveillé
+
+    def start(self) -> bool:
+        with self._lock:
+            if not self.destinations or self.running: return False
+            os.makedirs(self.spool_dir, exist_ok=True)
+            recovered = sum(destination.recover(self.max_pending) for destination in self.destinations)
+            self._stop.clear()
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="smartcadenas-notify")
+            self._thread = threading.Thread(target=self._run, name="smartcadenas-notify-dispatch", daemon=True)
+            self._thread.start()
+        logger.info("Notifications démarrées: %s (%s reprises du spool).",
+                    ", ".join(destination.target.label for destination in self.destinations), recovered)
+        return True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Arrête le répartiteur; les notifications non livrées restent dans le spool pour le prochain démarrage."""
+        self._stop.set(); self._wake()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread(): thread.join(timeout)
+        if self._pool is not None: self._pool.shutdown(wait=False, cancel_futures=True)
+        self._thread = None; self._pool = None
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """Attend que toutes les notifications déposées soient livrées ou rejetées (tests, benchmarks)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self._inbox.unfinished_tasks and not any(destination.backlog() for destination in self.destinations): return True
+            time.sleep(0.01)
+        return False
+
+    def _run(self) -> None:
+        while True:
+            stopping = self._stop.is_set()
+            self._ingest(0 if stopping else self._wait_time())
+            self._collect()
+            if stopping: break
+            try: self._dispatch()
+            except OSError as e: logger.error("Erreur spool des notifications: %s", e)
+        # Les envois encore en cours sont ignorés: non acquittés dans le spool, ils seront refaits au redémarrage
+        for destination in self.destinations:
+            try: destination.close()
+            except OSError as e: logger.error("Erreur spool des notifications: %s", e)
+
+    def _wait_time(self) -> float:
+        now = time.monotonic(); waits = [1.0]
+        for destination in self.destinations:
+            if destination.in_flight or not (destination.pending or destination.spilled): continue
+            waits.append(max(destination.retry_at, destination.open_until) - now)
+        return max(0.0, min(waits))
+
+    def _ingest(self, timeout: float) -> None:
+        items = []
+        try:
+            items.append(self._inbox.get(timeout=timeout) if timeout > 0 else self._inbox.get_nowait())
+            # À l'arrêt, la file est vidée entièrement dans les spools
+            while self._stop.is_set() or len(items) < NOTIFY_INGEST_CHUNK: items.append(self._inbox.get_nowait())
+        except queue.Empty: pass
+        alerts = [item for item in items if item is not _WAKE]
+        try:
+            for alert in alerts:
+                for destination in self.destinations: destination.enqueue(alert, self.max_pending)
+            if alerts:
+                for destination in self.destinations: destination.sync()
+        except OSError as e: logger.error("Erreur spool des notifications: %s", e)
+        for _ in items: self._inbox.task_done()
+
+    def _collect(self) -> None:
+        now = time.monotonic(); touched = set()
+        while True:
+            try: destination, batch, error = self._results.get_nowait()
+            except queue.Empty: break
+            if destination.in_flight is not batch: continue  # lot d'avant un arrêt
+            destination.in_flight = []; touched.add(destination)
+            labels = (("target", destination.target.label),)
+            if error is None or isinstance(error, RejectedDelivery):
+                destination.acknowledge(batch); destination.failures = 0; destination.open_until = 0.0
+                if error is None: destination.delivered += len(batch); outcome = "delivered"
+                else:
+                    destination.rejected += len(batch); destination.last_error = str(error); outcome = "rejected"
+                    logger.error("Notification rejetée par %s (%s): %s alertes abandonnées.", destination.target.label, error, len(batch))
+                metrics.inc("smartcadenas_notifications_total", labels + (("outcome", outcome),), len(batch))
+                continue
+            destination.pending.extendleft(reversed(batch))
+            destination.failures += 1; destination.errors += 1; destination.last_error = str(error)
+            metrics.inc("smartcadenas_notifications_total", labels + (("outcome", "failed"),), len(batch))
+            if destination.failures >= self.breaker_threshold:
+                if destination.open_until <= now:
+                    logger.warning("Notifications vers %s suspendues %gs après %s échecs: %s", destination.target.label,
+                                   self.breaker_cooldown, destination.failures, error)
+                destination.open_until = now + self.breaker_cooldown
+            else:
+                # Délai exponentiel, étalé pour que les destinations en échec ne réessaient pas en même temps
+                delay = min(self.retry_max, self.retry_base * 2 ** (destination.failures - 1))
+                destination.retry_at = now + delay * random.uniform(0.5, 1.0)
+        try:
+            for destination in touched: destination.sync()
+        except OSError as e: logger.error("Erreur spool des notifications: %s", e)
+
+    def _dispatch(self) -> None:
+        now = time.monotonic(); pool = self._pool
+        if pool is None: return
+        for destination in self.destinations:
+            destination.refill(self.max_pending)
+            if destination.in_flight or not destination.pending or now < destination.retry_at or now < destination.open_until:
+                destination.compact(); continue
+            # Disjoncteur entrouvert: une seule alerte sonde la destination
+            size = 1 if destination.state(self.breaker_threshold, now) == "half_open" else self.batch_size
+            batch = [destination.pending.popleft() for _ in range(min(size, len(destination.pending)))]
+            destination.in_flight = batch
+            pool.submit(self._send, destination, batch)
+
+    def _send(self, destination: _Destination, batch: List[Entry]) -> None:
+        error: Optional[BaseException] = None
+        try: destination.target.send([entry["alert"] for entry in batch])
+        except Exception as e: error = e  # pylint: disable=broad-except
+        self._results.put((destination, batch, error))
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {"enabled": self.enabled, "running": self.running, "min_severity": self.min_severity,
+                "queued": self._inbox.qsize(), "dropped": self.dropped,
+                "targets": [{"target": destination.target.label, "kind": destination.target.kind,
+                             "state": destination.state(self.breaker_threshold, now), "pending": destination.backlog(),
+                             "spilled": destination.spilled, "in_flight": len(destination.in_flight),
+                             "delivered": destination.delivered, "rejected": destination.rejected, "failures": destination.errors,
+                             "consecutive_failures": destination.failures, "last_error": destination.last_error,
+                             "retry_in": round(max(0.0, destination.retry_at - now, destination.open_until - now), 1)}
+                            for destination in self.destinations]}
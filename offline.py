@@ -0,0 +1,91 @@
+"""
+Codes hors ligne SmartCadenas: codes dérivés d'un secret par cadenas et d'une fenêtre de temps.
+
+Le code d'une fenêtre est HOTP (RFC 4226) calculé avec HMAC-SHA256 sur le numéro de fenêtre
+(heure Unix // code_validity), tronqué à code_length chiffres. Le serveur et le cadenas calculent
+le même code sans échange réseau; le cadenas valide localement et rejoue ses ouvertures plus tard
+(POST /api/access/batch), ce qui marque la fenêtre utilisée côté serveur (usage unique).
+
+L'état d'un cadenas en mode hors ligne (settings.code_mode == "offline") tient dans
+data["offline_codes"]: {"secret": base32, "enabled_at": ISO, "used": {fenêtre: drapeaux}}.
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import struct
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from storage import DEFAULT_CODE_LENGTH, DEFAULT_CODE_VALIDITY
+
+# Fenêtres voisines acceptées de part et d'autre (dérive d'horloge du cadenas)
+OFFLINE_SKEW_WINDOWS = int(os.getenv('OFFLINE_SKEW_WINDOWS', 1))
+# Fenêtres passées reconnues comme "code expiré" plutôt que "code incorrect"
+OFFLINE_EXPIRED_LOOKBACK = 12
+# Fenêtres utilisées conservées: au-delà, les plus anciennes sont oubliées
+OFFLINE_USED_RETENTION = 256
+OFFLINE_MAX_WINDOWS = 1000
+OFFLINE_ALGORITHM = "HOTP-HMAC-SHA256"
+
+
+def new_secret() -> str:
+    return base64.b32encode(secrets.token_bytes(20)).decode('ascii')
+
+def code_parameters(settings: Dict[str, Any]) -> Tuple[int, int]:
+    """(chiffres, période en secondes) avec les mêmes bornes que la génération aléatoire."""
+    return (max(4, min(10, int(settings.get("code_length", DEFAULT_CODE_LENGTH)))),
+            max(60, int(settings.get("code_validity", DEFAULT_CODE_VALIDITY))))
+
+def window_of(at: datetime, period: int) -> int:
+    # Horodatages naïfs en heure locale, comme le reste de l'état: timestamp() les ramène en heure Unix
+    return int(at.timestamp() // period)
+
+def window_bounds(window: int, period: int) -> Tuple[datetime, datetime]:
+    return datetime.fromtimestamp(window * period), datetime.fromtimestamp((window + 1) * period)
+
+def derive_code(secret: str, window: int, digits: int) -> str:
+    digest = hmac.new(base64.b32decode(secret), struct.pack('>Q', window), hashlib.sha256).digest()
+    offset = digest[-1] & 0x0F
+    value = struct.unpack('>I', digest[offset:offset + 4])[0] & 0x7FFFFFFF
+    return str(value % 10 ** digits).zfill(digits)
+
+def code_record(offline: Dict[str, Any], window: int, settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Code d'une fenêtre au format de current_code (valid_until inclut la tolérance de dérive)."""
+    digits, period = code_parameters(settings)
+    start, _ = window_bounds(window, period)
+    used = offline.get("used", {}).get(str(window), {})
+    valid_until = window_bounds(window + OFFLINE_SKEW_WINDOWS, period)[1]
+    return {"value": derive_code(offline["secret"], window, digits), "window": window, "generated_at": start.isoformat(),
+            "valid_until": valid_until.isoformat(), "expires_at": valid_until.timestamp(),
+            "used": used.get("used", False), "used_for_entry": used.get("used_for_entry", False)}
+
+def find_code(offline: Dict[str, Any], code: str, at: datetime, settings: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Fenêtre dont le code est `code` autour de `at` (la plus récente d'abord), ou None."""
+    if not offline.get("secret"): return None
+    digits, period = code_parameters(settings)
+    if len(code) != digits: return None
+    current = window_of(at, period)
+    for window in range(current + OFFLINE_SKEW_WINDOWS, current - OFFLINE_SKEW_WINDOWS - OFFLINE_EXPIRED_LOOKBACK - 1, -1):
+        if hmac.compare_digest(code.encode(), derive_code(offline["secret"], window, digits).encode()):
+            return code_record(offline, window, settings)
+    return None
+
+def upcoming_windows(offline: Dict[str, Any], at: datetime, count: int, settings: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Fenêtre courante et suivantes, pour le provisionnement (listes de codes, vérification du cadenas)."""
+    _, period = code_parameters(settings)
+    current = window_of(at, period); windows = []
+    for window in range(current, current + count):
+        record = code_record(offline, window, settings)
+        start, end = window_bounds(window, period)
+        windows.append({"window": window, "code": record["value"], "valid_from": start.isoformat(), "valid_until": end.isoformat(),
+                        "used": record["used"] or record["used_for_entry"]})
+    return windows
+
+def mark_window(offline: Dict[str, Any], window: int, flags: Dict[str, Any], at: datetime) -> None:
+    used = offline.setdefault("used", {})
+    used[str(window)] = dict(used.get(str(window), {}), **flags, at=at.isoformat())
+    if len(used) > OFFLINE_USED_RETENTION:
+        for stale in sorted(used, key=int)[:len(used) - OFFLINE_USED_RETENTION]: del used[stale]
@@ -0,0 +1,142 @@
+"""
+Séries temporelles SmartCadenas: compteurs par heure et par jour, tenus à jour à chaque commit.
+
+Un intervalle (bucket) est identifié par le préfixe de l'horodatage ISO de ses événements
+("2026-10-18T14" pour l'heure, "2026-10-18" pour le jour) et stocké sous forme d'une ligne JSON
+compacte: les compteurs de ROLLUP_FIELDS dans cet ordre, l'histogramme des raisons d'échec,
+puis un bitmap des adresses IP (hexadécimal, IP_SKETCH_BITS bits). Le bitmap se fusionne par OU
+entre intervalles: le nombre d'IP distinctes d'une plage quelconque s'en déduit par comptage
+linéaire, sans conserver les adresses.
+
+Un commit ne décode et ne réécrit que les intervalles de ses événements; une requête sur un mois
+lit au plus ~720 lignes, jamais les logs bruts. rebuild() redérive tout depuis l'historique.
+"""
+
+import functools
+import hashlib
+import json
+import math
+import operator
+import os
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Nombre d'intervalles conservés par granularité (au-delà, les plus anciens sont oubliés par lots)
+ROLLUP_RETENTION = {"hour": int(os.getenv('ROLLUP_HOURS', 24 * 35)), "day": int(os.getenv('ROLLUP_DAYS', 730))}
+# Longueur du préfixe d'horodatage qui identifie l'intervalle, et complément qui en donne le début
+GRANULARITIES = {"hour": (13, ":00:00"), "day": (10, "T00:00:00")}
+ROLLUP_FIELDS = ("opens", "closes", "success", "failed", "warning",
+                 "alerts_low", "alerts_medium", "alerts_high", "alerts_critical")
+IP_SKETCH_BITS = 512
+
+_EVENT_FIELD = {"door_open": 0, "door_close": 1}
+_STATUS_FIELD = {"success": 2, "failed": 3, "warning": 4}
+_SEVERITY_FIELD = {"low": 5, "medium": 6, "high": 7, "critical": 8}
+_REASONS = len(ROLLUP_FIELDS)
+_SKETCH = _REASONS + 1
+
+Row = List[Any]
+BucketKey = Tuple[str, str]
+
+
+def empty_row() -> Row:
+    return [0] * len(ROLLUP_FIELDS) + [{}, 0]
+
+def decode_row(text: Optional[str]) -> Row:
+    if not text: return empty_row()
+    row = json.loads(text)
+    row[_SKETCH] = int(row[_SKETCH], 16) if row[_SKETCH] else 0
+    return row
+
+def encode_row(row: Row) -> str:
+    sketch = row[_SKETCH]
+    return json.dumps(row[:_SKETCH] + [format(sketch, 'x') if sketch else ""], ensure_ascii=False, separators=(',', ':'))
+
+def bucket_start(granularity: str, bucket: str) -> str:
+    return bucket + GRANULARITIES[granularity][1]
+
+def _ip_bit(ip_address: str) -> int:
+    digest = hashlib.blake2b(ip_address.encode('utf-8'), digest_size=4).digest()
+    return 1 << (int.from_bytes(digest, 'big') % IP_SKETCH_BITS)
+
+# Comptage linéaire, tabulé par nombre de bits à zéro (bitmap saturé: borne basse au lieu d'une division par zéro)
+_ESTIMATES = [round(IP_SKETCH_BITS * math.log(IP_SKETCH_BITS / max(zeros, 0.5))) for zeros in range(IP_SKETCH_BITS + 1)]
+
+def distinct_estimate(sketch: int) -> int:
+    """IP distinctes d'un bitmap: exact à quelques unités près jusqu'à quelques centaines d'adresses."""
+    return _ESTIMATES[IP_SKETCH_BITS - sketch.bit_count()]
+
+def fold_rows(rows: Dict[BucketKey, Row], fetch: Callable[[str, str], Optional[str]],
+              logs: Iterable[Dict[str, Any]], alerts: Iterable[Dict[str, Any]]) -> None:
+    """Ajoute des logs et des alertes aux lignes décodées `rows`, chargées à la demande par fetch(granularité, intervalle)."""
+    def row_for(granularity: str, timestamp: str) -> Row:
+        key = (granularity, timestamp[:GRANULARITIES[granularity][0]])
+        row = rows.get(key)
+        if row is None: row = rows[key] = decode_row(fetch(*key))
+        return row
+
+    for entry in logs:
+        timestamp = entry.get("timestamp") or ""
+        if not timestamp: continue
+        event = _EVENT_FIELD.get(entry.get("event")); status = _STATUS_FIELD.get(entry.get("status"))
+        bit = _ip_bit(entry["ip_address"]) if entry.get("ip_address") else 0
+        for granularity in GRANULARITIES:
+            row = row_for(granularity, timestamp)
+            if event is not None: row[event] += 1
+            if status is not None: row[status] += 1
+            if status == 3:
+                reason = entry.get("reason") or "unknown"; row[_REASONS][reason] = row[_REASONS].get(reason, 0) + 1
+            row[_SKETCH] |= bit
+    for alert in alerts:
+        timestamp = alert.get("timestamp") or ""
+        if not timestamp: continue
+        severity = _SEVERITY_FIELD.get(alert.get("severity"), _SEVERITY_FIELD["medium"])
+        for granularity in GRANULARITIES: row_for(granularity, timestamp)[severity] += 1
+
+def trim_buckets(buckets: Dict[str, str], limit: int) -> List[str]:
+    """Oublie les intervalles les plus anciens au-delà de limit (par lots de limit // 10); retourne leurs clés."""
+    if len(buckets) <= limit + max(1, limit // 10): return []
+    dropped = sorted(buckets)[:len(buckets) - limit]
+    for bucket in dropped: del buckets[bucket]
+    return dropped
+
+def fold_document(rollups: Dict[str, Dict[str, str]], logs: Iterable[Dict[str, Any]], alerts: Iterable[Dict[str, Any]]) -> None:
+    """Variante en mémoire (backends json et journal): rollups[granularité][intervalle] = ligne encodée."""
+    rows: Dict[BucketKey, Row] = {}
+    fold_rows(rows, lambda granularity, bucket: rollups.get(granularity, {}).get(bucket), logs, alerts)
+    for (granularity, bucket), row in rows.items():
+        buckets = rollups.setdefault(granularity, {}); created = bucket not in buckets
+        buckets[bucket] = encode_row(row)
+        if created: trim_buckets(buckets, ROLLUP_RETENTION[granularity])
+
+def rebuild(logs: Iterable[Dict[str, Any]], alerts: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, str]]:
+    """Séries complètes redérivées de l'historique (commande flask rebuild-rollups)."""
+    rows: Dict[BucketKey, Row] = {}
+    fold_rows(rows, lambda granularity, bucket: None, logs, alerts)
+    rollups: Dict[str, Dict[str, str]] = {granularity: {} for granularity in GRANULARITIES}
+    for granularity, bucket in sorted(rows): rollups[granularity][bucket] = encode_row(rows[(granularity, bucket)])
+    for granularity, buckets in rollups.items(): trim_buckets(buckets, ROLLUP_RETENTION[granularity])
+    return rollups
+
+def in_range(granularity: str, bucket: str, since: Optional[str], until: Optional[str]) -> bool:
+    """Intervalle qui recoupe [since, until[."""
+    return ((since is None or bucket >= since[:GRANULARITIES[granularity][0]])
+            and (until is None or bucket_start(granularity, bucket) < until))
+
+def select_buckets(buckets: Dict[str, str], granularity: str, since: Optional[str], until: Optional[str]) -> List[Tuple[str, str]]:
+    return sorted((bucket, row) for bucket, row in list(buckets.items()) if in_range(granularity, bucket, since, until))
+
+def summarize(granularity: str, buckets: List[Tuple[str, str]]) -> Dict[str, Any]:
+    """Séries en colonnes (une valeur par intervalle) et totaux de la plage; seuls les intervalles actifs figurent."""
+    # Un seul décodage JSON pour toute la plage, puis transposition en colonnes
+    rows = json.loads("[" + ",".join(text for _, text in buckets) + "]")
+    columns = list(zip(*rows)) if rows else [()] * (_SKETCH + 1)
+    series: Dict[str, List[int]] = {field: list(columns[position]) for position, field in enumerate(ROLLUP_FIELDS)}
+    sketches = [int(sketch, 16) if sketch else 0 for sketch in columns[_SKETCH]]
+    series["distinct_ips"] = [distinct_estimate(sketch) for sketch in sketches]
+    reasons: Dict[str, int] = {}
+    for histogram in columns[_REASONS]:
+        for reason, count in histogram.items(): reasons[reason] = reasons.get(reason, 0) + count
+    totals: Dict[str, Any] = {field: sum(values) for field, values in series.items() if field != "distinct_ips"}
+    totals.update(failure_reasons=reasons, distinct_ips=distinct_estimate(functools.reduce(operator.or_, sketches, 0)))
+    return {"granularity": granularity, "buckets": [bucket_start(granularity, bucket) for bucket, _ in buckets],
+            "series": series, "failure_reasons": list(columns[_REASONS]), "totals": totals}
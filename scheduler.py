@@ -0,0 +1,154 @@
+"""
+Tâches périodiques de l'application SmartCadenas, exécutées hors du chemin des requêtes.
+
+Un seul thread (démon) exécute les tâches enregistrées à leur échéance, l'une après l'autre:
+une tâche lente retarde les suivantes mais jamais une requête. Une exception est journalisée
+et comptée sans arrêter le thread. start() et stop() sont idempotents; run_pending() permet
+d'exécuter les tâches dues sans thread (commande flask run-jobs, tests).
+
+Avec plusieurs processus (gunicorn -w N), chaque worker a son planificateur: les tâches locales
+(état en mémoire du processus) s'exécutent partout, les tâches partagées (shared=True, sur le
+stockage commun) seulement dans le worker qui détient le verrou de meneur (LeaderLock). Les
+autres retentent de le prendre à chaque échéance: si le meneur s'arrête, un autre le remplace.
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from metrics import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: pas de flock, chaque processus se considère meneur
+    fcntl = None  # type: ignore[assignment]
+
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', '1') != '0'
+# Fichier du verrou de meneur des tâches partagées (par défaut à côté du stockage, voir api.py)
+SCHEDULER_LOCK_FILE = os.getenv('SCHEDULER_LOCK_FILE')
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Optional[int]]
+
+
+class LeaderLock:
+    """Verrou de meneur inter-processus: flock exclusif non bloquant, gardé jusqu'à release() ou la fin du processus."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd: Optional[int] = None
+        self._pid = 0
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None and self._pid == os.getpid()
+
+    def acquire(self) -> bool:
+        if self.held or fcntl is None: return True
+        # Descripteur hérité d'un fork: son flock appartient au parent, on ne le réutilise pas
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try: fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd); return False
+        self._fd = fd; self._pid = os.getpid()
+        logger.info("Planificateur: meneur des tâches partagées (pid %s).", self._pid)
+        return True
+
+    def release(self) -> None:
+        if not self.held or self._fd is None: return
+        os.close(self._fd); self._fd = None  # la fermeture libère le flock
+
+
+class _ScheduledJob:
+    __slots__ = ("name", "interval", "func", "shared", "next_run", "runs", "failures", "last_duration", "last_result")
+
+    def __init__(self, name: str, interval: float, func: Job, next_run: float, shared: bool = False) -> None:
+        self.name = name; self.interval = interval; self.func = func; self.shared = shared; self.next_run = next_run
+        self.runs = 0; self.failures = 0; self.last_duration = 0.0; self.last_result: Optional[int] = None
+
+
+class Scheduler:
+    """Tâches à intervalle fixe (secondes, horloge monotone); un intervalle <= 0 désactive la tâche.
+
+    leader_lock: fichier du verrou de meneur; sans lui, le processus exécute aussi les tâches partagées.
+    """
+
+    def __init__(self, leader_lock: Optional[str] = None) -> None:
+        self._jobs: Dict[str, _ScheduledJob] = {}
+        self._leader = LeaderLock(leader_lock) if leader_lock else None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_job(self, name: str, interval: float, func: Job, initial_delay: Optional[float] = None, shared: bool = False) -> None:
+        """shared: tâche sur le stockage commun, exécutée par le seul processus meneur."""
+        if interval <= 0: return
+        with self._lock:
+            self._jobs[name] = _ScheduledJob(name, interval, func, time.monotonic() + (interval if initial_delay is None else initial_delay), shared)
+
+    def is_leader(self) -> bool:
+        return self._leader is None or self._leader.acquire()
+
+    def run_pending(self, now: Optional[float] = None, force: bool = False, names: Optional[Set[str]] = None) -> List[str]:
+        """Exécute les tâches dues (toutes si force, limitées à names si fourni) et retourne leurs noms.
+
+        Hors force, les tâches partagées ne s'exécutent que chez le meneur; ailleurs leur échéance est reportée.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            due = [job for job in self._jobs.values() if (force or job.next_run <= now) and (names is None or job.name in names)]
+        if not force and any(job.shared for job in due) and not self.is_leader():
+            for job in due:
+                if job.shared: job.next_run = time.monotonic() + job.interval
+            due = [job for job in due if not job.shared]
+        for job in due:
+            started = time.perf_counter(); outcome = "ok"
+            try: job.last_result = job.func()
+            except Exception as e:
+                outcome = "error"; job.failures += 1
+                logger.error("Erreur tâche planifiée %s: %s", job.name, e)
+            job.last_duration = time.perf_counter() - started; job.runs += 1
+            # Prochaine échéance calculée après l'exécution: pas de rattrapage en rafale après une pause
+            job.next_run = time.monotonic() + job.interval
+            metrics.inc("smartcadenas_scheduler_runs_total", (("job", job.name), ("outcome", outcome)))
+            metrics.observe("smartcadenas_scheduler_job_duration_seconds", (("job", job.name),), job.last_duration)
+            if job.last_result: logger.debug("Tâche %s: %s éléments traités.", job.name, job.last_result)
+        return [job.name for job in due]
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.run_pending()
+            with self._lock: next_run = min((job.next_run for job in self._jobs.values()), default=time.monotonic() + 60)
+            self._stop.wait(max(0.05, next_run - time.monotonic()))
+
+    def start(self) -> bool:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive(): return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="smartcadenas-scheduler", daemon=True)
+            self._thread.start()
+        logger.info("Planificateur démarré: %s.", ", ".join(f"{job.name}/{job.interval:g}s" for job in self._jobs.values()))
+        return True
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread(): thread.join(timeout)
+        self._thread = None
+        # Arrêt propre d'un worker: un autre reprend les tâches partagées à sa prochaine échéance
+        if self._leader is not None: self._leader.release()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {"running": self.running, "leader": self._leader is None or self._leader.held, "jobs": {
+                job.name: {"interval": job.interval, "shared": job.shared, "runs": job.runs, "failures": job.failures,
+                           "last_duration_ms": round(job.last_duration * 1000, 3), "last_result": job.last_result,
+                           "next_in": round(max(0.0, job.next_run - now), 1)} for job in self._jobs.values()}}
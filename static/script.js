@@ -4,7 +4,11 @@
  */
 
 const CONFIG = {
-    refreshInterval: 10000,    // Intervalle de rafraîchissement en ms
+    refreshInterval: 10000,    // Intervalle de rafraîchissement en ms (polling de secours si le flux SSE est coupé)
+    versionUrl: '/api/version', // Sonde de version (quelques octets, ETag) tant que le flux SSE est connecté
+    versionProbeInterval: 30000, // Le flux ne porte que les écritures de son worker: les autres sont vues par la sonde
+    eventsUrl: '/api/events',  // Flux Server-Sent Events des changements
+    eventsDebounce: 250,       // Regroupement des rechargements déclenchés par une rafale d'événements (ms)
     apiTimeout: 7000,          // Timeout pour les requêtes API en ms (un peu augmenté)
     maxRetries: 3,             // Nombre maximal de tentatives en cas d'échec API
     minRefreshDelay: 2000      // Délai minimum entre les rafraîchissements manuels
@@ -13,11 +17,17 @@ const CONFIG = {
 const state = {
     refreshTimer: null,
     isRefreshing: false,
-    currentCode: null, // Structure attendue: { value, valid_until, generated_at, used, used_for_entry } ou null
+    currentCode: null, // Structure attendue: { value, valid_until, generated_at, used } ou null (champs de GET /api/code)
     connectionProblem: false,
     lastRefreshTime: Date.now(),
     autoRefreshEnabled: true,
-    apiFailCount: 0
+    apiFailCount: 0,
+    eventSource: null,
+    streamConnected: false,
+    knownVersion: null,        // Dernière version d'état vue (flux SSE ou sonde)
+    versionEtag: null,
+    pendingStreamRefresh: new Set(),
+    streamRefreshTimer: null
 };
 
 const DOM = {
@@ -44,6 +54,7 @@ document.addEventListener('DOMContentLoaded', () => {
     refreshDashboard(true).finally(() => {
         updateRemainingTime(); // Initialise l'affichage du compte à rebours
         startAutoRefresh();    // Démarre les rafraîchissements automatiques
+        startEventStream();    // Mises à jour poussées par le serveur (polling en secours, sonde de version pendant le flux)
     });
 
     // Initialisation de la pagination (les données sont chargées par refreshDashboard)
@@ -120,8 +131,7 @@ async function generateNewCode() {
                 value: apiData.code,
                 valid_until: apiData.valid_until,
                 generated_at: apiData.generated_at,
-                used: false, // Un nouveau code est toujours non utilisé
-                used_for_entry: false
+                used: false // Un nouveau code est toujours non utilisé
             };
 
             const validTime = new Date(state.currentCode.valid_until).toLocaleTimeString('fr-FR', { hour: '2-digit', minute: '2-digit', second: '2-digit' });
@@ -153,6 +163,8 @@ async function refreshDashboard(forceRefresh = false) {
         const logsPage = currentUrlParams.get('logs_page') || '1';
         const alertsPage = currentUrlParams.get('alerts_page') || '1';
 
+        // Version relevée avant les lectures: toute écriture ultérieure sera vue par le flux ou la sonde
+        await probeVersion(false);
         const codeApiResponse = await fetchData('/api/code'); // GET pour l'état actuel du code
 
         if (codeApiResponse && codeApiResponse.code && codeApiResponse.valid_until) {
@@ -162,7 +174,6 @@ async function refreshDashboard(forceRefresh = false) {
                 valid_until: codeApiResponse.valid_until,
                 generated_at: codeApiResponse.generated_at,
                 used: codeApiResponse.used || false, // Assurer une valeur booléenne
-                used_for_entry: codeApiResponse.used_for_entry || false, // Assurer une valeur booléenne
             };
         } else {
             state.currentCode = null; // Pas de code actif ou réponse invalide
@@ -335,14 +346,98 @@ function startAutoRefresh() {
     setInterval(updateRemainingTime, 1000);
     if (state.autoRefreshEnabled) {
         state.refreshTimer = setInterval(() => {
-            if (state.autoRefreshEnabled && !document.hidden) {
+            if (state.autoRefreshEnabled && !document.hidden && !state.streamConnected) {
                  refreshDashboard();
             }
         }, CONFIG.refreshInterval);
+        // Flux connecté: il ne relaie que les écritures du worker qui le sert, la sonde voit celles des autres
+        setInterval(() => {
+            if (state.autoRefreshEnabled && !document.hidden && state.streamConnected) probeVersion();
+        }, CONFIG.versionProbeInterval);
     }
     setInterval(updateLastRefreshTime, 60000);
 }
 
+function noteVersion(version) {
+    if (typeof version !== 'number') return false;
+    const changed = state.knownVersion === null || version > state.knownVersion;
+    if (changed) state.knownVersion = version;
+    return changed;
+}
+
+async function probeVersion(refreshOnChange = true) {
+    const headers = { 'X-Requested-With': 'XMLHttpRequest' };
+    if (state.versionEtag) headers['If-None-Match'] = state.versionEtag;
+    try {
+        const response = await fetch(CONFIG.versionUrl, { headers, credentials: 'same-origin' });
+        if (response.status === 304 || !response.ok) return;
+        state.versionEtag = response.headers.get('ETag');
+        const { version } = await response.json();
+        // Version au-delà de la dernière reçue par le flux: écriture d'un autre worker, rechargement complet
+        if (noteVersion(version) && refreshOnChange) refreshDashboard();
+    } catch (error) {
+        console.warn('Sonde de version indisponible:', error);
+    }
+}
+
+function startEventStream() {
+    if (!window.EventSource) return; // Navigateur sans SSE: le polling reste actif
+    const source = new EventSource(CONFIG.eventsUrl);
+    state.eventSource = source;
+
+    source.addEventListener('open', () => { state.streamConnected = true; probeVersion(); });
+    // EventSource se reconnecte seul (avec Last-Event-ID): en attendant, le polling reprend
+    source.addEventListener('error', () => { state.streamConnected = false; });
+
+    // Chaque événement porte la version de son commit: la sonde ne rechargera pas ce que le flux a déjà livré
+    const on = (type, handler) => source.addEventListener(type, (event) => {
+        try { noteVersion(JSON.parse(event.data).version); } catch (error) { /* données illisibles: rechargement quand même */ }
+        handler();
+    });
+    on('code_generated', () => scheduleStreamRefresh('code'));
+    on('code_expired', () => scheduleStreamRefresh('code'));
+    on('access_logged', () => { scheduleStreamRefresh('code'); scheduleStreamRefresh('logs'); });
+    on('alert_created', () => scheduleStreamRefresh('alerts'));
+    on('alert_coalesced', () => scheduleStreamRefresh('alerts'));
+    on('alert_resolved', () => scheduleStreamRefresh('alerts'));
+    // Événements manqués (redémarrage serveur, client trop lent): rechargement complet
+    source.addEventListener('resync', () => refreshDashboard(true));
+
+    window.addEventListener('beforeunload', () => source.close());
+}
+
+function scheduleStreamRefresh(part) {
+    state.pendingStreamRefresh.add(part);
+    if (state.streamRefreshTimer) return;
+    state.streamRefreshTimer = setTimeout(() => {
+        const parts = state.pendingStreamRefresh;
+        state.pendingStreamRefresh = new Set();
+        state.streamRefreshTimer = null;
+        const currentUrlParams = new URLSearchParams(window.location.search);
+        const logsPage = currentUrlParams.get('logs_page') || '1';
+        const alertsPage = currentUrlParams.get('alerts_page') || '1';
+        if (parts.has('code')) loadCode();
+        if (parts.has('logs')) loadLogs(logsPage, alertsPage);
+        if (parts.has('alerts')) loadAlerts(alertsPage, logsPage);
+        updateLastRefreshTime();
+    }, CONFIG.eventsDebounce);
+}
+
+async function loadCode() {
+    try {
+        const codeApiResponse = await fetchData('/api/code');
+        state.currentCode = (codeApiResponse && codeApiResponse.code && codeApiResponse.valid_until) ? {
+            value: codeApiResponse.code,
+            valid_until: codeApiResponse.valid_until,
+            generated_at: codeApiResponse.generated_at,
+            used: codeApiResponse.used || false,
+        } : null;
+        updateCodeDisplay();
+    } catch (error) {
+        console.error('Erreur chargement code:', error);
+    }
+}
+
 function getEnhancedEventDescription(log) {
     if (log.event === 'door_open') {
         return log.status === 'success' ? "Ingresso agente autorizzato (sito)" : `Tentativo di ingresso fallito (${log.reason || 'motivo sconosciuto'})`;
@@ -453,7 +548,7 @@ function updateAlertsUI(data, currentPageAlerts, currentPageLogs) {
                     </div>
                     <p class="alert-message">${sanitizeHTML(alert.message)}</p>
                     <div class="alert-footer">
-                        <span class="alert-time">${formatDateTime(alert.timestamp)}</span>
+                        <span class="alert-time">${formatDateTime(alert.timestamp)}${alert.count > 1 ? ` · ×${alert.count}, dernière ${formatDateTime(alert.last_seen)}` : ''}</span>
                         <button class="btn btn-sm btn-resolve resolve-btn" data-alert-index="${alert._index}">
                             <i class="bi bi-check-circle-fill"></i> Risolvi
                         </button>
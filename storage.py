@@ -0,0 +1,1579 @@
+"""
+Couche de stockage de l'application SmartCadenas.
+
+Deux backends interchangeables, sélectionnés par la variable d'environnement STORAGE_BACKEND:
+- "json" (défaut): un document codes.json unique, servi depuis un cache mémoire;
+- "journal": le même document en mémoire, persisté par un journal append-only compacté;
+- "sqlite": état courant en clé/valeur, access_logs et alerts en tables indexées.
+
+Les écritures passent toujours par une transaction: l'état courant (réglages, code,
+tentatives échouées...) y est modifiable comme un dict, et les ajouts aux collections
+sont mis en attente puis appliqués en un seul commit.
+
+Chaque cadenas de la flotte est un shard indépendant (get_storage(lock_id)); le cadenas
+par défaut conserve les fichiers DATA_FILE / SQLITE_FILE historiques.
+
+Plusieurs processus (workers gunicorn) peuvent partager les fichiers: les backends json et
+journal prennent un verrou consultatif (flock sur <fichier>.lock) pendant leurs commits et
+relisent ce que les autres ont écrit; SQLite sérialise lui-même ses écrivains. Dans un
+processus, les commits concurrents sont regroupés (group commit): une écriture par lot.
+
+Déduplication: une alerte de même (type, source, sévérité) qu'une alerte ouverte vue depuis moins de
+ALERT_COALESCE_WINDOW secondes n'est pas ajoutée; l'alerte ouverte compte l'occurrence (count, last_seen).
+
+Rétention: l'état chaud garde au plus MAX_LOGS / MAX_ALERTS entrées; les plus anciennes sont
+évincées par lots vers l'archive gzip du cadenas (<fichier>.archive/, voir archive.py) au lieu
+d'être supprimées.
+"""
+
+import base64
+import bisect
+import copy
+import heapq
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from archive import LogArchive
+from metrics import metrics
+from rollups import GRANULARITIES, ROLLUP_RETENTION, fold_document, fold_rows, encode_row, rebuild, select_buckets
+
+try:
+    import fcntl
+except ImportError:  # Windows: pas de flock, seul le verrou de thread du backend protège l'état
+    fcntl = None  # type: ignore[assignment]
+
+# Les constantes ci-dessous sont lues à l'import: charger .env avant
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DATA_FILE = os.getenv('DATA_FILE', 'codes.json')
+SQLITE_FILE = os.getenv('SQLITE_FILE', 'smartcadenas.db')
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json').lower()
+STATE_CACHE_ENABLED = os.getenv('STATE_CACHE', '1') != '0'
+JOURNAL_FILE = os.getenv('JOURNAL_FILE')
+JOURNAL_COMPACT_THRESHOLD = int(os.getenv('JOURNAL_COMPACT_THRESHOLD', 1000))
+# Attente maximale du meneur d'un lot pour que les transactions en cours le rejoignent (0: pas d'attente)
+GROUP_COMMIT_WINDOW_MS = float(os.getenv('GROUP_COMMIT_WINDOW_MS', 2))
+LOCKS_DIR = os.getenv('LOCKS_DIR', 'locks')
+DEFAULT_LOCK_ID = os.getenv('DEFAULT_LOCK_ID', 'default')
+LOCK_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+MAX_LOGS = int(os.getenv('MAX_LOGS', 1000))
+MAX_ALERTS = int(os.getenv('MAX_ALERTS', 100))
+# Secondes pendant lesquelles une alerte répétée (même type, source, sévérité) est repliée sur l'alerte ouverte (0: jamais)
+ALERT_COALESCE_WINDOW = int(os.getenv('ALERT_COALESCE_WINDOW', 600))
+ARCHIVE_ENABLED = os.getenv('LOG_ARCHIVE', '1') != '0'
+DEFAULT_CODE_LENGTH = 4
+DEFAULT_CODE_VALIDITY = 300
+DEFAULT_MAX_ATTEMPTS = 3
+RECENT_FAILURES = 20
+EXPORT_CHUNK = 1000
+
+COLLECTIONS = ("access_logs", "alerts")
+# Clés du document dérivées des collections par le backend au commit: hors de l'état copié dans chaque transaction
+DERIVED_KEYS = ("rollups",)
+LOG_FILTERS = ("status", "event", "reason", "agent", "ip_address")
+
+
+def get_default_data() -> Dict[str, Any]:
+    return {
+        "settings": {
+            "code_length": int(os.getenv('CODE_LENGTH', DEFAULT_CODE_LENGTH)),
+            "code_validity": int(os.getenv('CODE_VALIDITY', DEFAULT_CODE_VALIDITY)),
+            "max_attempts": int(os.getenv('MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)),
+            # "random": code aléatoire généré par l'API; "offline": codes dérivés d'un secret (offline.py)
+            "code_mode": "random"
+        },
+        "current_code": {}, "access_logs": [], "alerts": [],
+        "agents": {"default": {"name": "Technicien", "permissions": ["basic_access"]}},
+        "failed_attempts": {"count": 0, "last_reset": datetime.now().isoformat(), "lockouts": 0},
+        "aggregates": build_aggregates({}, [], 0, 0),
+        "version": 0
+    }
+
+def merge_defaults(data: Dict[str, Any]) -> Dict[str, Any]:
+    for key, value in get_default_data().items():
+        if key not in data: data[key] = value
+        elif key == "settings" and isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                if sub_key not in data[key]: data[key][sub_key] = sub_value
+    return data
+
+def _compact_failure(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: entry.get(key) for key in ("timestamp", "reason", "code_used", "agent", "ip_address")}
+
+def _reason_histogram(recent: List[Dict[str, Any]]) -> Dict[str, int]:
+    reasons: Dict[str, int] = {}
+    for entry in recent: reasons[entry["reason"] or "unknown"] = reasons.get(entry["reason"] or "unknown", 0) + 1
+    return reasons
+
+def build_aggregates(by_status: Dict[str, int], failed_logs: List[Dict[str, Any]], unresolved: int, alerts_total: int) -> Dict[str, Any]:
+    """Agrégats du tableau de bord recalculés depuis les collections (reconstruction unique au chargement)."""
+    recent = [_compact_failure(entry) for entry in failed_logs[-RECENT_FAILURES:]]
+    return {"logs_total": sum(by_status.values()), "by_status": dict(by_status), "failure_reasons": _reason_histogram(recent),
+            "recent_failures": recent, "unresolved_alerts": unresolved, "alerts_total": alerts_total}
+
+def _document_aggregates(data: Dict[str, Any]) -> Dict[str, Any]:
+    logs = data.get("access_logs", []); alerts = data.get("alerts", [])
+    by_status: Dict[str, int] = {}
+    for log in logs: by_status[log.get("status") or "unknown"] = by_status.get(log.get("status") or "unknown", 0) + 1
+    return build_aggregates(by_status, [log for log in logs if log.get("status") == "failed"],
+                            sum(1 for alert in alerts if not alert.get("resolved", False)), len(alerts))
+
+def fold_aggregates(aggregates: Dict[str, Any], new_logs: List[Dict[str, Any]], new_alerts: List[Dict[str, Any]],
+                    newly_resolved: int, trimmed_unresolved: int) -> Dict[str, Any]:
+    """Met à jour les agrégats avec les mutations d'un commit, en O(taille du commit).
+
+    Les compteurs par statut et les totaux portent sur tout l'historique (la rétention ne les
+    décrémente pas); l'histogramme des raisons porte sur les RECENT_FAILURES derniers échecs et
+    le nombre d'alertes non résolues sur les alertes conservées.
+    """
+    by_status = aggregates.setdefault("by_status", {}); reasons = aggregates.setdefault("failure_reasons", {})
+    recent = aggregates.setdefault("recent_failures", [])
+    for entry in new_logs:
+        status = entry.get("status") or "unknown"
+        by_status[status] = by_status.get(status, 0) + 1
+        if status != "failed": continue
+        recent.append(_compact_failure(entry))
+        reason = entry.get("reason") or "unknown"; reasons[reason] = reasons.get(reason, 0) + 1
+        if len(recent) > RECENT_FAILURES:
+            dropped = recent.pop(0)["reason"] or "unknown"
+            reasons[dropped] -= 1
+            if reasons[dropped] <= 0: del reasons[dropped]
+    aggregates["logs_total"] = aggregates.get("logs_total", 0) + len(new_logs)
+    aggregates["alerts_total"] = aggregates.get("alerts_total", 0) + len(new_alerts)
+    aggregates["unresolved_alerts"] = max(0, aggregates.get("unresolved_alerts", 0) - newly_resolved - trimmed_unresolved
+                                          + sum(1 for alert in new_alerts if not alert.get("resolved", False)))
+    return aggregates
+
+def _timestamp_key(item: Dict[str, Any]) -> str:
+    return item.get('timestamp', '')
+
+def _order_key(item: Dict[str, Any]) -> Tuple[str, int]:
+    return item.get('timestamp', ''), item.get('id', 0)
+
+CursorKey = Tuple[str, int]
+
+def encode_cursor(key: Optional[Tuple[Any, ...]]) -> Optional[str]:
+    if key is None: return None
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token: str, fleet: bool = False) -> Any:
+    """Clé (timestamp, id), ou (timestamp, lock_id, id) pour un curseur de flotte."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(key, list) or len(key) != (3 if fleet else 2): raise ValueError
+        if not isinstance(key[0], str) or not isinstance(key[-1], int) or (fleet and not isinstance(key[1], str)): raise ValueError
+        return tuple(key)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Curseur invalide") from e
+
+def _prepare_collections(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Remet les collections en ordre chronologique et numérote les entrées qui n'ont pas encore d'id.
+
+    Appelé une fois au chargement: ensuite les écritures conservent l'ordre et aucun tri
+    n'est nécessaire à la lecture.
+    """
+    sequences = data.setdefault("sequences", {})
+    for collection in COLLECTIONS:
+        items = data.setdefault(collection, [])
+        if any(_timestamp_key(a) > _timestamp_key(b) for a, b in zip(items, items[1:])): items.sort(key=_timestamp_key)
+        next_id = max([sequences.get(collection, 0)] + [item["id"] for item in items if "id" in item])
+        for item in items:
+            if "id" not in item: next_id += 1; item["id"] = next_id
+        sequences[collection] = next_id
+        if any(_order_key(a) > _order_key(b) for a, b in zip(items, items[1:])): items.sort(key=_order_key)
+    # L'identifiant public d'une alerte est son id: les anciens _index (longueur de la liste) se répétaient après troncature
+    for alert in data["alerts"]: alert["_index"] = alert["id"]
+    return data
+
+def _insert_ordered(data: Dict[str, Any], collection: str, item: Dict[str, Any]) -> None:
+    sequences = data.setdefault("sequences", {})
+    if "id" not in item: item["id"] = sequences.get(collection, 0) + 1
+    sequences[collection] = max(sequences.get(collection, 0), item["id"])
+    items = data.setdefault(collection, [])
+    # Les horodatages serveur sont croissants: l'insertion est presque toujours un append
+    if not items or _order_key(items[-1]) <= _order_key(item): items.append(item)
+    else: bisect.insort(items, item, key=_order_key)
+
+def _record_io(backend: str, op: str, started: float, size: Optional[int] = None) -> None:
+    labels = (("backend", backend), ("op", op))
+    metrics.observe("smartcadenas_storage_duration_seconds", labels, time.perf_counter() - started)
+    if size is not None: metrics.inc("smartcadenas_storage_bytes_total", labels, size)
+
+def _retention_excess(count: int, limit: int) -> int:
+    """Entrées à évincer de l'état chaud. Avec l'archive, l'éviction se fait par lots (limit // 10):
+    un membre gzip par lot plutôt qu'un par commit, et la liste n'est décalée qu'une fois par lot."""
+    slack = max(1, limit // 10) if ARCHIVE_ENABLED else 0
+    return count - limit if count > limit + slack else 0
+
+def _trim_collections(data: Dict[str, Any], archive: Optional[LogArchive] = None,
+                      replaying: bool = False) -> Dict[str, List[Dict[str, Any]]]:
+    """Évince les entrées au-delà de la rétention (archivées d'abord) et les retourne par collection."""
+    evicted: Dict[str, List[Dict[str, Any]]] = {}
+    for collection, limit in (("access_logs", MAX_LOGS), ("alerts", MAX_ALERTS)):
+        items = data.get(collection, [])
+        excess = _retention_excess(len(items), limit)
+        if excess <= 0: continue
+        if archive is not None:
+            started = time.perf_counter()
+            try: archive.append(collection, items[:excess], skip_archived=replaying); _record_io("archive", "write", started)
+            except OSError as e:
+                # Entrées gardées à chaud: l'archivage sera retenté au prochain commit
+                logger.error("Erreur archivage %s: %s", collection, e); continue
+        evicted[collection] = items[:excess]
+        del items[:excess]
+    return evicted
+
+def _matches(item: Dict[str, Any], filters: Optional[Dict[str, str]]) -> bool:
+    return not filters or all(item.get(field) == value for field, value in filters.items())
+
+def _page_desc(items: List[Dict[str, Any]], offset: int, limit: int) -> List[Dict[str, Any]]:
+    end = len(items) - offset
+    return items[max(0, end - limit):end][::-1] if end > 0 else []
+
+def _before_desc(items: List[Dict[str, Any]], key: Optional[CursorKey], limit: int) -> Tuple[List[Dict[str, Any]], Optional[CursorKey]]:
+    # Page la plus récente strictement antérieure à key, en O(log n + limit)
+    end = len(items) if key is None else bisect.bisect_left(items, key, key=_order_key)
+    page = items[max(0, end - limit):end][::-1]
+    return page, (_order_key(page[-1]) if page and end > limit else None)
+
+
+class StorageError(Exception):
+    """Échec de persistance d'une transaction."""
+
+
+class StateTransaction(dict):
+    """État courant modifiable pendant une transaction, plus les mutations de collections en attente.
+
+    Les clés de l'état (settings, current_code, failed_attempts...) se lisent et s'écrivent
+    comme sur un dict; les ajouts de logs et d'alertes ne sont visibles qu'après le commit.
+    """
+
+    def __init__(self, state: Dict[str, Any], lock_id: str = DEFAULT_LOCK_ID) -> None:
+        super().__init__(state)
+        self.lock_id = lock_id
+        self.new_logs: List[Dict[str, Any]] = []
+        self.new_alerts: List[Dict[str, Any]] = []
+        self.alert_updates: Dict[int, Dict[str, Any]] = {}
+        # Alertes de add_alert repliées au commit sur une alerte ouverte (id, count, first_seen, last_seen renseignés)
+        self.coalesced: List[Dict[str, Any]] = []
+        self.rollups: Optional[Dict[str, Dict[str, str]]] = None
+
+    def append_log(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        self.new_logs.append(entry)
+        return entry
+
+    def add_alert(self, alert: Dict[str, Any]) -> Dict[str, Any]:
+        self.new_alerts.append(alert)
+        return alert
+
+    def update_alert(self, index: int, fields: Dict[str, Any]) -> None:
+        self.alert_updates.setdefault(index, {}).update(fields)
+
+    def replace_rollups(self, rollups: Dict[str, Dict[str, str]]) -> None:
+        """Remplace toutes les séries (reconstruction); les logs et alertes du même commit s'y ajoutent ensuite."""
+        self.rollups = rollups
+
+    def bump_version(self, previous: Dict[str, Any]) -> None:
+        """Incrémente la version d'état (ETag des lectures) si la transaction modifie quelque chose."""
+        if self.new_logs or self.new_alerts or self.alert_updates or self.rollups is not None or any(previous.get(k) != v for k, v in self.items()):
+            self["version"] = previous.get("version", 0) + 1
+
+
+AlertKey = Tuple[Any, Any, Any]
+
+def alert_key(alert: Dict[str, Any]) -> AlertKey:
+    return alert.get("type"), alert.get("source"), alert.get("severity")
+
+def _seconds_between(earlier: str, later: str) -> Optional[float]:
+    try: return (datetime.fromisoformat(later) - datetime.fromisoformat(earlier)).total_seconds()
+    except (TypeError, ValueError): return None
+
+def coalesce_alerts(tx: StateTransaction, find_open: Callable[[AlertKey], Optional[Dict[str, Any]]], window: int) -> None:
+    """Replie les nouvelles alertes de tx sur l'alerte ouverte de même clé vue depuis moins de window secondes.
+
+    find_open(clé) retourne la dernière alerte non résolue de cette clé (recherche indexée du
+    backend). L'occurrence devient une mise à jour (count, last_seen) de cette alerte au lieu
+    d'un nouvel enregistrement: l'historique et les écritures restent bornés pendant une attaque.
+    """
+    if window <= 0: return
+    kept: List[Dict[str, Any]] = []
+    for alert in tx.new_alerts:
+        existing = None if alert.get("resolved", False) else find_open(alert_key(alert))
+        # Mises à jour déjà faites dans cette transaction (autre occurrence repliée, résolution)
+        pending = tx.alert_updates.get(existing["id"], {}) if existing is not None else {}
+        if existing is None or pending.get("resolved"):
+            kept.append(alert); continue
+        seen = alert.get("last_seen") or alert.get("timestamp") or ""
+        last_seen = pending.get("last_seen") or existing.get("last_seen") or existing.get("timestamp") or ""
+        elapsed = _seconds_between(last_seen, seen)
+        if elapsed is None or elapsed > window:
+            kept.append(alert); continue
+        count = pending.get("count", existing.get("count", 1)) + alert.get("count", 1)
+        fields = {"count": count, "last_seen": max(last_seen, seen)}
+        first_seen = existing.get("first_seen") or existing.get("timestamp")
+        if "first_seen" not in existing: fields["first_seen"] = first_seen
+        tx.update_alert(existing["id"], fields)
+        alert.update(fields, id=existing["id"], _index=existing["id"], first_seen=first_seen)
+        tx.coalesced.append(alert)
+    tx.new_alerts[:] = kept
+
+
+CommitListener = Callable[[str, Dict[str, Any], StateTransaction], None]
+_commit_listeners: List[CommitListener] = []
+
+def add_commit_listener(listener: CommitListener) -> None:
+    """Enregistre listener(lock_id, état avant commit, transaction), appelé après chaque commit réussi."""
+    _commit_listeners.append(listener)
+
+def _notify_commit(lock_id: str, previous: Dict[str, Any], tx: StateTransaction) -> None:
+    for listener in _commit_listeners:
+        try: listener(lock_id, previous, tx)
+        except Exception as e: logger.error("Erreur notification commit (%s): %s", lock_id, e)
+
+
+class LogIndex:
+    """Index secondaires des logs chauds: une liste de postings par (champ, valeur) de LOG_FILTERS,
+    dans l'ordre (timestamp, id) du journal. Tenu à jour au commit (ajouts, évictions en tête).
+
+    Une requête filtrée parcourt la plus courte des listes concernées à rebours depuis le curseur:
+    le coût suit le nombre d'entrées de cette liste, pas la taille de l'historique.
+    """
+
+    def __init__(self, logs: List[Dict[str, Any]]) -> None:
+        self._postings: Dict[Tuple[str, Any], List[Dict[str, Any]]] = {}
+        self.add(logs)
+
+    def add(self, entries: List[Dict[str, Any]]) -> None:
+        for entry in entries:
+            for field in LOG_FILTERS:
+                value = entry.get(field)
+                if value is None: continue
+                postings = self._postings.setdefault((field, value), [])
+                if not postings or _order_key(postings[-1]) <= _order_key(entry): postings.append(entry)
+                else: bisect.insort(postings, entry, key=_order_key)
+
+    def evict(self, entries: List[Dict[str, Any]]) -> None:
+        # Les entrées évincées sont les plus anciennes du journal: elles forment un préfixe de chaque liste
+        counts: Dict[Tuple[str, Any], int] = {}
+        for entry in entries:
+            for field in LOG_FILTERS:
+                if entry.get(field) is not None: counts[(field, entry[field])] = counts.get((field, entry[field]), 0) + 1
+        for posting_key, count in counts.items():
+            postings = self._postings.get(posting_key, [])
+            del postings[:count]
+            if not postings: self._postings.pop(posting_key, None)
+
+    def before(self, key: Optional[CursorKey], limit: int, filters: Dict[str, str]) -> Tuple[List[Dict[str, Any]], Optional[CursorKey]]:
+        candidates = min((self._postings.get((field, value), []) for field, value in filters.items()), key=len)
+        position = len(candidates) if key is None else bisect.bisect_left(candidates, key, key=_order_key)
+        page: List[Dict[str, Any]] = []
+        while position > 0 and len(page) <= limit:
+            position -= 1
+            if _matches(candidates[position], filters): page.append(candidates[position])
+        return page[:limit], (_order_key(page[limit - 1]) if len(page) > limit else None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"postings": len(self._postings), "entries": sum(len(postings) for postings in self._postings.values())}
+
+
+class StateCache:
+    """Cache mémoire versionné du document JSON.
+
+    L'entrée est indexée par la signature du fichier (mtime, taille, inode): une écriture
+    faite par un autre processus ou à la main invalide le cache au prochain accès.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Any]] = None
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, signature: Optional[Tuple[int, int, int]]) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if self._data is not None and signature is not None and signature == self._signature:
+                self.hits += 1
+                return self._data
+            self.misses += 1
+            return None
+
+    def store(self, data: Dict[str, Any], signature: Optional[Tuple[int, int, int]]) -> None:
+        with self._lock:
+            self._data = data; self._signature = signature; self.version += 1
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._data = None; self._signature = None
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"version": self.version, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0}
+
+def _file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    try: st = os.stat(path)
+    except OSError: return None
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+class FileLock:
+    """Verrou consultatif inter-processus (flock exclusif) sur un fichier compagnon.
+
+    Le fichier de données est remplacé par rename à chaque écriture: le verrou ne peut pas
+    porter sur lui. Réentrant dans le processus; les threads sont déjà sérialisés par le
+    verrou du backend, qui doit être tenu pour acquire() et release().
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd: Optional[int] = None
+        self._pid = 0
+        self._depth = 0
+
+    @property
+    def held(self) -> bool:
+        return self._depth > 0 and self._pid == os.getpid()
+
+    def acquire(self) -> None:
+        if not self.held:
+            # Descripteur rouvert après un fork (gunicorn --preload): un flock hérité serait partagé avec le parent
+            if self._fd is None or self._pid != os.getpid():
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644); self._pid = os.getpid()
+            self._depth = 0
+            if fcntl is not None: fcntl.flock(self._fd, fcntl.LOCK_EX)
+        self._depth += 1
+
+    def release(self) -> None:
+        if not self.held: return
+        self._depth -= 1
+        if self._depth == 0 and fcntl is not None and self._fd is not None: fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.release()
+
+
+class _PendingCommit:
+    """Transaction appliquée en mémoire, en attente de l'écriture de son lot."""
+    __slots__ = ("previous", "tx", "done", "error")
+
+    def __init__(self, previous: Dict[str, Any], tx: StateTransaction) -> None:
+        self.previous = previous; self.tx = tx
+        self.done = False; self.error: Optional[BaseException] = None
+
+
+class JsonStorage:
+    """Document JSON unique, réécrit en entier (fichier temporaire puis rename) à chaque lot de commits.
+
+    Une transaction s'applique au document en mémoire sous le verrou du backend puis attend
+    l'écriture de son lot. La première du lot (le meneur) patiente au plus
+    GROUP_COMMIT_WINDOW_MS tant que d'autres transactions sont en cours ou que le lot reste plus
+    petit que le précédent, écrit une seule fois pour toutes, puis réveille les autres. Le verrou de fichier est pris par le premier commit
+    d'un lot et rendu une fois le lot écrit: un autre processus ne peut pas écrire entre la
+    lecture de l'état et son écriture.
+    """
+
+    name = "json"
+    lock_id = DEFAULT_LOCK_ID
+
+    def __init__(self, path: str = DATA_FILE, cache_enabled: bool = STATE_CACHE_ENABLED) -> None:
+        self.path = path
+        self.cache = StateCache()
+        self.cache_enabled = cache_enabled
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(f"{path}.lock")
+        self.group_commit_window = GROUP_COMMIT_WINDOW_MS / 1000
+        self.coalesce_window = ALERT_COALESCE_WINDOW
+        self._flushed = threading.Condition(self._lock)
+        self._pending: List[_PendingCommit] = []
+        self._group_data: Optional[Dict[str, Any]] = None
+        self._flushing = False
+        self._last_batch = 1
+        self._inflight = 0
+        self._inflight_lock = threading.Lock()
+        self._unresolved_view: Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]] = (None, [])
+        self._event_index: Tuple[Optional[Dict[str, Any]], Dict[str, Dict[str, Any]]] = (None, {})
+        self._alert_index: Tuple[Optional[Dict[str, Any]], Dict[int, Dict[str, Any]]] = (None, {})
+        self._open_alerts: Tuple[Optional[Dict[str, Any]], Dict[AlertKey, Dict[str, Any]]] = (None, {})
+        self._log_index: Tuple[Optional[Dict[str, Any]], Optional[LogIndex]] = (None, None)
+        self.archive = LogArchive(f"{path}.archive") if ARCHIVE_ENABLED else None
+
+    def initialize(self) -> None:
+        """Crée le fichier ou migre sa structure; appelé au démarrage de chaque worker, pendant que d'autres commitent.
+
+        Sous les deux verrous, comme un commit, et sur un document relu (jamais le document partagé du
+        cache): le fichier n'est réécrit que si la lecture a dû le compléter, le réordonner ou le tronquer.
+        """
+        with self._lock, self._file_lock:
+            if not os.path.exists(self.path):
+                logger.info("Fichier %s n'existe pas. Création avec données par défaut.", self.path)
+                self._read_file()
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file: stored = json.load(file)
+            except ValueError: stored = None
+            data = self._read_file()
+            if (stored == data and len(data.get("access_logs", [])) <= MAX_LOGS and len(data.get("alerts", [])) <= MAX_ALERTS):
+                logger.info("Structure de %s à jour.", self.path); return
+            logger.info("Vérification et mise à jour structure de %s.", self.path)
+            self.save(data)
+
+    def load(self) -> Dict[str, Any]:
+        # Les lectures sont servies depuis la mémoire tant que le fichier n'a pas changé sur disque.
+        # Le document retourné est partagé et ne doit être modifié que par commit().
+        signature = _file_signature(self.path)
+        if self.cache_enabled:
+            cached = self.cache.lookup(signature)
+            if cached is not None: return cached
+        data = self._read_file()
+        # Signature prise avant lecture: si le fichier a été (re)créé entre-temps, la prochaine lecture le recharge.
+        if self.cache_enabled: self.cache.store(data, signature)
+        return data
+
+    def _read_file(self, recheck: bool = True) -> Dict[str, Any]:
+        if not os.path.exists(self.path):
+            with self._lock, self._file_lock:
+                # Un autre processus a pu créer le fichier pendant l'attente du verrou
+                if not os.path.exists(self.path):
+                    default_data = get_default_data()
+                    _atomic_write_json(self.path, default_data)
+                    return default_data
+        try:
+            started = time.perf_counter()
+            with open(self.path, 'r', encoding='utf-8') as file: data = json.load(file); size = file.tell()
+            _record_io(self.name, "read", started, size)
+            if not isinstance(data, dict): raise ValueError("Format JSON invalide")
+            rebuild = "aggregates" not in data
+            data = _prepare_collections(merge_defaults(data))
+            # Document antérieur aux agrégats: un seul parcours, ensuite ils sont tenus à jour à chaque commit
+            if rebuild: data["aggregates"] = _document_aggregates(data)
+            return data
+        except (json.JSONDecodeError, ValueError) as e:
+            if recheck:
+                # Les écritures sont atomiques: un fichier illisible n'est pas une écriture en cours. Relu sous le
+                # verrou de fichier avant de réinitialiser, au cas où un autre processus l'aurait remplacé entre-temps.
+                with self._lock, self._file_lock: return self._read_file(recheck=False)
+            logger.error("Erreur chargement données: %s", e)
+            backup_file = f"{self.path}.bak.{datetime.now().strftime('%Y%m%d%H%M%S')}"
+            current_data_content = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f_read: current_data_content = json.load(f_read)
+                except: pass # pylint: disable=bare-except
+            try:
+                with open(backup_file, 'w', encoding='utf-8') as file_backup:
+                    json.dump(current_data_content if current_data_content else {"error_loading": True}, file_backup, indent=2, ensure_ascii=False)
+                logger.info("Salvataggio creato: %s", backup_file)
+            except Exception as backup_error: logger.error("Errore salvataggio: %s", backup_error)
+            default_data_on_error = get_default_data()
+            _atomic_write_json(self.path, default_data_on_error)
+            return default_data_on_error
+
+    def save(self, data: Dict[str, Any]) -> bool:
+        try:
+            _trim_collections(data, self.archive)
+            started = time.perf_counter()
+            size = _atomic_write_json(self.path, data)
+            _record_io(self.name, "write", started, size)
+            if self.cache_enabled: self.cache.store(data, _file_signature(self.path))
+            return True
+        except Exception as e:
+            logger.error("Erreur sauvegarde données: %s", e)
+            self.cache.invalidate()
+            return False
+
+    @contextmanager
+    def transaction(self) -> Iterator[StateTransaction]:
+        with self._inflight_lock: self._inflight += 1
+        with self._lock:
+            try:
+                self._lock_file()
+                # Lot en cours: ses mutations ne sont pas encore sur disque, le document du lot fait foi
+                data = self._group_data if self._group_data is not None else self.load()
+                previous = {k: v for k, v in data.items() if k not in COLLECTIONS and k not in DERIVED_KEYS}
+                tx = StateTransaction(copy.deepcopy(previous), self.lock_id)
+                yield tx
+                if tx.new_alerts: coalesce_alerts(tx, lambda key: self._open_alert(data, key), self.coalesce_window)
+                if tx.new_logs or tx.new_alerts or tx.alert_updates: self._fold_aggregates(data, tx)
+                tx.bump_version(previous)
+                changed = self._commit(data, tx)
+            except BaseException:
+                self._leave(); raise
+            pending = _PendingCommit(previous, tx)
+            if changed: self._pending.append(pending); self._group_data = data
+            self._leave()
+            if not changed:
+                _notify_commit(self.lock_id, previous, tx)
+                return
+            while not pending.done:
+                if self._flushing: self._flushed.wait()
+                else: self._flush_group()
+            if pending.error is not None: raise StorageError("Erreur sauvegarde") from pending.error
+
+    def _lock_file(self) -> None:
+        if self._file_lock.held: return
+        started = time.perf_counter()
+        self._file_lock.acquire()
+        _record_io(self.name, "lock", started)
+        self._file_locked()
+
+    def _file_locked(self) -> None:
+        """Verrou de fichier obtenu: load() compare déjà la signature du fichier, rien à relire ici."""
+
+    def _leave(self) -> None:
+        # Transaction appliquée (ou abandonnée): le meneur n'a plus à l'attendre
+        with self._inflight_lock: self._inflight -= 1
+        self._flushed.notify_all()
+        if not self._pending and not self._flushing and self._file_lock.held: self._file_lock.release()
+
+    def _flush_group(self) -> None:
+        """Meneur: laisse les transactions en cours rejoindre le lot, l'écrit une fois et réveille ses membres."""
+        self._flushing = True
+        error: Optional[BaseException] = None
+        try:
+            # Lot attendu aussi grand que le précédent: juste après une écriture, ses membres réveillés n'ont pas
+            # encore recommencé de transaction. Un écrivain seul (lots de 1) n'attend jamais.
+            deadline = time.monotonic() + self.group_commit_window
+            while ((self._inflight or len(self._pending) < self._last_batch)
+                   and (remaining := deadline - time.monotonic()) > 0):
+                self._flushed.wait(remaining)
+            batch, self._pending = self._pending, []
+            self._last_batch = len(batch)
+            data, self._group_data = self._group_data, None
+            try: self._persist(data, batch)
+            except (StorageError, OSError) as e: error = e
+            metrics.observe("smartcadenas_storage_group_commit_size", (("backend", self.name),), len(batch))
+        finally:
+            self._flushing = False
+            if not self._pending and self._file_lock.held: self._file_lock.release()
+        for entry in batch: entry.done = True; entry.error = error
+        # Sous le verrou: les abonnés voient les commits dans l'ordre où ils ont été appliqués
+        if error is None:
+            for entry in batch: _notify_commit(self.lock_id, entry.previous, entry.tx)
+        self._flushed.notify_all()
+
+    def _commit(self, data: Dict[str, Any], tx: StateTransaction) -> bool:
+        """Applique la transaction au document en mémoire; False si elle ne change rien (pas d'écriture)."""
+        if not (tx.new_logs or tx.new_alerts or tx.alert_updates or tx.rollups is not None) and all(data.get(k) == v for k, v in tx.items()):
+            return False
+        data.update(tx)
+        if tx.rollups is not None: data["rollups"] = tx.rollups
+        if tx.new_logs or tx.new_alerts: fold_document(data.setdefault("rollups", {}), tx.new_logs, tx.new_alerts)
+        alerts_by_id = self._alerts_by_id(data)
+        for index, fields in tx.alert_updates.items():
+            alert = alerts_by_id.get(index)
+            if alert is not None: alert.update(fields)
+        for alert in tx.new_alerts:
+            _insert_ordered(data, "alerts", alert); alert["_index"] = alert["id"]
+        for entry in tx.new_logs: _insert_ordered(data, "access_logs", entry)
+        if tx.new_alerts or tx.alert_updates: self._unresolved_view = (None, [])
+        if tx.new_alerts: self._alert_index = (None, {}); self._open_alerts = (None, {})
+        evicted = _trim_collections(data, self.archive)
+        self._index_logs(data, tx.new_logs, evicted.get("access_logs", []))
+        return True
+
+    def _persist(self, data: Dict[str, Any], batch: List[_PendingCommit]) -> None:  # pylint: disable=unused-argument
+        if not self.save(data): raise StorageError("Erreur sauvegarde")
+
+    def _fold_aggregates(self, data: Dict[str, Any], tx: StateTransaction) -> None:
+        alerts = data.get("alerts", []); alerts_by_id = self._alerts_by_id(data)
+        resolving = {index for index, fields in tx.alert_updates.items() if fields.get("resolved")}
+        newly_resolved = sum(1 for index in resolving
+                             if (alert := alerts_by_id.get(index)) is not None and not alert.get("resolved", False))
+        # Alertes que la rétention va supprimer: les plus anciennes parmi l'existant et les nouvelles
+        overflow = _retention_excess(len(alerts) + len(tx.new_alerts), MAX_ALERTS); trimmed_unresolved = 0
+        if overflow > 0:
+            oldest = heapq.nsmallest(overflow, alerts[:overflow] + tx.new_alerts, key=_order_key)
+            trimmed_unresolved = sum(1 for alert in oldest
+                                     if not alert.get("resolved", False) and alert.get("_index") not in resolving)
+        fold_aggregates(tx.setdefault("aggregates", build_aggregates({}, [], 0, 0)), tx.new_logs, tx.new_alerts,
+                        newly_resolved, trimmed_unresolved)
+
+    def _index_logs(self, data: Dict[str, Any], added: List[Dict[str, Any]], evicted: List[Dict[str, Any]]) -> None:
+        """Répercute un commit sur les index des logs chauds (event_id, postings) sans les reconstruire."""
+        view_of, index = self._event_index
+        if view_of is data:
+            for entry in added:
+                if entry.get("event_id"): index[entry["event_id"]] = entry
+            for entry in evicted:
+                if entry.get("event_id"): index.pop(entry["event_id"], None)
+        view_of, log_index = self._log_index
+        if view_of is data and log_index is not None: log_index.add(added); log_index.evict(evicted)
+
+    def _log_index_for(self, data: Dict[str, Any]) -> LogIndex:
+        view_of, log_index = self._log_index
+        if view_of is not data or log_index is None:
+            # Construction unique au premier filtre (ou après rechargement du document)
+            log_index = LogIndex(data.get("access_logs", []))
+            self._log_index = (data, log_index)
+        return log_index
+
+    def read_state(self) -> Dict[str, Any]:
+        return self.load()
+
+    def version(self) -> int:
+        return self.load().get("version", 0)
+
+    def compact(self) -> None:
+        """Rien à replier: le document est réécrit en entier à chaque commit."""
+
+    @staticmethod
+    def _find_alert(alerts: List[Dict[str, Any]], index: int) -> Optional[Dict[str, Any]]:
+        for alert_item in alerts:
+            if alert_item.get("id") == index: return alert_item
+        return None
+
+    def _alerts_by_id(self, data: Dict[str, Any]) -> Dict[int, Dict[str, Any]]:
+        # Index id -> alerte, reconstruit après un ajout d'alerte (la troncature change alors la liste)
+        view_of, index = self._alert_index
+        if view_of is not data:
+            index = {alert["id"]: alert for alert in data.get("alerts", [])}
+            self._alert_index = (data, index)
+        return index
+
+    def get_alert(self, index: int) -> Optional[Dict[str, Any]]:
+        return self._alerts_by_id(self.load()).get(index)
+
+    def _open_alert(self, data: Dict[str, Any], key: AlertKey) -> Optional[Dict[str, Any]]:
+        # Index (type, source, sévérité) -> dernière alerte ouverte, reconstruit après un ajout d'alerte comme _alerts_by_id
+        view_of, index = self._open_alerts
+        if view_of is not data:
+            index = {alert_key(alert): alert for alert in data.get("alerts", []) if not alert.get("resolved", False)}
+            self._open_alerts = (data, index)
+        alert = index.get(key)
+        return None if alert is None or alert.get("resolved", False) else alert
+
+    def find_alerts(self, alert_type: Optional[str] = None, severity: Optional[str] = None,
+                    before: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Alertes non résolues correspondant à tous les critères fournis (before: horodatage exclu)."""
+        unresolved = self._alerts(False)
+        # Les alertes sont triées par horodatage: le critère "before" se résout par dichotomie
+        if before is not None: unresolved = unresolved[:bisect.bisect_left(unresolved, before, key=_timestamp_key)]
+        return [alert for alert in unresolved
+                if (alert_type is None or alert.get("type") == alert_type) and (severity is None or alert.get("severity") == severity)]
+
+    def _alerts(self, include_resolved: bool) -> List[Dict[str, Any]]:
+        data = self.load()
+        if include_resolved: return data.get("alerts", [])
+        # Vue des alertes non résolues, reconstruite après une écriture plutôt qu'à chaque lecture
+        view_of, unresolved = self._unresolved_view
+        if view_of is not data:
+            unresolved = [a for a in data.get("alerts", []) if not a.get("resolved", False)]
+            self._unresolved_view = (data, unresolved)
+        return unresolved
+
+    def find_logs_by_event_id(self, event_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """Logs déjà enregistrés pour ces clés d'idempotence (event_id), tant qu'ils sont conservés."""
+        data = self.load()
+        view_of, index = self._event_index
+        if view_of is not data:
+            index = {log["event_id"]: log for log in data.get("access_logs", []) if log.get("event_id")}
+            self._event_index = (data, index)
+        return {event_id: index[event_id] for event_id in event_ids if event_id in index}
+
+    def page_logs(self, offset: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        logs = self.load().get("access_logs", [])
+        return _page_desc(logs, offset, limit), len(logs)
+
+    def logs_before(self, key: Optional[CursorKey], limit: int,
+                    filters: Optional[Dict[str, str]] = None) -> Tuple[List[Dict[str, Any]], Optional[CursorKey]]:
+        data = self.load()
+        if filters: return self._log_index_for(data).before(key, limit, filters)
+        return _before_desc(data.get("access_logs", []), key, limit)
+
+    def recent_logs(self, limit: int, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        recent = []
+        for log in reversed(self.load().get("access_logs", [])):
+            if status is None or log.get("status") == status:
+                recent.append(log)
+                if len(recent) >= limit: break
+        return recent
+
+    def page_alerts(self, offset: int, limit: int, include_resolved: bool = False) -> Tuple[List[Dict[str, Any]], int]:
+        alerts = self._alerts(include_resolved)
+        return _page_desc(alerts, offset, limit), len(alerts)
+
+    def alerts_before(self, key: Optional[CursorKey], limit: int, include_resolved: bool = False) -> Tuple[List[Dict[str, Any]], Optional[CursorKey]]:
+        return _before_desc(self._alerts(include_resolved), key, limit)
+
+    def iter_collection(self, collection: str, since: Optional[str] = None, until: Optional[str] = None,
+                        filters: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+        """Entrées chaudes dans [since, until[ en ordre chronologique (copie de la tranche: un commit concurrent n'interfère pas)."""
+        items = self.load().get(collection, [])
+        lo = 0 if since is None else bisect.bisect_left(items, since, key=_timestamp_key)
+        hi = len(items) if until is None else bisect.bisect_left(items, until, key=_timestamp_key)
+        return (item for item in items[lo:hi] if _matches(item, filters))
+
+    def rollups(self, granularity: str, since: Optional[str] = None, until: Optional[str] = None) -> List[Tuple[str, str]]:
+        """(intervalle, ligne encodée) de la granularité qui recoupent [since, until[, en ordre chronologique."""
+        return select_buckets(self.load().get("rollups", {}).get(granularity, {}), granularity, since, until)
+
+
+def _atomic_write_json(path: str, data: Dict[str, Any]) -> int:
+    # Écriture dans un fichier temporaire du même répertoire puis rename: le fichier cible
+    # est toujours soit l'ancienne version complète, soit la nouvelle. Retourne la taille écrite.
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=2, ensure_ascii=False)
+            file.flush(); os.fsync(file.fileno()); size = file.tell()
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path): os.unlink(tmp_path)
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try: os.fsync(dir_fd)
+        finally: os.close(dir_fd)
+    except OSError: pass
+    return size
+
+
+class JournalStorage(JsonStorage):
+    """Document JSON en mémoire, persisté par un journal append-only plus un instantané compacté.
+
+    Chaque lot de commits ajoute ses mutations au journal (une ligne JSON par mutation, un fsync
+    par lot): le coût d'écriture dépend de l'événement, pas de la taille de l'historique. Au-delà
+    de JOURNAL_COMPACT_THRESHOLD lignes, un thread replie le journal dans l'instantané (DATA_FILE),
+    écrit de façon atomique. Au démarrage: instantané + rejeu des lignes postérieures à son numéro
+    de séquence. Les lignes ajoutées par d'autres processus sont rejouées à la lecture suivante
+    (signature du journal) et avant chaque commit, sous le verrou de fichier.
+    """
+
+    name = "journal"
+
+    def __init__(self, path: str = DATA_FILE, journal_path: Optional[str] = None,
+                 compact_threshold: int = JOURNAL_COMPACT_THRESHOLD) -> None:
+        super().__init__(path, cache_enabled=False)
+        self.journal_path = journal_path or JOURNAL_FILE or f"{path}.journal"
+        self.compact_threshold = compact_threshold
+        self._data: Optional[Dict[str, Any]] = None
+        self._journal_file = None
+        self._journal_lines = 0
+        self._journal_offset = 0
+        self._journal_signature: Optional[Tuple[int, int, int]] = None
+        self._snapshot_signature: Optional[Tuple[int, int, int]] = None
+        self._journal_payload: List[bytes] = []
+        self._seq = 0
+        self._compacting = False
+
+    def initialize(self) -> None:
+        with self._lock:
+            self.load()
+            self.compact()
+
+    def load(self) -> Dict[str, Any]:
+        if self._data is None or _file_signature(self.journal_path) != self._journal_signature:
+            with self._lock:
+                if self._data is None:
+                    with self._file_lock: self._data = self._recover()
+                # Verrou de fichier tenu: personne d'autre n'écrit, le rattrapage a été fait en le prenant
+                elif not self._file_lock.held: self._catch_up()
+        return self._data
+
+    def _file_locked(self) -> None:
+        if self._data is not None: self._catch_up()
+
+    def _recover(self) -> Dict[str, Any]:
+        # Appelé sous le verrou de fichier: la troncature ne peut pas couper l'écriture d'un autre processus
+        self._snapshot_signature = _file_signature(self.path)
+        data = self._read_file()
+        self._seq = data.get("journal_seq", 0)
+        replayed = 0; good_offset = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'rb') as file:
+                for line in file:
+                    try: record = json.loads(line)
+                    except ValueError:
+                        # Ligne tronquée par un arrêt brutal: tout ce qui suit est ignoré
+                        logger.warning("Journal %s: ligne incomplète ignorée à l'offset %s.", self.journal_path, good_offset)
+                        break
+                    good_offset += len(line)
+                    if record.get("seq", 0) <= self._seq: continue
+                    self._apply(data, record); self._seq = record["seq"]; replayed += 1
+            with open(self.journal_path, 'r+b') as file: file.truncate(good_offset)
+            # L'éviction rejouée a pu être archivée avant l'arrêt: les entrées déjà archivées sont écartées
+            _trim_collections(data, self.archive, replaying=True)
+        self._journal_lines = replayed; self._journal_offset = good_offset
+        self._journal_signature = _file_signature(self.journal_path)
+        if replayed: logger.info("Journal %s: %s mutations rejouées.", self.journal_path, replayed)
+        return data
+
+    def _catch_up(self) -> None:
+        """Rejoue les mutations ajoutées au journal par d'autres processus depuis la dernière lecture."""
+        journal = _file_signature(self.journal_path)
+        if journal == self._journal_signature: return
+        size = journal[1] if journal else 0
+        if _file_signature(self.path) != self._snapshot_signature or size < self._journal_offset:
+            # Compaction faite ailleurs: nouvel instantané et journal vidé, tout est relu
+            with self._file_lock: self._data = self._recover()
+            return
+        applied = 0
+        with open(self.journal_path, 'rb') as file:
+            file.seek(self._journal_offset)
+            for line in file:
+                # Ligne sans fin: écriture en cours dans un autre processus, reprise à la prochaine lecture
+                if not line.endswith(b"\n"): break
+                try: record = json.loads(line)
+                except ValueError: break
+                self._journal_offset += len(line); self._journal_lines += 1
+                if record.get("seq", 0) <= self._seq: continue
+                self._apply(self._data, record); self._seq = record["seq"]; applied += 1
+        self._journal_signature = journal if self._journal_offset == size else None
+        if applied:
+            _trim_collections(self._data, self.archive, replaying=True)
+            # Document modifié en place: les vues et index dérivés sont reconstruits à la demande
+            self._unresolved_view = (None, []); self._alert_index = (None, {}); self._open_alerts = (None, {})
+            self._event_index = (None, {}); self._log_index = (None, None)
+
+    @staticmethod
+    def _apply(data: Dict[str, Any], record: Dict[str, Any]) -> None:
+        op = record["op"]
+        if op == "set": data[record["key"]] = record["value"]
+        # Les séries sont dérivées à l'application de chaque mutation: le rejeu les reconstruit à l'identique
+        elif op == "log":
+            _insert_ordered(data, "access_logs", record["entry"]); fold_document(data.setdefault("rollups", {}), [record["entry"]], [])
+        elif op == "alert":
+            _insert_ordered(data, "alerts", record["alert"]); fold_document(data.setdefault("rollups", {}), [], [record["alert"]])
+        elif op == "alert_update":
+            # Rejeu uniquement (démarrage): le parcours linéaire suffit, MAX_ALERTS borne la liste
+            alert = JsonStorage._find_alert(data.get("alerts", []), record["index"])
+            if alert is not None: alert.update(record["fields"])
+
+    def _records(self, data: Dict[str, Any], tx: StateTransaction) -> List[Dict[str, Any]]:
+        records = [{"op": "set", "key": key, "value": value} for key, value in tx.items() if data.get(key) != value]
+        records += [{"op": "alert_update", "index": index, "fields": fields} for index, fields in tx.alert_updates.items()]
+        if tx.rollups is not None: records.append({"op": "set", "key": "rollups", "value": tx.rollups})
+        # Les identifiants sont fixés avant l'écriture pour que le rejeu reproduise exactement l'état
+        sequences = data.get("sequences", {})
+        next_alert_id = sequences.get("alerts", 0)
+        for alert in tx.new_alerts:
+            next_alert_id += 1; alert["_index"] = alert["id"] = next_alert_id
+            records.append({"op": "alert", "alert": alert})
+        next_log_id = sequences.get("access_logs", 0)
+        for entry in tx.new_logs:
+            next_log_id += 1; entry["id"] = next_log_id
+            records.append({"op": "log", "entry": entry})
+        return records
+
+    def _commit(self, data: Dict[str, Any], tx: StateTransaction) -> bool:
+        records = self._records(data, tx)
+        if not records: return False
+        for record in records:
+            self._seq += 1; record["seq"] = self._seq
+        self._journal_payload.append(b"".join(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n" for record in records))
+        # Mises à jour d'alertes (résolutions, occurrences repliées) par l'index id -> alerte plutôt qu'un parcours
+        alerts_by_id = self._alerts_by_id(data) if tx.alert_updates else {}
+        for record in records:
+            if record["op"] != "alert_update": self._apply(data, record)
+            elif (alert := alerts_by_id.get(record["index"])) is not None: alert.update(record["fields"])
+        # Une seule éviction par commit, comme pour le backend JSON (et comme l'a prévu _fold_aggregates)
+        evicted = _trim_collections(data, self.archive)
+        if tx.new_alerts or tx.alert_updates: self._unresolved_view = (None, [])
+        if tx.new_alerts: self._alert_index = (None, {}); self._open_alerts = (None, {})
+        self._index_logs(data, tx.new_logs, evicted.get("access_logs", []))
+        self._journal_lines += len(records)
+        return True
+
+    def _persist(self, data: Dict[str, Any], batch: List[_PendingCommit]) -> None:
+        payload = b"".join(self._journal_payload); self._journal_payload = []
+        try:
+            started = time.perf_counter()
+            if self._journal_file is None: self._journal_file = open(self.journal_path, 'ab')
+            # Fin de ligne laissée par un processus tué en pleine écriture: coupée, sinon le rejeu s'y arrêterait
+            if os.fstat(self._journal_file.fileno()).st_size != self._journal_offset: self._journal_file.truncate(self._journal_offset)
+            self._journal_file.write(payload); self._journal_file.flush()
+            os.fsync(self._journal_file.fileno())
+            _record_io(self.name, "append", started, len(payload))
+        except OSError as e:
+            logger.error("Erreur écriture journal: %s", e)
+            # Le lot est déjà appliqué en mémoire: l'état sera reconstruit depuis le disque au prochain accès
+            try:
+                if self._journal_file is not None: self._journal_file.truncate(self._journal_offset); self._journal_file.close()
+            except OSError: pass
+            self._journal_file = None; self._data = None
+            raise StorageError("Erreur sauvegarde") from e
+        self._journal_offset += len(payload); self._journal_signature = _file_signature(self.journal_path)
+        if self._journal_lines >= self.compact_threshold and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self.compact, name="journal-compaction", daemon=True).start()
+
+    def compact(self) -> None:
+        """Replie le journal dans un nouvel instantané puis vide le journal."""
+        with self._lock:
+            try:
+                # Lot en cours d'écriture: la prochaine compaction le prendra
+                if self._pending or self._flushing: return
+                with self._file_lock:
+                    self.load(); self._catch_up(); data = self._data
+                    # Appel périodique (planificateur) sur un journal déjà vide: l'instantané est à jour
+                    if not self._journal_offset: return
+                    data["journal_seq"] = self._seq
+                    # Si l'arrêt survient entre le rename et la troncature, journal_seq évite un double rejeu
+                    started = time.perf_counter()
+                    size = _atomic_write_json(self.path, data)
+                    _record_io(self.name, "compact", started, size)
+                    if self._journal_file is not None: self._journal_file.close(); self._journal_file = None
+                    with open(self.journal_path, 'wb') as file: os.fsync(file.fileno())
+                    self._journal_lines = 0; self._journal_offset = 0
+                    self._journal_signature = _file_signature(self.journal_path); self._snapshot_signature = _file_signature(self.path)
+            except OSError as e:
+                logger.error("Erreur compaction journal: %s", e)
+            finally:
+                self._compacting = False
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS access_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL, event TEXT, status TEXT, ip_address TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_access_logs_timestamp ON access_logs(timestamp);
+CREATE INDEX IF NOT EXISTS idx_access_logs_status ON access_logs(status, timestamp);
+CREATE INDEX IF NOT EXISTS idx_access_logs_ip ON access_logs(ip_address, timestamp);
+CREATE INDEX IF NOT EXISTS idx_access_logs_event_id ON access_logs(json_extract(doc, '$.event_id'));
+CREATE INDEX IF NOT EXISTS idx_access_logs_event ON access_logs(event, timestamp);
+CREATE INDEX IF NOT EXISTS idx_access_logs_agent ON access_logs(json_extract(doc, '$.agent'), timestamp);
+CREATE INDEX IF NOT EXISTS idx_access_logs_reason ON access_logs(json_extract(doc, '$.reason'), timestamp);
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL, type TEXT, severity TEXT, resolved INTEGER NOT NULL DEFAULT 0,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts(timestamp);
+CREATE INDEX IF NOT EXISTS idx_alerts_resolved ON alerts(resolved, timestamp);
+CREATE INDEX IF NOT EXISTS idx_alerts_open ON alerts(type, severity, json_extract(doc, '$.source')) WHERE resolved = 0;
+CREATE TABLE IF NOT EXISTS rollups (
+    granularity TEXT NOT NULL, bucket TEXT NOT NULL, row TEXT NOT NULL,
+    PRIMARY KEY (granularity, bucket)
+) WITHOUT ROWID;
+"""
+
+
+class SqliteStorage:
+    """État courant en table clé/valeur, logs et alertes en lignes indexées.
+
+    Un ajout coûte un INSERT quel que soit l'historique: MAX_LOGS peut être relevé
+    à plusieurs millions sans que la latence d'écriture suive.
+    """
+
+    name = "sqlite"
+    lock_id = DEFAULT_LOCK_ID
+    # Expression SQL indexée de chaque filtre (les champs absents d'une collection sont filtrés sur le document)
+    _FILTER_SQL = {
+        "access_logs": {"status": "status", "event": "event", "ip_address": "ip_address",
+                        "agent": "json_extract(doc, '$.agent')", "reason": "json_extract(doc, '$.reason')"},
+        "alerts": {"type": "type", "severity": "severity"},
+    }
+
+    def __init__(self, path: str = SQLITE_FILE) -> None:
+        self.path = path
+        self._local = threading.local()
+        self.coalesce_window = ALERT_COALESCE_WINDOW
+        self.archive = LogArchive(f"{path}.archive") if ARCHIVE_ENABLED else None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Une connexion par thread: sqlite3 refuse le partage entre threads par défaut
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SQLITE_SCHEMA)
+            if conn.execute("SELECT 1 FROM state WHERE key = 'aggregates'").fetchone() is None: self._backfill_aggregates(conn)
+            self._local.conn = conn
+        return conn
+
+    @classmethod
+    def _table_aggregates(cls, conn: sqlite3.Connection) -> Dict[str, Any]:
+        by_status = {status or "unknown": count for status, count in
+                     conn.execute("SELECT status, COUNT(*) FROM access_logs GROUP BY status")}
+        failed = [cls._log_from_row(row) for row in conn.execute(
+            "SELECT id, doc FROM access_logs WHERE status = 'failed' ORDER BY timestamp DESC, id DESC LIMIT ?", (RECENT_FAILURES,))]
+        unresolved = conn.execute("SELECT COUNT(*) FROM alerts WHERE resolved = 0").fetchone()[0]
+        return build_aggregates(by_status, failed[::-1], unresolved, conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0])
+
+    def _backfill_aggregates(self, conn: sqlite3.Connection) -> None:
+        # Base antérieure aux agrégats: calcul unique par SQL, ensuite tenus à jour à chaque commit
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM state WHERE key = 'aggregates'").fetchone() is None:
+                self._write_state(conn, "aggregates", self._table_aggregates(conn))
+            conn.execute("COMMIT")
+        except BaseException:
+            self._rollback(conn); raise
+
+    @staticmethod
+    def _rollback(conn: sqlite3.Connection) -> None:
+        try: conn.execute("ROLLBACK")
+        except sqlite3.Error: pass
+
+    def initialize(self) -> None:
+        # Persiste les valeurs par défaut manquantes (lues sinon à la volée par _read_state)
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, value in self._read_state(conn).items(): self._write_state(conn, key, value)
+            conn.execute("COMMIT")
+        except BaseException:
+            self._rollback(conn); raise
+        logger.info("Base SQLite %s initialisée.", self.path)
+
+    @staticmethod
+    def _read_state(conn: sqlite3.Connection) -> Dict[str, Any]:
+        state = merge_defaults({key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM state")})
+        for key in COLLECTIONS + DERIVED_KEYS: state.pop(key, None)
+        return state
+
+    @staticmethod
+    def _write_state(conn: sqlite3.Connection, key: str, value: Any) -> None:
+        conn.execute("INSERT INTO state (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                     (key, json.dumps(value, ensure_ascii=False)))
+
+    @staticmethod
+    def _insert_log(conn: sqlite3.Connection, entry: Dict[str, Any]) -> int:
+        # L'identifiant est la clé de la ligne: il n'est pas dupliqué dans le document
+        doc = {k: v for k, v in entry.items() if k != "id"}
+        cursor = conn.execute("INSERT INTO access_logs (timestamp, event, status, ip_address, doc) VALUES (?, ?, ?, ?, ?)",
+                              (entry.get("timestamp", ""), entry.get("event"), entry.get("status"),
+                               entry.get("ip_address"), json.dumps(doc, ensure_ascii=False)))
+        entry["id"] = cursor.lastrowid
+        return cursor.lastrowid
+
+    @staticmethod
+    def _insert_alert(conn: sqlite3.Connection, alert: Dict[str, Any]) -> int:
+        doc = {k: v for k, v in alert.items() if k not in ("_index", "id")}
+        cursor = conn.execute("INSERT INTO alerts (timestamp, type, severity, resolved, doc) VALUES (?, ?, ?, ?, ?)",
+                              (alert.get("timestamp", ""), alert.get("type"), alert.get("severity"),
+                               int(bool(alert.get("resolved", False))), json.dumps(doc, ensure_ascii=False)))
+        alert["id"] = cursor.lastrowid
+        return cursor.lastrowid
+
+    @contextmanager
+    def transaction(self) -> Iterator[StateTransaction]:
+        conn = self._connection()
+        # BEGIN IMMEDIATE sérialise les écrivains, y compris entre processus
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._read_state(conn)
+            tx = StateTransaction(copy.deepcopy(state), self.lock_id)
+            yield tx
+            started = time.perf_counter()
+            if tx.new_alerts: coalesce_alerts(tx, lambda key: self._open_alert(conn, key), self.coalesce_window)
+            newly_resolved = 0; trimmed_unresolved = 0
+            for index, fields in tx.alert_updates.items():
+                row = conn.execute("SELECT doc FROM alerts WHERE id = ?", (index,)).fetchone()
+                if row is None: continue
+                doc = json.loads(row[0])
+                if fields.get("resolved") and not doc.get("resolved", False): newly_resolved += 1
+                doc.update(fields)
+                conn.execute("UPDATE alerts SET resolved = ?, doc = ? WHERE id = ?",
+                             (int(bool(doc.get("resolved", False))), json.dumps(doc, ensure_ascii=False), index))
+            for alert in tx.new_alerts: alert["_index"] = self._insert_alert(conn, alert)
+            for entry in tx.new_logs: self._insert_log(conn, entry)
+            if tx.new_logs: self._trim_table(conn, "access_logs", MAX_LOGS, self._log_from_row)
+            if tx.new_alerts:
+                trimmed = self._trim_table(conn, "alerts", MAX_ALERTS, self._alert_from_row)
+                trimmed_unresolved = sum(1 for alert in trimmed if not alert.get("resolved", False))
+            if tx.rollups is not None: self._replace_rollups(conn, tx.rollups)
+            if tx.new_logs or tx.new_alerts: self._fold_rollups(conn, tx.new_logs, tx.new_alerts)
+            if tx.new_logs or tx.new_alerts or tx.alert_updates:
+                fold_aggregates(tx.setdefault("aggregates", build_aggregates({}, [], 0, 0)), tx.new_logs, tx.new_alerts,
+                                newly_resolved, trimmed_unresolved)
+            tx.bump_version(state)
+            for key, value in tx.items():
+                if state.get(key) != value: self._write_state(conn, key, value)
+            conn.execute("COMMIT")
+            _record_io(self.name, "commit", started)
+        except sqlite3.Error as e:
+            self._rollback(conn)
+            logger.error("Erreur sauvegarde données: %s", e)
+            raise StorageError("Erreur sauvegarde") from e
+        except BaseException:
+            self._rollback(conn); raise
+        _notify_commit(self.lock_id, state, tx)
+
+    @staticmethod
+    def _fold_rollups(conn: sqlite3.Connection, logs: List[Dict[str, Any]], alerts: List[Dict[str, Any]]) -> None:
+        rows: Dict[Tuple[str, str], List[Any]] = {}; created = set()
+
+        def fetch(granularity: str, bucket: str) -> Optional[str]:
+            row = conn.execute("SELECT row FROM rollups WHERE granularity = ? AND bucket = ?", (granularity, bucket)).fetchone()
+            if row is None: created.add(granularity)
+            return row[0] if row else None
+
+        fold_rows(rows, fetch, logs, alerts)
+        conn.executemany("INSERT INTO rollups (granularity, bucket, row) VALUES (?, ?, ?) "
+                         "ON CONFLICT(granularity, bucket) DO UPDATE SET row = excluded.row",
+                         [(granularity, bucket, encode_row(row)) for (granularity, bucket), row in rows.items()])
+        # Rétention vérifiée seulement quand un intervalle apparaît, par lots comme trim_buckets
+        for granularity in created:
+            limit = ROLLUP_RETENTION[granularity]
+            count = conn.execute("SELECT COUNT(*) FROM rollups WHERE granularity = ?", (granularity,)).fetchone()[0]
+            if count > limit + max(1, limit // 10):
+                conn.execute("DELETE FROM rollups WHERE granularity = ? AND bucket IN (SELECT bucket FROM rollups "
+                             "WHERE granularity = ? ORDER BY bucket LIMIT ?)", (granularity, granularity, count - limit))
+
+    @staticmethod
+    def _replace_rollups(conn: sqlite3.Connection, rollups: Dict[str, Dict[str, str]]) -> None:
+        conn.execute("DELETE FROM rollups")
+        conn.executemany("INSERT INTO rollups (granularity, bucket, row) VALUES (?, ?, ?)",
+                         [(granularity, bucket, row) for granularity, buckets in rollups.items() for bucket, row in buckets.items()])
+
+    def _trim_table(self, conn: sqlite3.Connection, table: str, limit: int, convert) -> List[Dict[str, Any]]:
+        """Archive puis supprime les lignes au-delà de la rétention; retourne les entrées évincées."""
+        # Les identifiants croissent avec le temps et seule la tête est supprimée: MAX - MIN + 1 compte les lignes sans COUNT(*)
+        low, high = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+        if high is None or _retention_excess(high - low + 1, limit) == 0: return []
+        cutoff = high - limit
+        evicted = [convert(row) for row in conn.execute(f"SELECT id, doc FROM {table} WHERE id <= ? ORDER BY id", (cutoff,))]
+        if self.archive is not None:
+            # Archivé avant le COMMIT: un rollback peut laisser un doublon dans l'archive, jamais une perte
+            try: self.archive.append(table, evicted)
+            except OSError as e:
+                logger.error("Erreur archivage %s: %s", table, e); return []
+        conn.execute(f"DELETE FROM {table} WHERE id <= ?", (cutoff,))
+        return evicted
+
+    def read_state(self) -> Dict[str, Any]:
+        return self._read_state(self._connection())
+
+    def version(self) -> int:
+        row = self._connection().execute("SELECT value FROM state WHERE key = 'version'").fetchone()
+        return json.loads(row[0]) if row else 0
+
+    def compact(self) -> None:
+        """Replie le WAL dans la base et met à jour les statistiques du planificateur de requêtes."""
+        started = time.perf_counter()
+        conn = self._connection()
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)"); conn.execute("PRAGMA optimize")
+        _record_io(self.name, "compact", started)
+
+    @staticmethod
+    def _log_from_row(row: Tuple[int, str]) -> Dict[str, Any]:
+        entry = json.loads(row[1]); entry["id"] = row[0]
+        return entry
+
+    @staticmethod
+    def _alert_from_row(row: Tuple[int, str]) -> Dict[str, Any]:
+        alert = json.loads(row[1]); alert["id"] = alert["_index"] = row[0]
+        return alert
+
+    @staticmethod
+    def _keyset_page(rows: List[Tuple[int, str]], limit: int, convert) -> Tuple[List[Dict[str, Any]], Optional[CursorKey]]:
+        # Une ligne de plus que la page indique s'il reste des entrées plus anciennes
+        page = [convert(row) for row in rows[:limit]]
+        return page, (_order_key(page[-1]) if page and len(rows) > limit else None)
+
+    def get_alert(self, index: int) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute("SELECT id, doc FROM alerts WHERE id = ?", (index,)).fetchone()
+        return self._alert_from_row(row) if row else None
+
+    @classmethod
+    def _open_alert(cls, conn: sqlite3.Connection, key: AlertKey) -> Optional[Dict[str, Any]]:
+        alert_type, source, severity = key
+        # Index partiel sur les seules alertes ouvertes: une recherche par commit, quelle que soit la taille de la table
+        row = conn.execute("SELECT id, doc FROM alerts WHERE type IS ? AND severity IS ? AND json_extract(doc, '$.source') IS ?"
+                           " AND resolved = 0 ORDER BY id DESC LIMIT 1", (alert_type, severity, source)).fetchone()
+        return cls._alert_from_row(row) if row else None
+
+    def find_logs_by_event_id(self, event_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not event_ids: return {}
+        placeholders = ", ".join("?" * len(event_ids))
+        rows = self._connection().execute(
+            f"SELECT id, doc FROM access_logs WHERE json_extract(doc, '$.event_id') IN ({placeholders})", list(event_ids))
+        return {log["event_id"]: log for log in map(self._log_from_row, rows)}
+
+    def page_logs(self, offset: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        conn = self._connection()
+        total = conn.execute("SELECT COUNT(*) FROM access_logs").fetchone()[0]
+        rows = conn.execute("SELECT id, doc FROM access_logs ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?", (limit, offset))
+        return [self._log_from_row(row) for row in rows], total
+
+    def logs_before(self, key: Optional[CursorKey], limit: int,
+                    filters: Optional[Dict[str, str]] = None) -> Tuple[List[Dict[str, Any]], Optional[CursorKey]]:
+        conditions, params = self._filter_conditions("access_logs", filters)
+        if key is not None: conditions.append("(timestamp, id) < (?, ?)"); params += [key[0], key[1]]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connection().execute(f"SELECT id, doc FROM access_logs {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+                                          params + [limit + 1])
+        return self._keyset_page(rows.fetchall(), limit, self._log_from_row)
+
+    @classmethod
+    def _filter_conditions(cls, collection: str, filters: Optional[Dict[str, str]]) -> Tuple[List[str], List[Any]]:
+        expressions = cls._FILTER_SQL[collection]
+        conditions = [f"{expressions[field]} = ?" for field in (filters or {}) if field in expressions]
+        return conditions, [value for field, value in (filters or {}).items() if field in expressions]
+
+    def recent_logs(self, limit: int, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        conn = self._connection()
+        if status is None:
+            rows = conn.execute("SELECT id, doc FROM access_logs ORDER BY timestamp DESC, id DESC LIMIT ?", (limit,))
+        else:
+            rows = conn.execute("SELECT id, doc FROM access_logs WHERE status = ? ORDER BY timestamp DESC, id DESC LIMIT ?", (status, limit))
+        return [self._log_from_row(row) for row in rows]
+
+    def find_alerts(self, alert_type: Optional[str] = None, severity: Optional[str] = None,
+                    before: Optional[str] = None) -> List[Dict[str, Any]]:
+        conditions = ["resolved = 0"]; params: List[Any] = []
+        if alert_type is not None: conditions.append("type = ?"); params.append(alert_type)
+        if severity is not None: conditions.append("severity = ?"); params.append(severity)
+        if before is not None: conditions.append("timestamp < ?"); params.append(before)
+        rows = self._connection().execute(f"SELECT id, doc FROM alerts WHERE {' AND '.join(conditions)} ORDER BY timestamp, id", params)
+        return [self._alert_from_row(row) for row in rows]
+
+    def page_alerts(self, offset: int, limit: int, include_resolved: bool = False) -> Tuple[List[Dict[str, Any]], int]:
+        conn = self._connection()
+        where = "" if include_resolved else "WHERE resolved = 0"
+        total = conn.execute(f"SELECT COUNT(*) FROM alerts {where}").fetchone()[0]
+        rows = conn.execute(f"SELECT id, doc FROM alerts {where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?", (limit, offset))
+        return [self._alert_from_row(row) for row in rows], total
+
+    def alerts_before(self, key: Optional[CursorKey], limit: int, include_resolved: bool = False) -> Tuple[List[Dict[str, Any]], Optional[CursorKey]]:
+        conditions = [] if include_resolved else ["resolved = 0"]
+        params: List[Any] = []
+        if key is not None: conditions.append("(timestamp, id) < (?, ?)"); params += [key[0], key[1]]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connection().execute(f"SELECT id, doc FROM alerts {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+                                          params + [limit + 1])
+        return self._keyset_page(rows.fetchall(), limit, self._alert_from_row)
+
+    def iter_collection(self, collection: str, since: Optional[str] = None, until: Optional[str] = None,
+                        filters: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+        """Lignes dans [since, until[ en ordre chronologique, lues par lots de EXPORT_CHUNK (pas de transaction longue)."""
+        conditions, params = self._filter_conditions(collection, filters)
+        if since is not None: conditions.append("timestamp >= ?"); params.append(since)
+        if until is not None: conditions.append("timestamp < ?"); params.append(until)
+        convert = self._log_from_row if collection == "access_logs" else self._alert_from_row
+        key: Tuple[str, int] = ("", 0)
+        while True:
+            where = " AND ".join(conditions + ["(timestamp, id) > (?, ?)"])
+            rows = self._connection().execute(f"SELECT id, doc, timestamp FROM {collection} WHERE {where} ORDER BY timestamp, id LIMIT ?",
+                                              params + [key[0], key[1], EXPORT_CHUNK]).fetchall()
+            for row in rows:
+                item = convert(row[:2])
+                if _matches(item, filters): yield item
+            if len(rows) < EXPORT_CHUNK: return
+            key = (rows[-1][2], rows[-1][0])
+
+    def rollups(self, granularity: str, since: Optional[str] = None, until: Optional[str] = None) -> List[Tuple[str, str]]:
+        """(intervalle, ligne encodée) de la granularité qui recoupent [since, until[, en ordre chronologique."""
+        params: List[Any] = [granularity]; conditions = ["granularity = ?"]
+        if since is not None: conditions.append("bucket >= ?"); params.append(since[:GRANULARITIES[granularity][0]])
+        if until is not None: conditions.append("bucket <= ?"); params.append(until[:GRANULARITIES[granularity][0]])
+        rows = self._connection().execute(f"SELECT bucket, row FROM rollups WHERE {' AND '.join(conditions)} ORDER BY bucket", params)
+        # L'intervalle de until n'est gardé que s'il commence avant until
+        return [(bucket, row) for bucket, row in rows if until is None or bucket + GRANULARITIES[granularity][1] < until]
+
+    def import_document(self, data: Dict[str, Any]) -> Dict[str, int]:
+        """Importe un document codes.json complet (migration unique)."""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM access_logs LIMIT 1").fetchone() or conn.execute("SELECT 1 FROM alerts LIMIT 1").fetchone():
+                raise StorageError(f"La base {self.path} contient déjà des données")
+            for key, value in merge_defaults(data).items():
+                if key not in COLLECTIONS and key not in DERIVED_KEYS: self._write_state(conn, key, value)
+            self._replace_rollups(conn, data.get("rollups", {}))
+            logs = sorted(data.get("access_logs", []), key=_timestamp_key)
+            alerts = sorted(data.get("alerts", []), key=_timestamp_key)
+            for entry in logs: self._insert_log(conn, entry)
+            for alert in alerts: self._insert_alert(conn, alert)
+            self._write_state(conn, "aggregates", self._table_aggregates(conn))
+            conn.execute("COMMIT")
+        except BaseException:
+            self._rollback(conn); raise
+        return {"access_logs": len(logs), "alerts": len(alerts)}
+
+
+def migrate_json_to_sqlite(json_path: str = DATA_FILE, sqlite_path: str = SQLITE_FILE) -> Dict[str, int]:
+    with open(json_path, 'r', encoding='utf-8') as file: data = json.load(file)
+    if not isinstance(data, dict): raise ValueError("Format JSON invalide")
+    counts = SqliteStorage(sqlite_path).import_document(data)
+    logger.info("Migration %s -> %s: %s logs, %s alertes.", json_path, sqlite_path, counts['access_logs'], counts['alerts'])
+    return counts
+
+
+BACKENDS = {"json": JsonStorage, "journal": JournalStorage, "sqlite": SqliteStorage}
+_SHARD_SUFFIX = {"json": ".json", "journal": ".json", "sqlite": ".db"}
+_shards: Dict[str, Any] = {}
+_shards_lock = threading.Lock()
+
+def _shard_path(lock_id: str) -> str:
+    # Le cadenas par défaut garde les fichiers historiques; les autres ont leur propre fichier dans LOCKS_DIR
+    if lock_id == DEFAULT_LOCK_ID: return SQLITE_FILE if STORAGE_BACKEND == "sqlite" else DATA_FILE
+    return os.path.join(LOCKS_DIR, f"{lock_id}{_SHARD_SUFFIX[STORAGE_BACKEND]}")
+
+def is_valid_lock_id(lock_id: str) -> bool:
+    return bool(LOCK_ID_PATTERN.match(lock_id or ""))
+
+def lock_exists(lock_id: str) -> bool:
+    return lock_id == DEFAULT_LOCK_ID or lock_id in _shards or os.path.exists(_shard_path(lock_id))
+
+def list_lock_ids() -> List[str]:
+    lock_ids = {DEFAULT_LOCK_ID} | set(_shards)
+    if os.path.isdir(LOCKS_DIR):
+        suffix = _SHARD_SUFFIX[STORAGE_BACKEND]
+        lock_ids |= {name[:-len(suffix)] for name in os.listdir(LOCKS_DIR)
+                     if name.endswith(suffix) and is_valid_lock_id(name[:-len(suffix)])}
+    return sorted(lock_ids)
+
+def get_storage(lock_id: str = DEFAULT_LOCK_ID):
+    """Backend du cadenas lock_id: chaque cadenas a son propre fichier (ou base) et son propre verrou,
+    une écriture sur un cadenas ne réécrit ni ne bloque jamais les autres."""
+    store = _shards.get(lock_id)
+    if store is None:
+        with _shards_lock:
+            store = _shards.get(lock_id)
+            if store is None:
+                if STORAGE_BACKEND not in BACKENDS: raise ValueError(f"STORAGE_BACKEND inconnu: {STORAGE_BACKEND}")
+                if not is_valid_lock_id(lock_id): raise ValueError(f"Identifiant de cadenas invalide: {lock_id}")
+                path = _shard_path(lock_id)
+                if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+                store = BACKENDS[STORAGE_BACKEND](path); store.lock_id = lock_id
+                _shards[lock_id] = store
+    return store
+
+def reconcile_aggregates(store) -> bool:
+    """Recompte les alertes non résolues et l'histogramme des raisons récentes; ne commite qu'en cas d'écart.
+
+    Les compteurs d'historique (by_status, totaux) ne sont pas recalculés: la rétention ayant
+    évincé des entrées, les collections conservées ne permettent pas de les reconstruire.
+    """
+    aggregates = store.read_state().get("aggregates", {})
+    unresolved = store.page_alerts(0, 0)[1]; reasons = _reason_histogram(aggregates.get("recent_failures", []))
+    if aggregates.get("unresolved_alerts") == unresolved and aggregates.get("failure_reasons") == reasons: return False
+    with store.transaction() as tx:
+        # Relu sous le verrou d'écriture: un commit concurrent a pu changer les deux valeurs
+        aggregates = tx.get("aggregates", {}); unresolved = store.page_alerts(0, 0)[1]
+        tx["aggregates"] = dict(aggregates, unresolved_alerts=unresolved,
+                                failure_reasons=_reason_histogram(aggregates.get("recent_failures", [])))
+    return True
+
+def rebuild_rollups(store) -> Dict[str, int]:
+    """Redérive les séries horaires et journalières de tout l'historique (archive comprise) et les remplace.
+
+    Le parcours se fait hors transaction; les entrées commitées entre-temps sont ajoutées sous le
+    verrou d'écriture, juste avant le remplacement: aucune n'est comptée deux fois ni perdue.
+    """
+    seen: Dict[str, Optional[CursorKey]] = {}
+
+    def scan(collection: str) -> Iterator[Dict[str, Any]]:
+        seen[collection] = None
+        for item in iter_records(store, collection):
+            seen[collection] = _order_key(item); yield item
+
+    rollups = rebuild(scan("access_logs"), scan("alerts"))
+    with store.transaction() as tx:
+        late = {collection: [item for item in store.iter_collection(collection, key[0] if key else None)
+                             if key is None or _order_key(item) > key] for collection, key in seen.items()}
+        fold_document(rollups, late["access_logs"], late["alerts"])
+        tx.replace_rollups(rollups)
+    return {granularity: len(buckets) for granularity, buckets in rollups.items()}
+
+def logs_in_range(store, since: Optional[str], until: Optional[str], key: Optional[CursorKey], limit: int,
+                  filters: Optional[Dict[str, str]] = None) -> Tuple[List[Dict[str, Any]], Optional[CursorKey]]:
+    """Page de logs horodatés dans [since, until[, du plus récent au plus ancien, en complétant
+    l'état chaud par l'archive: seuls les membres d'archive qui recoupent la plage sont lus."""
+    bounds = [k for k in (key, (until, 0) if until else None) if k is not None]
+    upper = min(bounds) if bounds else None
+
+    def in_range(item: Dict[str, Any]) -> bool:
+        return ((since is None or item.get("timestamp", "") >= since) and (upper is None or _order_key(item) < upper)
+                and _matches(item, filters))
+
+    hot, hot_next = store.logs_before(upper, limit, filters)
+    candidates = {item["id"]: item for item in hot if in_range(item)}
+    has_more = hot_next is not None and (since is None or hot[-1].get("timestamp", "") >= since)
+    archive = getattr(store, "archive", None)
+    if archive is not None:
+        members = archive.members("access_logs", since, upper[0] if upper else None)
+        for position, member in enumerate(members):
+            for item in archive.read_member(member):
+                # Une entrée archivée deux fois (rejeu après arrêt) ou encore chaude n'est rendue qu'une fois
+                if in_range(item): candidates.setdefault(item["id"], item)
+            if len(candidates) > limit and position + 1 < len(members):
+                threshold = sorted(candidates.values(), key=_order_key, reverse=True)[limit]
+                # Membres restants tous plus anciens que la page: inutile de les décompresser
+                if members[position + 1]["max_ts"] < threshold.get("timestamp", ""): has_more = True; break
+    ordered = sorted(candidates.values(), key=_order_key, reverse=True)
+    page = ordered[:limit]
+    has_more = has_more or len(ordered) > limit
+    return page, (_order_key(page[-1]) if page and has_more else None)
+
+def iter_records(store, collection: str, since: Optional[str] = None, until: Optional[str] = None,
+                 filters: Optional[Dict[str, str]] = None) -> Iterator[Dict[str, Any]]:
+    """Historique complet d'une collection (archive puis état chaud) dans [since, until[, en ordre chronologique.
+
+    Fusion paresseuse: un membre d'archive n'est décompressé que lorsqu'il peut contenir la
+    prochaine entrée à émettre. La mémoire dépend du recouvrement entre membres, pas de la
+    taille de l'historique.
+    """
+    def keep(item: Dict[str, Any]) -> bool:
+        timestamp = item.get("timestamp", "")
+        return (since is None or timestamp >= since) and (until is None or timestamp < until) and _matches(item, filters)
+
+    archive = getattr(store, "archive", None)
+    pending = sorted(archive.members(collection, since, until), key=lambda m: m["min_ts"]) if archive is not None else []
+    heap: List[Tuple[CursorKey, int, Dict[str, Any], Iterator[Dict[str, Any]]]] = []
+    counter = itertools.count()
+
+    def push(run: Iterator[Dict[str, Any]]) -> None:
+        for item in run:
+            heapq.heappush(heap, (_order_key(item), next(counter), item, run)); return
+
+    push(store.iter_collection(collection, since, until, filters))
+    position = 0; last_key = None
+    while heap or position < len(pending):
+        while position < len(pending) and (not heap or pending[position]["min_ts"] <= heap[0][0][0]):
+            push(iter(sorted(filter(keep, archive.read_member(pending[position])), key=_order_key))); position += 1
+        if not heap: continue
+        key, _, item, run = heapq.heappop(heap)
+        push(run)
+        # Une entrée archivée deux fois (ou encore chaude) ressort consécutivement: elle n'est émise qu'une fois
+        if key != last_key: yield item; last_key = key
+
+FleetCursorKey = Tuple[str, str, int]
+
+def _fleet_before(fetch, key: Optional[FleetCursorKey], limit: int) -> Tuple[List[Dict[str, Any]], Optional[FleetCursorKey]]:
+    # Fusion k-voies des pages de chaque cadenas, ordre global (timestamp, lock_id, id) décroissant:
+    # chaque cadenas ne fournit qu'au plus `limit` entrées, sans parcourir son historique.
+    candidates = []; shard_has_more = False
+    for lock_id in list_lock_ids():
+        if key is None: shard_key = None
+        elif lock_id > key[1]: shard_key = (key[0], 0)
+        elif lock_id < key[1]: shard_key = (key[0], sys.maxsize)
+        else: shard_key = (key[0], key[2])
+        items, next_key = fetch(get_storage(lock_id), shard_key, limit)
+        shard_has_more = shard_has_more or next_key is not None
+        candidates += [(item.get("timestamp", ""), lock_id, item.get("id", 0), item) for item in items]
+    candidates.sort(key=lambda c: c[:3], reverse=True)
+    page = [dict(item, lock_id=lock_id) for _, lock_id, _, item in candidates[:limit]]
+    has_more = len(candidates) > limit or shard_has_more
+    return page, ((page[-1]["timestamp"], page[-1]["lock_id"], page[-1].get("id", 0)) if page and has_more else None)
+
+def fleet_logs_before(key: Optional[FleetCursorKey], limit: int) -> Tuple[List[Dict[str, Any]], Optional[FleetCursorKey]]:
+    return _fleet_before(lambda store, shard_key, n: store.logs_before(shard_key, n), key, limit)
+
+def fleet_alerts_before(key: Optional[FleetCursorKey], limit: int, include_resolved: bool = False) -> Tuple[List[Dict[str, Any]], Optional[FleetCursorKey]]:
+    return _fleet_before(lambda store, shard_key, n: store.alerts_before(shard_key, n, include_resolved), key, limit)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Tests en processus du moteur d'anomalies (anomaly.py): le moteur vectorisé (NumPy) et le moteur en
+Python pur doivent produire les mêmes statistiques et les mêmes constats sur le même flux d'accès.
+
+python -m unittest test_anomaly (ou pytest test_anomaly.py); ignorés sans NumPy.
+"""
+
+import math
+import random
+import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+from anomaly import AnomalyEngine, np
+
+START = datetime(2026, 10, 1, 0, 0, 0)
+WINDOW = 7 * 24 * 3600
+
+
+def access(at: datetime, ip_address: str, agent: str, status: str, event: str = "door_open") -> Dict[str, Any]:
+    return {"event": event, "timestamp": at.isoformat(), "ip_address": ip_address, "agent": agent, "status": status}
+
+
+def access_stream(seed: int, days: int = 5) -> List[Tuple[str, Dict[str, Any]]]:
+    """Trafic ordinaire de jour sur trois cadenas, plus une anomalie plantée de chaque type"""
+    rng = random.Random(seed); stream: List[Tuple[str, Dict[str, Any]]] = []
+    for day in range(days):
+        for lock_id in ("lock-a", "lock-b", "lock-c"):
+            for _ in range(60):
+                at = START + timedelta(days=day, hours=rng.randint(8, 18), seconds=rng.randint(0, 3599))
+                agent = f"agent-{rng.randint(1, 6)}"; ip_address = f"10.0.{rng.randint(0, 3)}.{rng.randint(1, 20)}"
+                status = "failed" if rng.random() < 0.05 else "success"
+                stream.append((lock_id, access(at, ip_address, agent, status)))
+                if status == "success": stream.append((lock_id, access(at + timedelta(seconds=30), ip_address, agent, "success", "door_close")))
+    # Script à intervalle fixe, forte proportion d'échecs, devinette distribuée, heure inhabituelle, cycles incomplets
+    night = START + timedelta(days=days - 1, hours=3)
+    stream += [("lock-a", access(night + timedelta(seconds=7 * n), "203.0.113.9", "curl", "failed")) for n in range(20)]
+    stream += [("lock-b", access(night + timedelta(seconds=rng.randint(0, 7200)), "198.51.100.4", "agent-1", "failed")) for _ in range(12)]
+    stream += [("lock-c", access(night + timedelta(minutes=n), f"192.0.2.{n}", f"bot-{n}", "failed")) for n in range(15)]
+    stream.append(("lock-a", access(night, "10.0.0.1", "agent-2", "success")))
+    stream += [("lock-b", access(night + timedelta(hours=10, minutes=n), "10.0.1.1", "agent-9", "success")) for n in range(4)]
+    stream.sort(key=lambda item: item[1]["timestamp"])
+    return stream
+
+
+@unittest.skipUnless(np is not None, "NumPy absent: seul le moteur en Python pur est disponible")
+class EngineConcordanceTest(unittest.TestCase):
+    """Mêmes entrées, mêmes sorties: NumPy n'est qu'une accélération"""
+
+    def engines(self) -> Tuple[AnomalyEngine, AnomalyEngine]:
+        return AnomalyEngine(window_seconds=WINDOW, vectorized=True), AnomalyEngine(window_seconds=WINDOW, vectorized=False)
+
+    @staticmethod
+    def feed(engine: AnomalyEngine, stream: List[Tuple[str, Dict[str, Any]]]) -> None:
+        for lock_id, entry in stream: engine.on_commit(lock_id, {}, SimpleNamespace(new_logs=[entry]))
+
+    def assert_same_statistics(self, vectorized: AnomalyEngine, python: AnomalyEngine) -> None:
+        # pylint: disable=protected-access
+        expected = python._statistics(); actual = vectorized._statistics()
+        self.assertEqual(sorted(actual), sorted(expected))
+        for name, values in expected.items():
+            self.assertEqual(len(actual[name]), len(values), name)
+            for index, (got, want) in enumerate(zip(actual[name], values)):
+                self.assertTrue(math.isclose(got, want, rel_tol=1e-9, abs_tol=1e-9), f"{name}[{index}]: {got} != {want}")
+
+    @staticmethod
+    def findings(engine: AnomalyEngine) -> List[Tuple[str, str, str, float]]:
+        return sorted((f["lock_id"], f["kind"], f["subject"], f["score"]) for f in engine.last_findings)
+
+    def test_same_statistics_and_findings(self) -> None:
+        stream = access_stream(seed=7); now = datetime.fromisoformat(stream[-1][1]["timestamp"]).timestamp()
+        vectorized, python = self.engines()
+        for engine in (vectorized, python):
+            self.feed(engine, stream); engine.ingest(); engine._trim(now)  # pylint: disable=protected-access
+        self.assertEqual(vectorized.stats()["engine"], "numpy")
+        self.assertEqual(python.stats()["engine"], "python")
+        self.assert_same_statistics(vectorized, python)
+
+        raised: Dict[str, List[Any]] = {"numpy": [], "python": []}
+        vectorized.run(lambda lock_id, alerts: raised["numpy"].extend(alerts), now=now)
+        python.run(lambda lock_id, alerts: raised["python"].extend(alerts), now=now)
+        self.assertEqual(self.findings(vectorized), self.findings(python))
+        self.assertEqual(sorted(raised["numpy"]), sorted(raised["python"]))
+        self.assertEqual({"failure_rate", "scripted_attempts", "distributed_guessing", "odd_hour", "incomplete_cycles"},
+                         {kind for _, kind, _, _ in self.findings(python)})
+
+    def test_same_results_across_runs_and_trimmed_window(self) -> None:
+        """Deuxième passage: seuls les nouveaux événements lèvent un écart horaire, la fenêtre a glissé"""
+        first, second = access_stream(seed=11, days=4), access_stream(seed=12, days=6)
+        vectorized, python = self.engines()
+        for stream in (first, second):
+            now = datetime.fromisoformat(stream[-1][1]["timestamp"]).timestamp() + 2 * 24 * 3600
+            for engine in (vectorized, python):
+                self.feed(engine, stream); engine.run(lambda lock_id, alerts: None, now=now)
+            self.assertEqual(self.findings(vectorized), self.findings(python))
+        self.assertEqual(len(vectorized._ts), len(python._ts))  # pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+    unittest.main()
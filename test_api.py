@@ -1,16 +1,24 @@
 #!/usr/bin/env python3
 """
 Script de test complet pour l'API SmartCadenas - Version fonctionnelle
+
+--load lance un banc de charge concurrent (voir LoadTester) au lieu des tests fonctionnels.
 """
 
 import argparse
+import csv
+import itertools
 import json
 import logging
 import os
 import random
+import shutil
 import sys
+import threading
 import time
-from typing import Optional, Dict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Dict, List, Tuple
 
 import requests
 from requests.exceptions import RequestException
@@ -27,6 +35,8 @@ BASE_URL = os.getenv("API_BASE_URL", "http://localhost:5000/api")
 TEST_AGENT = os.getenv("TEST_AGENT", "TestBot/1.0")
 REQUEST_TIMEOUT = int(os.getenv("REQUEST_TIMEOUT", 5))
 DEFAULT_CODE_VALIDITY = int(os.getenv("CODE_VALIDITY", 300))  # 5 minutes
+# Répartition par défaut des scénarios du banc de charge (poids relatifs)
+DEFAULT_LOAD_MIX = "polling=60,dashboard=20,door_cycle=15,bruteforce=5"
 
 
 class Colors:
@@ -56,6 +66,8 @@ class APITester:
         self.current_code = None
         self.test_results = []
         self.failed_attempts = 0
+        self.failures_lock_id: Optional[str] = None
+        self.wrong_code: Optional[str] = None
 
     def make_request(self, method: str, endpoint: str, **kwargs) -> Optional[Dict]:
         """Effectue une requête HTTP avec gestion des erreurs"""
@@ -70,6 +82,17 @@ class APITester:
             logger.error(f"Erreur de requête: {e}")
             return None
 
+    def failures_lock(self) -> Optional[str]:
+        """Cadenas propre à ce lancement pour les codes erronés. Le limiteur compte les échecs par (cadenas, IP):
+        sur le cadenas par défaut, ceux d'un lancement précédent bloqueraient celui-ci (429) pendant LIMITER_WINDOW"""
+        if self.failures_lock_id is None:
+            lock_id = f"failures-{int(time.time())}-{random.randint(1000, 9999)}"
+            generated = self.make_request('POST', f'/locks/{lock_id}/code')
+            if generated:
+                self.failures_lock_id = lock_id
+                self.wrong_code = "".join("1" if digit == "0" else "0" for digit in generated['code'])
+        return self.failures_lock_id
+
     def run_test(self, test_func, description: str) -> bool:
         """Exécute un test et enregistre le résultat"""
         print_colored(f"\n{description}", Colors.CYAN)
@@ -113,7 +136,26 @@ class APITester:
             ('test_multiple_failures', "9. Tentatives multiples échouées"),
             ('test_create_alert', "10. Création d'alerte"),
             ('test_get_logs', "11. Récupération des logs"),
-            ('test_get_alerts', "12. Récupération des alertes")
+            ('test_get_alerts', "12. Récupération des alertes"),
+            ('test_logs_cursor', "13. Pagination des logs par curseur"),
+            ('test_lock_fleet', "14. Flotte multi-cadenas"),
+            ('test_access_batch', "15. Lot d'événements tamponnés"),
+            ('test_event_stream', "16. Flux d'événements SSE"),
+            ('test_etag_version', "17. ETag et sonde de version"),
+            ('test_bruteforce_lockout', "18. Blocage d'une source après échecs répétés"),
+            ('test_aggregates', "19. Agrégats du tableau de bord"),
+            ('test_bulk_resolve', "20. Résolution groupée des alertes"),
+            ('test_log_archive', "21. Archive des logs évincés"),
+            ('test_export', "22. Export NDJSON / CSV en flux"),
+            ('test_log_filters', "23. Filtres des logs par index secondaires"),
+            ('test_metrics', "24. Exposition des métriques Prometheus"),
+            ('test_code_verify', "25. Vérification de code côté serveur"),
+            ('test_offline_codes', "26. Codes hors ligne par fenêtre de temps"),
+            ('test_concurrent_writes', "27. Écritures concurrentes sans perte"),
+            ('test_stats', "28. Séries horaires et journalières"),
+            ('test_anomalies', "29. Moteur d'anomalies hors du chemin des requêtes"),
+            ('test_alert_coalescing', "30. Déduplication des alertes répétées"),
+            ('test_notifications', "31. État des notifications sortantes")
         ]
 
         for test_method_name, description in test_order:
@@ -168,8 +210,11 @@ class APITester:
 
     def test_access_fail(self) -> bool:
         """Teste l'accès avec code invalide"""
-        payload = {"event": "door_open", "code": "0000"}
-        response = self.make_request('POST', '/access', json=payload)
+        lock_id = self.failures_lock()
+        if not lock_id:
+            return False
+        payload = {"event": "door_open", "code": self.wrong_code}
+        response = self.make_request('POST', f'/locks/{lock_id}/access', json=payload)
         return response and response.get('event_status') == "failed"
 
     def test_invalidate_code(self) -> bool:
@@ -183,16 +228,27 @@ class APITester:
 
     def test_error_reason(self) -> bool:
         """Teste les raisons d'échec détaillées"""
-        payload = {"event": "door_open", "code": "9999"}
-        response = self.make_request('POST', '/access', json=payload)
+        lock_id = self.failures_lock()
+        if not lock_id:
+            return False
+        payload = {"event": "door_open", "code": self.wrong_code}
+        response = self.make_request('POST', f'/locks/{lock_id}/access', json=payload)
         return response and 'reason' in response
 
     def test_multiple_failures(self) -> bool:
-        """Teste les tentatives multiples échouées"""
-        for _ in range(3):
-            payload = {"event": "door_open", "code": str(random.randint(1000, 9999))}
-            self.make_request('POST', '/access', json=payload)
-        return True
+        """Teste les tentatives multiples échouées (la source est ensuite bloquée LOCKOUT_DURATION secondes sur ce cadenas)"""
+        lock_id = self.failures_lock()
+        settings = self.make_request('GET', f'/locks/{lock_id}/settings') if lock_id else None
+        if not settings:
+            return False
+        try:
+            for _ in range(settings['max_attempts'] + 1):
+                response = self.session.post(f"{BASE_URL}/locks/{lock_id}/access", timeout=REQUEST_TIMEOUT,
+                                             json={"event": "door_open", "code": self.wrong_code})
+        except RequestException as e:
+            logger.error(f"Erreur de requête: {e}")
+            return False
+        return response.status_code == 429
 
     def test_create_alert(self) -> bool:
         """Teste la création d'alerte"""
@@ -210,6 +266,404 @@ class APITester:
         response = self.make_request('GET', '/alerts')
         return response and 'alerts' in response
 
+    def test_logs_cursor(self) -> bool:
+        """Teste la pagination par curseur des logs (pages disjointes, de la plus récente à la plus ancienne)"""
+        first = self.make_request('GET', '/logs', params={'cursor': '', 'per_page': 2})
+        if not first or len(first.get('logs', [])) != 2 or not first['pagination'].get('next_cursor'):
+            return False
+        second = self.make_request('GET', '/logs', params={'cursor': first['pagination']['next_cursor'], 'per_page': 2})
+        if not second or not second.get('logs'):
+            return False
+        first_ids = {log['id'] for log in first['logs']}
+        return (not first_ids & {log['id'] for log in second['logs']}
+                and first['logs'][-1]['timestamp'] >= second['logs'][0]['timestamp'])
+
+    def test_lock_fleet(self) -> bool:
+        """Teste l'isolation d'un second cadenas et les vues de flotte"""
+        lock_id = f"test-{int(time.time())}"
+        if self.make_request('GET', f'/locks/{lock_id}/code') is not None:
+            return False  # un cadenas jamais provisionné doit être inconnu (404)
+        default_before = self.make_request('GET', '/code')
+        generated = self.make_request('POST', f'/locks/{lock_id}/code')
+        if not generated or not generated.get('code'):
+            return False
+        payload = {"event": "door_open", "code": generated['code']}
+        access = self.make_request('POST', f'/locks/{lock_id}/access', json=payload)
+        if not access or access.get('event_status') != "success":
+            return False
+        default_after = self.make_request('GET', '/code')
+        if not default_before or not default_after or default_before.get('code') != default_after.get('code'):
+            return False
+        locks = self.make_request('GET', '/locks')
+        fleet_logs = self.make_request('GET', '/fleet/logs', params={'per_page': 50})
+        return (locks is not None and lock_id in {lock['lock_id'] for lock in locks.get('locks', [])}
+                and fleet_logs is not None and any(log.get('lock_id') == lock_id for log in fleet_logs.get('logs', [])))
+
+    def test_access_batch(self) -> bool:
+        """Teste le rejeu d'un lot d'événements et son idempotence"""
+        lock_id = f"batch-{int(time.time())}"
+        generated = self.make_request('POST', f'/locks/{lock_id}/code')
+        if not generated or not generated.get('code'):
+            return False
+        prefix = f"{lock_id}-{random.randint(1000, 9999)}"
+        events = [
+            {"event_id": f"{prefix}-1", "event": "door_open", "code": generated['code'], "timestamp": generated['generated_at']},
+            {"event_id": f"{prefix}-2", "event": "door_close", "code": "_LBE_"},
+            {"event_id": f"{prefix}-3", "event": "door_jump", "code": "1234"},
+        ]
+        first = self.make_request('POST', f'/locks/{lock_id}/access/batch', json={"events": events})
+        if not first or [r['status'] for r in first.get('results', [])] != ["logged", "logged", "rejected"]:
+            return False
+        if first['results'][0].get('event_status') != "success":
+            return False
+        retry = self.make_request('POST', f'/locks/{lock_id}/access/batch', json={"events": events})
+        logs = self.make_request('GET', f'/locks/{lock_id}/logs', params={'per_page': 50})
+        return (retry is not None and retry.get('logged') == 0 and retry.get('duplicates') == 2
+                and logs is not None and logs['pagination']['total'] == 2)
+
+    def test_event_stream(self) -> bool:
+        """Teste la réception en moins d'une seconde d'une alerte via /api/events, avec la version d'état de son commit"""
+        marker = f"sse-{random.randint(100000, 999999)}"
+        try:
+            with self.session.get(f"{BASE_URL}/events", stream=True, timeout=REQUEST_TIMEOUT) as stream:
+                lines = stream.iter_lines(decode_unicode=True)
+                next(lines)  # "retry: ...": l'abonnement est actif
+                start = time.time()
+                self.make_request('POST', '/alert', json={"type": "test", "message": marker})
+                event_type = None
+                for line in lines:
+                    if time.time() - start > 1:
+                        return False
+                    if line.startswith('event:'):
+                        event_type = line.split(':', 1)[1].strip()
+                    # Alerte "test" déjà ouverte (tests précédents): l'occurrence est repliée sur celle-ci
+                    elif line.startswith('data:') and event_type in ("alert_created", "alert_coalesced") and marker in line:
+                        # La version permet au tableau de bord de distinguer les écritures des autres workers (sonde /api/version)
+                        version = json.loads(line.split(':', 1)[1]).get('version')
+                        return isinstance(version, int) and version <= self.make_request('GET', '/version')['version']
+        except RequestException as e:
+            logger.error(f"Erreur flux SSE: {e}")
+        return False
+
+    def test_etag_version(self) -> bool:
+        """Teste les réponses 304 sur état inchangé et l'incrément de version après écriture"""
+        version = self.session.get(f"{BASE_URL}/version", timeout=REQUEST_TIMEOUT)
+        code = self.session.get(f"{BASE_URL}/code", timeout=REQUEST_TIMEOUT)
+        etag = code.headers.get('ETag')
+        if version.status_code != 200 or not etag:
+            return False
+        unchanged = self.session.get(f"{BASE_URL}/code", headers={'If-None-Match': etag}, timeout=REQUEST_TIMEOUT)
+        if unchanged.status_code != 304 or unchanged.content:
+            return False
+        self.make_request('POST', '/alert', json={"type": "test", "message": "Version"})
+        after = self.session.get(f"{BASE_URL}/version", headers={'If-None-Match': version.headers.get('ETag', '')},
+                                 timeout=REQUEST_TIMEOUT)
+        return after.status_code == 200 and after.json().get('version', 0) > version.json().get('version', 0)
+
+    def test_bruteforce_lockout(self) -> bool:
+        """Teste le blocage (429) d'une source après max_attempts échecs, sans effet sur les autres cadenas"""
+        lock_id = f"bruteforce-{int(time.time())}"
+        generated = self.make_request('POST', f'/locks/{lock_id}/code')
+        settings = self.make_request('GET', f'/locks/{lock_id}/settings')
+        if not generated or not settings:
+            return False
+        wrong_code = "0" * settings['code_length'] if generated['code'] != "0" * settings['code_length'] else "1" * settings['code_length']
+        payload = {"event": "door_open", "code": wrong_code}
+        for _ in range(settings['max_attempts']):
+            if not self.make_request('POST', f'/locks/{lock_id}/access', json=payload):
+                return False
+        blocked = self.session.post(f"{BASE_URL}/locks/{lock_id}/access", timeout=REQUEST_TIMEOUT,
+                                    json={"event": "door_open", "code": generated['code']})
+        if blocked.status_code != 429 or not blocked.headers.get('Retry-After'):
+            return False
+        alerts = self.make_request('GET', f'/locks/{lock_id}/alerts')
+        return alerts is not None and any(a.get('type') == "multiple_failed_attempts" for a in alerts.get('alerts', []))
+
+    def test_aggregates(self) -> bool:
+        """Teste la mise à jour des agrégats à l'écriture (statuts, raisons d'échec, alertes non résolues)"""
+        lock_id = f"aggregates-{int(time.time())}"
+        generated = self.make_request('POST', f'/locks/{lock_id}/code')
+        if not generated:
+            return False
+        wrong_code = "".join("1" if digit == "0" else "0" for digit in generated['code'])
+        self.make_request('POST', f'/locks/{lock_id}/access', json={"event": "door_open", "code": wrong_code})
+        alert = self.make_request('POST', f'/locks/{lock_id}/alert', json={"type": "test", "message": "Agrégats"})
+        before = self.make_request('GET', f'/locks/{lock_id}/aggregates')
+        if not alert or not before:
+            return False
+        if (before['by_status'].get('failed') != 1 or before['failure_reasons'].get('code_incorrect') != 1
+                or before['unresolved_alerts'] != 1 or len(before['recent_failures']) != 1):
+            return False
+        self.make_request('POST', f"/locks/{lock_id}/alert/{alert['alert_id']}/resolve")
+        after = self.make_request('GET', f'/locks/{lock_id}/aggregates')
+        return after is not None and after['unresolved_alerts'] == 0 and after['logs_total'] == 1
+
+    def test_bulk_resolve(self) -> bool:
+        """Teste la résolution groupée par identifiants puis par filtre"""
+        lock_id = f"bulk-{int(time.time())}"
+        if not self.make_request('POST', f'/locks/{lock_id}/code'):
+            return False
+        ids = []
+        for alert_type, severity in (("test", "medium"), ("test", "high"), ("autre", "medium")):
+            alert = self.make_request('POST', f'/locks/{lock_id}/alert', json={"type": alert_type, "message": "Lot", "severity": severity})
+            if not alert:
+                return False
+            ids.append(alert['alert_id'])
+        by_ids = self.make_request('POST', f'/locks/{lock_id}/alerts/resolve', json={"ids": [ids[0], 999999]})
+        if not by_ids or by_ids['resolved'] != 1 or by_ids['not_found'] != [999999]:
+            return False
+        by_filter = self.make_request('POST', f'/locks/{lock_id}/alerts/resolve', json={"type": "test"})
+        if not by_filter or by_filter['ids'] != [ids[1]]:
+            return False
+        aggregates = self.make_request('GET', f'/locks/{lock_id}/aggregates')
+        return aggregates is not None and aggregates['unresolved_alerts'] == 1
+
+    def test_log_archive(self) -> bool:
+        """Teste qu'une plage de dates retrouve les logs évincés vers l'archive (MAX_LOGS par défaut)"""
+        lock_id = f"archive-{int(time.time())}"
+        if not self.make_request('POST', f'/locks/{lock_id}/code'):
+            return False
+        since = datetime.now().isoformat()
+        total = 1200
+        for batch in range(total // 100):
+            events = [{"event_id": f"{lock_id}-{batch}-{i}", "event": "door_close", "code": "_LBE_"} for i in range(100)]
+            if not self.make_request('POST', f'/locks/{lock_id}/access/batch', json={"events": events}):
+                return False
+        hot = self.make_request('GET', f'/locks/{lock_id}/logs')
+        if not hot or hot['pagination']['total'] >= total:
+            return False
+        ids, cursor = set(), None
+        while True:
+            params = {'since': since, 'per_page': 50}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.make_request('GET', f'/locks/{lock_id}/logs', params=params)
+            if not page:
+                return False
+            ids.update(log['id'] for log in page['logs'])
+            cursor = page['pagination']['next_cursor']
+            if not cursor:
+                break
+        return len(ids) == total
+
+    def test_export(self) -> bool:
+        """Teste l'export en flux NDJSON (gzip négocié) et CSV avec filtres"""
+        lock_id = f"export-{int(time.time())}"
+        if not self.make_request('POST', f'/locks/{lock_id}/code'):
+            return False
+        events = [{"event_id": f"{lock_id}-{i}", "event": "door_close", "code": "_LBE_"} for i in range(5)]
+        if not self.make_request('POST', f'/locks/{lock_id}/access/batch', json={"events": events}):
+            return False
+        # Alerte répétée: repliée, son nombre d'occurrences doit figurer dans l'export CSV
+        alert = {"type": "force_attempt", "message": "Export", "severity": "low"}
+        if not all(self.make_request('POST', f'/locks/{lock_id}/alert', json=alert) for _ in range(2)):
+            return False
+        try:
+            ndjson = self.session.get(f"{BASE_URL}/locks/{lock_id}/logs/export", params={'event': 'door_close'},
+                                      headers={'Accept-Encoding': 'gzip'}, timeout=REQUEST_TIMEOUT)
+            records = [json.loads(line) for line in ndjson.text.splitlines()]
+            csv_export = self.session.get(f"{BASE_URL}/locks/{lock_id}/logs/export",
+                                          params={'format': 'csv', 'status': 'failed'}, timeout=REQUEST_TIMEOUT)
+            alerts_export = self.session.get(f"{BASE_URL}/locks/{lock_id}/alerts/export", params={'format': 'csv'},
+                                             timeout=REQUEST_TIMEOUT)
+            alert_rows = list(csv.DictReader(alerts_export.text.splitlines()))
+        except (RequestException, ValueError) as e:
+            logger.error(f"Erreur export: {e}")
+            return False
+        return (ndjson.headers.get('Content-Encoding') == 'gzip' and len(records) == 5
+                and [r['event_id'] for r in records] == [e['event_id'] for e in events]
+                and csv_export.text.splitlines()[0].startswith('id,timestamp,event') and len(csv_export.text.splitlines()) == 1
+                and len(alert_rows) == 1 and alert_rows[0]['count'] == '2' and alert_rows[0]['source']
+                and '' < alert_rows[0]['first_seen'] <= alert_rows[0]['last_seen'])
+
+    def test_log_filters(self) -> bool:
+        """Teste les filtres agent/event/status de /api/logs et leur pagination par curseur"""
+        lock_id = f"filters-{int(time.time())}"
+        if not self.make_request('POST', f'/locks/{lock_id}/code'):
+            return False
+        events = [{"event_id": f"{lock_id}-{i}", "event": "door_close", "code": "_LBE_", "agent": ("alpha", "beta")[i % 2]}
+                  for i in range(6)]
+        if not self.make_request('POST', f'/locks/{lock_id}/access/batch', json={"events": events}):
+            return False
+        found, cursor = [], None
+        while True:
+            params = {'agent': 'alpha', 'event': 'door_close', 'per_page': 2}
+            if cursor:
+                params['cursor'] = cursor
+            page = self.make_request('GET', f'/locks/{lock_id}/logs', params=params)
+            if not page:
+                return False
+            found += page['logs']
+            cursor = page['pagination']['next_cursor']
+            if not cursor:
+                break
+        none = self.make_request('GET', f'/locks/{lock_id}/logs', params={'agent': 'beta', 'event': 'door_open'})
+        return (len(found) == 3 and all(log['agent'] == 'alpha' for log in found)
+                and [log['event_id'] for log in found] == [f"{lock_id}-4", f"{lock_id}-2", f"{lock_id}-0"]
+                and none is not None and none['logs'] == [])
+
+    def test_metrics(self) -> bool:
+        """Teste l'exposition /metrics: histogramme des requêtes, compteurs et mesures par cadenas"""
+        if not self.make_request('GET', '/code'):
+            return False
+        try:
+            response = self.session.get(f"{BASE_URL.rsplit('/api', 1)[0]}/metrics", timeout=REQUEST_TIMEOUT)
+        except RequestException as e:
+            logger.error(f"Erreur métriques: {e}")
+            return False
+        text = response.text
+        return (response.status_code == 200 and response.headers.get('Content-Type', '').startswith('text/plain')
+                and 'smartcadenas_http_request_duration_seconds_count{' in text
+                and '# TYPE smartcadenas_logs_held gauge' in text and 'smartcadenas_storage_duration_seconds_bucket{' in text)
+
+    def test_code_verify(self) -> bool:
+        """Teste /code/verify: JSON, texte et binaire négociés par Accept, sans exposer le code"""
+        lock_id = f"verify-{int(time.time())}"
+        generated = self.make_request('POST', f'/locks/{lock_id}/code')
+        if not generated:
+            return False
+        code = generated['code']; wrong = '1' * len(code) if code != '1' * len(code) else '2' * len(code)
+        url = f"{BASE_URL}/locks/{lock_id}/code/verify"
+        try:
+            as_json = self.session.post(url, json={"code": code}, timeout=REQUEST_TIMEOUT)
+            as_text = self.session.post(url, data=wrong, headers={'Content-Type': 'text/plain', 'Accept': 'text/plain'},
+                                        timeout=REQUEST_TIMEOUT)
+            as_binary = self.session.post(url, data=code, headers={'Content-Type': 'text/plain', 'Accept': 'application/octet-stream'},
+                                          timeout=REQUEST_TIMEOUT)
+        except RequestException as e:
+            logger.error(f"Erreur vérification: {e}")
+            return False
+        return (as_json.status_code == 200 and as_json.json()['valid'] and code not in as_json.text
+                and as_text.text.startswith('1 ') and len(as_text.content) == 8
+                and len(as_binary.content) == 3 and as_binary.content[0] == 0 and int.from_bytes(as_binary.content[1:], 'big') > 0)
+
+    def test_offline_codes(self) -> bool:
+        """Teste le mode hors ligne: fenêtres à venir, ouverture avec le code dérivé, usage unique"""
+        lock_id = f"offline-{int(time.time())}"
+        enabled = self.make_request('POST', f'/locks/{lock_id}/code/offline')
+        if not enabled or not enabled.get('secret'):
+            return False
+        windows = self.make_request('GET', f'/locks/{lock_id}/code/windows', params={'count': 3})
+        if not windows or len(windows['windows']) != 3:
+            return False
+        code = windows['windows'][0]['code']
+        first = self.make_request('POST', f'/locks/{lock_id}/access', json={"event": "door_open", "code": code, "agent": "offline"})
+        second = self.make_request('POST', f'/locks/{lock_id}/access', json={"event": "door_open", "code": code, "agent": "offline"})
+        after = self.make_request('GET', f'/locks/{lock_id}/code/windows', params={'count': 1})
+        return (first is not None and first['event_status'] == 'success'
+                and second is not None and second['reason'] == 'code_already_used_for_entry_or_exit'
+                and after is not None and len(code) == windows['digits']
+                # Fenêtre changée entre-temps: elle n'est plus listée, l'usage unique a été vérifié par second
+                and {w['window']: w['used'] for w in after['windows']}.get(windows['windows'][0]['window'], True))
+
+    def test_concurrent_writes(self) -> bool:
+        """Teste que des écritures simultanées sur un cadenas sont toutes conservées (ids distincts, agrégats exacts)"""
+        lock_id = f"concurrent-{int(time.time())}"
+        if not self.make_request('POST', f'/locks/{lock_id}/code'):
+            return False
+        writers = 20
+
+        def post_alert(i: int) -> Optional[int]:
+            try:
+                response = requests.post(f"{BASE_URL}/locks/{lock_id}/alert", timeout=REQUEST_TIMEOUT,
+                                         json={"type": f"test-{i}", "message": f"Écriture concurrente {i}"},
+                                         headers={'User-Agent': TEST_AGENT})
+                return response.json().get('alert_id') if response.status_code == 201 else None
+            except (RequestException, ValueError):
+                return None
+
+        with ThreadPoolExecutor(max_workers=writers) as pool:
+            alert_ids = list(pool.map(post_alert, range(writers)))
+        aggregates = self.make_request('GET', f'/locks/{lock_id}/aggregates')
+        alerts = self.make_request('GET', f'/locks/{lock_id}/alerts', params={'per_page': writers})
+        return (None not in alert_ids and len(set(alert_ids)) == writers
+                and aggregates is not None and aggregates['alerts_total'] == writers
+                and aggregates['unresolved_alerts'] == writers
+                and alerts is not None and {a['id'] for a in alerts['alerts']} == set(alert_ids))
+
+    def test_stats(self) -> bool:
+        """Teste les séries /api/stats (compteurs, raisons d'échec, sévérités, IP distinctes) par heure et par jour"""
+        lock_id = f"stats-{int(time.time())}"
+        generated = self.make_request('POST', f'/locks/{lock_id}/code')
+        if not generated:
+            return False
+        since = (datetime.now() - timedelta(hours=1)).isoformat()
+        wrong_code = "".join("1" if digit == "0" else "0" for digit in generated['code'])
+        self.make_request('POST', f'/locks/{lock_id}/access', json={"event": "door_open", "code": wrong_code})
+        self.make_request('POST', f'/locks/{lock_id}/access', json={"event": "door_open", "code": generated['code']})
+        self.make_request('POST', f'/locks/{lock_id}/access', json={"event": "door_close", "code": "_LBE_"})
+        self.make_request('POST', f'/locks/{lock_id}/alert', json={"type": "test", "message": "Séries", "severity": "high"})
+        hourly = self.make_request('GET', f'/locks/{lock_id}/stats', params={'granularity': 'hour', 'since': since})
+        daily = self.make_request('GET', f'/locks/{lock_id}/stats', params={'granularity': 'day'})
+        empty = self.make_request('GET', f'/locks/{lock_id}/stats', params={'until': since[:10]})
+        invalid = self.session.get(f"{BASE_URL}/locks/{lock_id}/stats", params={'granularity': 'week'}, timeout=REQUEST_TIMEOUT)
+        if not hourly or not daily or empty is None:
+            return False
+        totals = hourly['totals']
+        return (totals['opens'] == 2 and totals['closes'] == 1 and totals['success'] == 2 and totals['failed'] == 1
+                and totals['failure_reasons'] == {"code_incorrect": 1} and totals['alerts_high'] == 1
+                and totals['distinct_ips'] == 1 and sum(hourly['series']['opens']) == 2
+                and len(hourly['buckets']) == len(hourly['failure_reasons']) and daily['totals'] == totals
+                and empty['buckets'] == [] and invalid.status_code == 400)
+
+    def test_anomalies(self) -> bool:
+        """Teste que les accès commités alimentent le moteur d'anomalies et que son état est exposé"""
+        lock_id = f"anomalies-{int(time.time())}"
+        if not self.make_request('POST', f'/locks/{lock_id}/code'):
+            return False
+        before = self.make_request('GET', '/anomalies')
+        self.make_request('POST', f'/locks/{lock_id}/access', json={"event": "door_close", "code": "_LBE_"})
+        after = self.make_request('GET', f'/locks/{lock_id}/anomalies')
+        unknown = self.session.get(f"{BASE_URL}/locks/inconnu-{lock_id}/anomalies", timeout=REQUEST_TIMEOUT)
+        if not before or not after or unknown.status_code != 404:
+            return False
+        if not after['enabled']:
+            return after['engine'] in ("numpy", "python")
+        # L'accès est en file ou déjà versé dans la fenêtre si la tâche est passée entre-temps
+        return (after['pending'] + after['window_events'] == before['pending'] + before['window_events'] + 1
+                and all(finding['lock_id'] == lock_id for finding in after['findings']))
+
+    def test_alert_coalescing(self) -> bool:
+        """Teste le repli des alertes répétées (même type, source, sévérité) sur l'alerte ouverte, y compris en rafale"""
+        lock_id = f"coalesce-{int(time.time())}"
+        if not self.make_request('POST', f'/locks/{lock_id}/code'):
+            return False
+        payload = {"type": "force_attempt", "message": "3 codes invalides", "severity": "high"}
+        first = self.session.post(f"{BASE_URL}/locks/{lock_id}/alert", json=payload, timeout=REQUEST_TIMEOUT)
+        if first.status_code != 201:
+            return False
+        alert_id = first.json()['alert_id']
+
+        def repeat(_: int) -> Optional[int]:
+            try:
+                response = requests.post(f"{BASE_URL}/locks/{lock_id}/alert", json=payload, timeout=REQUEST_TIMEOUT,
+                                         headers={'User-Agent': TEST_AGENT})
+                return response.json().get('alert_id') if response.status_code == 200 else None
+            except (RequestException, ValueError):
+                return None
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            repeated = list(pool.map(repeat, range(10)))
+        other = self.make_request('POST', f'/locks/{lock_id}/alert', json=dict(payload, severity="low"))
+        alerts = self.make_request('GET', f'/locks/{lock_id}/alerts')
+        aggregates = self.make_request('GET', f'/locks/{lock_id}/aggregates')
+        if not other or not alerts or not aggregates or repeated != [alert_id] * 10 or other['alert_id'] == alert_id:
+            return False
+        coalesced = next((a for a in alerts['alerts'] if a['id'] == alert_id), {})
+        if (len(alerts['alerts']) != 2 or coalesced.get('count') != 11 or coalesced['first_seen'] > coalesced['last_seen']
+                or aggregates['alerts_total'] != 2 or aggregates['unresolved_alerts'] != 2):
+            return False
+        # Une fois résolue, l'alerte n'absorbe plus les répétitions: la suivante en ouvre une nouvelle
+        self.make_request('POST', f'/locks/{lock_id}/alert/{alert_id}/resolve')
+        reopened = self.session.post(f"{BASE_URL}/locks/{lock_id}/alert", json=payload, timeout=REQUEST_TIMEOUT)
+        return reopened.status_code == 201 and reopened.json()['alert_id'] not in (alert_id, other['alert_id'])
+
+    def test_notifications(self) -> bool:
+        """Teste l'état des notifications sortantes (livraison en processus: voir test_notify.py)"""
+        status = self.make_request('GET', '/notifications')
+        return (bool(status) and isinstance(status.get('targets'), list) and isinstance(status.get('enabled'), bool)
+                and status.get('min_severity') in ("low", "medium", "high", "critical"))
+
     def generate_report(self) -> Dict:
         """Génère un rapport de test"""
         total = len(self.test_results)
@@ -227,13 +681,235 @@ class APITester:
         }
 
 
+def percentile(samples: List[float], q: float) -> float:
+    """Percentile au rang le plus proche d'une liste triée"""
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, int(round(q / 100 * len(samples))) - 1))]
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """"polling=60,dashboard=20" -> {"polling": 60, "dashboard": 20}"""
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in LoadTester.SCENARIOS:
+            raise ValueError(f"Scénario inconnu: {name} (disponibles: {', '.join(LoadTester.SCENARIOS)})")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+class LoadTester:
+    """Banc de charge concurrent: `concurrency` clients simulés tirent des scénarios selon `mix`.
+
+    Chaque client a sa propre session HTTP et ses propres cadenas pour les scénarios qui
+    écrivent (un cycle de porte ou une attaque ne perturbe pas les autres clients); les
+    lectures (sondage des cadenas, tableau de bord) visent le cadenas par défaut, celui
+    qui porte le jeu de données. Chaque requête est chronométrée et rangée sous son scénario.
+
+    En processus, clients et serveur partagent le GIL: les chiffres servent à comparer deux
+    versions sur la même machine, pas à dimensionner (--remote contre un serveur de production).
+    """
+
+    SCENARIOS = ("polling", "dashboard", "door_cycle", "bruteforce")
+    DASHBOARD_ENDPOINTS = (('/logs', {'per_page': 50}), ('/alerts', {}), ('/aggregates', {}), ('/version', {}))
+
+    def __init__(self, base_url: str, concurrency: int, mix: Dict[str, int], duration: float,
+                 max_requests: Optional[int] = None, seed: Optional[int] = None):
+        self.base_url = base_url
+        self.concurrency = max(1, concurrency)
+        self.mix = mix
+        self.duration = duration
+        self.max_requests = max_requests
+        self.seed = seed
+        self.run_tag = f"load-{int(time.time())}"
+        self._issued = itertools.count()
+        self._samples: Dict[str, List[float]] = {name: [] for name in mix}
+        self._statuses: Dict[str, Dict[str, int]] = {name: {} for name in mix}
+        self._lock = threading.Lock()
+
+    def _request(self, session: requests.Session, scenario: str, method: str, endpoint: str,
+                 **kwargs) -> Optional[requests.Response]:
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, f"{self.base_url}{endpoint}", **kwargs)
+            status = str(response.status_code)
+        except RequestException as e:
+            logger.debug("Erreur de requête (%s): %s", scenario, e)
+            response, status = None, "erreur"
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._samples[scenario].append(elapsed)
+            self._statuses[scenario][status] = self._statuses[scenario].get(status, 0) + 1
+        return response
+
+    def _polling(self, session: requests.Session, state: Dict[str, Any], rng: random.Random) -> None:
+        """Cadenas qui sonde son code, avec If-None-Match comme le firmware (304 si rien n'a changé)"""
+        headers = {'If-None-Match': state['etag']} if state.get('etag') else {}
+        response = self._request(session, "polling", 'GET', '/code', headers=headers)
+        if response is not None and response.headers.get('ETag'):
+            state['etag'] = response.headers['ETag']
+
+    def _dashboard(self, session: requests.Session, state: Dict[str, Any], rng: random.Random) -> None:
+        endpoint, params = rng.choice(self.DASHBOARD_ENDPOINTS)
+        self._request(session, "dashboard", 'GET', endpoint, params=params)
+
+    def _door_cycle(self, session: requests.Session, state: Dict[str, Any], rng: random.Random) -> None:
+        """Nouveau code, ouverture puis fermeture sur le cadenas propre au client"""
+        lock = f"/locks/{state['lock_id']}"
+        response = self._request(session, "door_cycle", 'POST', f'{lock}/code')
+        if response is None or not response.ok:
+            return
+        code = response.json()['code']
+        for event in ("door_open", "door_close"):
+            self._request(session, "door_cycle", 'POST', f'{lock}/access', json={"event": event, "code": code})
+
+    def _bruteforce(self, session: requests.Session, state: Dict[str, Any], rng: random.Random) -> None:
+        """Codes au hasard: échecs puis 429 une fois la source bloquée"""
+        code = f"{rng.randrange(10 ** 4):04d}"
+        self._request(session, "bruteforce", 'POST', f"/locks/{state['brute_lock_id']}/access",
+                      json={"event": "door_open", "code": code})
+
+    def _worker(self, index: int, deadline: float) -> None:
+        session = requests.Session()
+        session.headers.update({'User-Agent': f"{TEST_AGENT} load-{index}"})
+        rng = random.Random(None if self.seed is None else self.seed + index)
+        state = {"lock_id": f"{self.run_tag}-{index}", "brute_lock_id": f"{self.run_tag}-brute-{index}"}
+        # Un cadenas n'existe qu'après son premier code: création hors mesure
+        for lock_id in (state["lock_id"], state["brute_lock_id"]):
+            session.post(f"{self.base_url}/locks/{lock_id}/code", timeout=REQUEST_TIMEOUT)
+        scenarios: List[Callable[[requests.Session, Dict[str, Any], random.Random], None]] = [
+            getattr(self, f"_{name}") for name in self.mix]
+        weights = list(self.mix.values())
+        while time.perf_counter() < deadline:
+            # next() sur itertools.count est atomique sous le GIL: pas de verrou pour le quota global
+            if self.max_requests is not None and next(self._issued) >= self.max_requests:
+                break
+            rng.choices(scenarios, weights)[0](session, state, rng)
+        session.close()
+
+    def run(self) -> Dict[str, Any]:
+        """Lance les clients et retourne débit et latences (p50/p95/p99) par scénario et au total"""
+        # Premier chargement de l'état (lecture à froid du jeu de données) hors mesure
+        requests.get(f"{self.base_url}/code", timeout=max(REQUEST_TIMEOUT, 60))
+        started = time.perf_counter()
+        deadline = started + self.duration
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="load") as pool:
+            for future in [pool.submit(self._worker, i, deadline) for i in range(self.concurrency)]:
+                future.result()
+        elapsed = time.perf_counter() - started
+        scenarios = {name: self._summary(samples, self._statuses[name], elapsed)
+                     for name, samples in self._samples.items()}
+        return {"elapsed_s": round(elapsed, 3),
+                "total": self._summary([s for samples in self._samples.values() for s in samples],
+                                       {}, elapsed),
+                "scenarios": scenarios}
+
+    @staticmethod
+    def _summary(samples: List[float], statuses: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+        samples = sorted(samples)
+        summary: Dict[str, Any] = {
+            "requests": len(samples),
+            "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else 0.0,
+            "mean_ms": round(sum(samples) / len(samples), 3) if samples else 0.0,
+            "p50_ms": round(percentile(samples, 50), 3),
+            "p95_ms": round(percentile(samples, 95), 3),
+            "p99_ms": round(percentile(samples, 99), 3),
+            "max_ms": round(samples[-1], 3) if samples else 0.0,
+        }
+        if statuses:
+            summary["statuses"] = dict(sorted(statuses.items()))
+        return summary
+
+
+def start_local_server() -> Tuple[Any, str]:
+    """Serveur WSGI local (multi-thread, port libre) autour de l'application, dans ce processus.
+
+    Importer bench_api redirige d'abord codes.json, les cadenas et app.log vers un répertoire
+    temporaire: le banc ne touche jamais l'état de travail.
+    """
+    from werkzeug.serving import WSGIRequestHandler, make_server  # pylint: disable=import-outside-toplevel
+    import bench_api  # pylint: disable=import-outside-toplevel
+
+    class KeepAliveHandler(WSGIRequestHandler):
+        # HTTP/1.1: les sessions réutilisent leur connexion comme derrière un vrai serveur
+        protocol_version = "HTTP/1.1"
+
+    server = make_server('127.0.0.1', 0, bench_api.api.app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, name="load-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api"
+
+
+def run_load(args: argparse.Namespace) -> int:
+    """Banc de charge: un passage par taille de jeu de données, rapport JSON sur la sortie standard"""
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        print_colored(str(e), Colors.RED)
+        return 1
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    server = None
+    if args.remote:
+        base_url = BASE_URL
+        # Le jeu de données d'un serveur distant ne peut pas être préparé d'ici
+        sizes = [None]
+    else:
+        server, base_url = start_local_server()
+        import bench_api  # pylint: disable=import-outside-toplevel
+        from storage import STORAGE_BACKEND  # pylint: disable=import-outside-toplevel
+        if STORAGE_BACKEND != "json":
+            # bench_api.write_dataset écrit directement le fichier JSON du cadenas par défaut
+            print_colored("Le banc en processus prépare ses jeux de données avec STORAGE_BACKEND=json", Colors.RED)
+            server.shutdown()
+            return 1
+
+    results = []
+    try:
+        for size in sizes:
+            if size is not None:
+                bench_api.write_dataset(bench_api.build_dataset(size))
+            tester = LoadTester(base_url, args.concurrency, mix, args.duration, args.requests, args.seed)
+            result = tester.run()
+            results.append(dict({"logs": size}, **result))
+            logger.info("%s logs: %s req/s, p99 %s ms", size, result['total']['throughput_rps'], result['total']['p99_ms'])
+    finally:
+        if server is not None:
+            server.shutdown()
+            shutil.rmtree(bench_api.WORK_DIR, ignore_errors=True)
+
+    report = {"benchmark": "load",
+              "config": {"base_url": base_url, "in_process": server is not None, "concurrency": args.concurrency,
+                         "duration_s": args.duration, "max_requests": args.requests, "mix": mix, "seed": args.seed},
+              "results": results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + "\n")
+    print(output)
+    return 0
+
+
 def main():
     """Point d'entrée principal"""
     parser = argparse.ArgumentParser(description='Testeur API SmartCadenas')
     parser.add_argument('--list', action='store_true', help='Lister les tests disponibles')
     parser.add_argument('--test', type=str, help='Exécuter un test spécifique')
+    load = parser.add_argument_group('banc de charge')
+    load.add_argument('--load', action='store_true', help='Banc de charge concurrent au lieu des tests fonctionnels')
+    load.add_argument('--remote', action='store_true', help=f'Viser le serveur de API_BASE_URL ({BASE_URL}) au lieu de l\'application en processus')
+    load.add_argument('--concurrency', type=int, default=8, help='Clients simultanés')
+    load.add_argument('--duration', type=float, default=10.0, help='Durée de chaque passage (secondes)')
+    load.add_argument('--requests', type=int, help='Arrêter après ce nombre de scénarios (en plus de --duration)')
+    load.add_argument('--mix', type=str, default=DEFAULT_LOAD_MIX, help='Scénarios et poids: ' + ', '.join(LoadTester.SCENARIOS))
+    load.add_argument('--sizes', type=str, default="1000,100000", help='Logs du cadenas par défaut, un passage par taille')
+    load.add_argument('--seed', type=int, help='Graine des tirages (passages reproductibles)')
+    load.add_argument('--output', type=str, help='Écrire aussi le rapport JSON dans ce fichier')
     args = parser.parse_args()
 
+    if args.load:
+        return run_load(args)
+
     tester = APITester()
 
     if args.list:
@@ -242,7 +918,10 @@ def main():
             "server_health", "code_generation", "code_validation",
             "access_success", "door_close", "access_fail",
             "invalidate_code", "error_reason", "multiple_failures",
-            "create_alert", "get_logs", "get_alerts"
+            "create_alert", "get_logs", "get_alerts", "logs_cursor", "lock_fleet",
+            "access_batch", "event_stream", "etag_version",
+            "bruteforce_lockout", "aggregates", "bulk_resolve", "log_archive", "export", "log_filters", "metrics", "code_verify", "offline_codes",
+            "concurrent_writes", "stats", "anomalies", "alert_coalescing", "notifications"
         ]
         for test in tests:
             print(f"  - {test}")
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Tests en processus des notifications sortantes (notify.py), contre un webhook local.
+
+Contrairement à test_api.py (client HTTP d'un serveur distant), ces tests importent le module du
+serveur: python -m unittest test_notify (ou pytest test_notify.py).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import storage
+from notify import Notifier, WebhookTarget
+from storage import JsonStorage
+
+
+class NotifierTest(unittest.TestCase):
+    """Lots, nouvel essai, disjoncteur et reprise du spool d'un Notifier vers un webhook bouchon"""
+
+    def setUp(self) -> None:
+        stub: Dict[str, Any] = {"failures": 0, "down": False, "bodies": []}
+        self.stub = stub
+
+        class StubHandler(BaseHTTPRequestHandler):
+            def do_POST(self) -> None:  # pylint: disable=invalid-name
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                failing = stub["down"] or stub["failures"] > 0
+                if failing and not stub["down"]:
+                    stub["failures"] -= 1
+                elif not failing:
+                    stub["bodies"].append(body)
+                self.send_response(503 if failing else 204)
+                self.end_headers()
+
+            def log_message(self, *args: Any) -> None:  # pylint: disable=arguments-differ
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.spool_dir = tempfile.mkdtemp(prefix="smartcadenas-notify-")
+        self.target = WebhookTarget(f"http://127.0.0.1:{self.server.server_port}/hook?token=secret")
+        self.options = {"spool_dir": self.spool_dir, "batch_size": 10, "retry_base": 0.05,
+                        "breaker_threshold": 3, "breaker_cooldown": 60}
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def notifier(self) -> Notifier:
+        notifier = Notifier([self.target], **self.options)
+        self.addCleanup(notifier.stop)
+        return notifier
+
+    @staticmethod
+    def commit(notifier: Notifier, first: int, count: int, severity: str = "high") -> None:
+        alerts = [{"id": i, "type": "force_attempt", "message": f"Alerte {i}", "severity": severity} for i in range(first, first + count)]
+        notifier.on_commit("test", {}, SimpleNamespace(new_alerts=alerts))
+
+    def delivered(self) -> List[int]:
+        return sorted(alert['id'] for body in self.stub["bodies"] for alert in body['alerts'])
+
+    def wait_state(self, notifier: Notifier, state: str, timeout: float = 5) -> Dict[str, Any]:
+        deadline = time.time() + timeout
+        while notifier.stats()['targets'][0]['state'] != state and time.time() < deadline:
+            time.sleep(0.05)
+        return notifier.stats()['targets'][0]
+
+    def test_batches_and_retries(self) -> None:
+        """Déposées avant le démarrage: lots de 10 après deux échecs, les alertes "low" sont ignorées"""
+        self.stub["failures"] = 2
+        notifier = self.notifier()
+        self.commit(notifier, 0, 25)
+        self.commit(notifier, 100, 5, "low")
+        notifier.start()
+        self.assertTrue(notifier.flush(10))
+        self.assertEqual(self.delivered(), list(range(25)))
+        self.assertEqual(len(self.stub["bodies"]), 3)
+        self.assertEqual(notifier.stats()['targets'][0]['failures'], 2)
+
+    def test_breaker_and_spool_replay(self) -> None:
+        """Destination hors service: le disjoncteur s'ouvre, les alertes survivent à l'arrêt dans le spool"""
+        self.stub["down"] = True
+        notifier = self.notifier()
+        notifier.start()
+        self.commit(notifier, 200, 5)
+        opened = self.wait_state(notifier, 'open')
+        notifier.stop()
+        self.assertEqual(opened['state'], 'open')
+        self.assertEqual(opened['pending'], 5)
+        self.assertNotIn('secret', opened['target'])
+
+        self.stub["down"] = False
+        restarted = self.notifier()
+        restarted.start()
+        self.assertTrue(restarted.flush(10))
+        self.assertEqual(self.delivered(), list(range(200, 205)))
+        restarted.stop()
+        # Tout est acquitté: un nouveau démarrage ne renvoie rien
+        again = self.notifier()
+        again.start()
+        self.assertEqual(again.stats()['targets'][0]['pending'], 0)
+        self.assertEqual(len(self.stub["bodies"]), 1)
+
+    def test_only_committing_worker_queues_alert(self) -> None:
+        """Deux workers sur le même fichier: l'alerte n'est déposée qu'au commit qui l'écrit, pas à la relecture"""
+        notifier = self.notifier()
+        storage.add_commit_listener(notifier.on_commit)
+        self.addCleanup(storage._commit_listeners.remove, notifier.on_commit)  # pylint: disable=protected-access
+        path = os.path.join(self.spool_dir, "codes.json")
+        writer, other = JsonStorage(path), JsonStorage(path)
+        writer.initialize()
+        with writer.transaction() as tx:
+            tx.add_alert({"type": "force_attempt", "message": "Alerte", "severity": "high", "source": "10.0.0.1"})
+        with other.transaction() as tx:
+            tx.append_log({"event": "door_close", "timestamp": "2026-10-01T08:00:00", "status": "success"})
+        self.assertEqual(len(other.read_state()["alerts"]), 1)
+        self.assertEqual(notifier.stats()["queued"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Tests en processus des backends fichiers: reprise après arrêt brutal, instantané + rejeu, compaction
+et coût d'écriture par événement du journal (storage.JournalStorage); démarrage d'un worker pendant
+les commits d'un autre (storage.JsonStorage).
+
+Un redémarrage est simulé par une nouvelle instance sur les mêmes fichiers, l'ancienne étant
+abandonnée sans arrêt propre: python -m unittest test_storage (ou pytest test_storage.py).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from typing import List
+
+from storage import JournalStorage, JsonStorage
+
+START = datetime(2026, 10, 1, 8, 0, 0)
+
+
+class JournalStorageTest(unittest.TestCase):
+    """Aucune entrée perdue ni rejouée deux fois, quel que soit le moment de l'arrêt"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix="smartcadenas-journal-")
+        self.path = os.path.join(self.directory, "codes.json")
+        self.journal_path = f"{self.path}.journal"
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open_store(self, compact_threshold: int = 100000, initialize: bool = True) -> JournalStorage:
+        """Nouvelle instance; initialize() compacte au démarrage, load() seul garde le journal rejoué"""
+        store = JournalStorage(self.path, journal_path=self.journal_path, compact_threshold=compact_threshold)
+        if initialize: store.initialize()
+        else: store.load()
+        return store
+
+    @staticmethod
+    def write_events(store: JournalStorage, first: int, count: int) -> None:
+        for n in range(first, first + count):
+            with store.transaction() as tx:
+                tx.append_log({"event": "door_open", "timestamp": (START + timedelta(seconds=n)).isoformat(),
+                               "ip_address": "10.0.0.1", "agent": "test", "status": "success", "n": n})
+
+    @staticmethod
+    def events(store: JournalStorage) -> List[int]:
+        return [entry["n"] for entry in store.read_state()["access_logs"]]
+
+    def journal_size(self) -> int:
+        return os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+
+    def test_torn_line_is_dropped_on_restart(self) -> None:
+        """Dernière ligne coupée en pleine écriture: ignorée et tronquée, les suivantes s'ajoutent proprement"""
+        store = self.open_store()
+        self.write_events(store, 0, 10)
+        intact = self.journal_size()
+        with open(self.journal_path, 'ab') as file:
+            file.write(b'{"op": "log", "entry": {"event": "door_open", "n": 99')
+
+        restarted = self.open_store(initialize=False)
+        self.assertEqual(self.events(restarted), list(range(10)))
+        self.assertEqual(self.journal_size(), intact)
+        self.write_events(restarted, 10, 5)
+        self.assertEqual(self.events(self.open_store()), list(range(15)))
+
+    def test_compaction_then_restart(self) -> None:
+        """Instantané compacté puis nouvelles mutations: le redémarrage relit l'instantané et rejoue la suite"""
+        store = self.open_store()
+        self.write_events(store, 0, 20)
+        store.compact()
+        self.assertEqual(self.journal_size(), 0)
+        with open(self.path, encoding='utf-8') as file: self.assertGreater(json.load(file)["journal_seq"], 0)
+        self.write_events(store, 20, 10)
+        self.assertEqual(self.events(self.open_store()), list(range(30)))
+
+    def test_crash_between_snapshot_and_truncate(self) -> None:
+        """Instantané écrit mais journal pas encore vidé: journal_seq empêche le double rejeu"""
+        store = self.open_store()
+        self.write_events(store, 0, 10)
+        with open(self.journal_path, 'rb') as file: journal = file.read()
+        store.compact()
+        with open(self.journal_path, 'wb') as file: file.write(journal)
+
+        restarted = self.open_store(initialize=False)
+        self.assertEqual(self.events(restarted), list(range(10)))
+        self.write_events(restarted, 10, 5)
+        self.assertEqual(self.events(self.open_store(initialize=False)), list(range(15)))
+
+    def test_threshold_compaction_in_background(self) -> None:
+        """Au-delà du seuil, la compaction tourne dans un thread sans perdre les commits qui la suivent"""
+        store = self.open_store(compact_threshold=20)
+        self.write_events(store, 0, 50)
+        deadline = time.time() + 5
+        while store._compacting and time.time() < deadline:  # pylint: disable=protected-access
+            time.sleep(0.01)
+        with open(self.path, encoding='utf-8') as file: self.assertGreater(json.load(file).get("journal_seq", 0), 0)
+        self.write_events(store, 50, 5)
+        self.assertEqual(self.events(self.open_store(compact_threshold=20)), list(range(55)))
+
+    def test_append_cost_does_not_grow_with_history(self) -> None:
+        """Octets ajoutés au journal par événement: les mêmes après 10 et après 500 événements"""
+        store = self.open_store()
+        self.write_events(store, 0, 10)
+        before = self.journal_size(); self.write_events(store, 10, 1); early = self.journal_size() - before
+        self.write_events(store, 11, 489)
+        before = self.journal_size(); self.write_events(store, 500, 1); late = self.journal_size() - before
+        self.assertLess(abs(late - early), early * 0.2)
+
+
+
+class JsonStorageTest(unittest.TestCase):
+    """initialize() d'un worker qui démarre ne doit ni réécrire un fichier à jour ni écraser les commits des autres"""
+
+    def setUp(self) -> None:
+        self.directory = tempfile.mkdtemp(prefix="smartcadenas-json-")
+        self.path = os.path.join(self.directory, "codes.json")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_initialize_leaves_up_to_date_file_alone(self) -> None:
+        JsonStorage(self.path).initialize()
+        before = os.stat(self.path).st_mtime_ns
+        JsonStorage(self.path).initialize()
+        self.assertEqual(os.stat(self.path).st_mtime_ns, before)
+
+    def test_initialize_during_commits_loses_nothing(self) -> None:
+        writer = JsonStorage(self.path); writer.initialize()
+
+        def write() -> None:
+            for n in range(300):
+                with writer.transaction() as tx:
+                    tx.append_log({"event": "door_open", "timestamp": (START + timedelta(seconds=n)).isoformat(),
+                                   "status": "success", "n": n})
+
+        thread = threading.Thread(target=write); thread.start()
+        while thread.is_alive(): JsonStorage(self.path).initialize()
+        thread.join()
+        with open(self.path, encoding='utf-8') as file:
+            self.assertEqual([entry["n"] for entry in json.load(file)["access_logs"]], list(range(300)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,23 @@
+"""
+Point d'entrée WSGI de SmartCadenas pour la production:
+
+    gunicorn -k gthread -w 4 --threads 64 -b 0.0.0.0:5000 wsgi:app
+
+Workers à threads (gthread) ou asynchrones (-k gevent), jamais les workers sync par défaut: chaque flux
+/api/events ouvert par un tableau de bord occupe un thread tant qu'il reste connecté, un worker sync
+entier. --threads doit dépasser SSE_MAX_CLIENTS (flux admis par worker, 50 par défaut) pour laisser
+des threads aux requêtes des cadenas.
+
+Chaque worker importe ce module: il initialise le stockage puis démarre ses tâches de fond
+(planificateur et envoi des notifications, voir api.start_background_jobs). Sans --preload:
+importé dans le processus maître avant le fork, les threads de fond ne passeraient pas aux workers.
+Le limiteur anti force brute reste par worker: jusqu'à -w × max_attempts échecs par source.
+"""
+
+from api import app, start_background_jobs
+from storage import get_storage
+
+get_storage().initialize()
+start_background_jobs()
+
+__all__ = ["app"]